@@ -109,6 +109,7 @@ class Window(QMainWindow, Ui_MainWindow):
         # scan robots on startup
         robot_client.set_robot_model("elmo")
         self.client = None
+        self.leds_stream = None
         self.scan_network.clicked.connect(self.scan_robots)
         self.reboot.clicked.connect(self.do_reboot)
         self.shutdown.clicked.connect(self.do_shutdown)
@@ -120,6 +121,9 @@ class Window(QMainWindow, Ui_MainWindow):
 
     def disconnect(self):
         self.client = None
+        if self.leds_stream is not None:
+            self.leds_stream.close()
+            self.leds_stream = None
         QMessageBox.warning(self, "Disconnect", "Connection to robot lost!")
         self.scan_robots()
 
@@ -154,6 +158,9 @@ class Window(QMainWindow, Ui_MainWindow):
                 self.client.send_command("shutdown")
 
     def connect(self, address):
+        if self.leds_stream is not None:
+            self.leds_stream.close()
+            self.leds_stream = None
         success, message, self.client = robot_client.connect(address)
         if success:
             self.client.on_error = self.log
@@ -177,7 +184,10 @@ class Window(QMainWindow, Ui_MainWindow):
         # mirror leds horizontally
         # leds = [leds[i:i+13][::-1] for i in range(0, len(leds), 13)]
 
-        self.client.send_command("update_leds", colors=leds)
+        # stream the frame over udp, opened on first use, once the status reported the stream port
+        if self.leds_stream is None:
+            self.leds_stream = self.client.stream_leds()
+        self.leds_stream.send(leds)
 
     def initialize_leds(self):
         self.icon_list = []
@@ -214,10 +224,12 @@ class Window(QMainWindow, Ui_MainWindow):
                     palette = led.palette()
                     palette.setColor(self.backgroundRole(), QColor(self.leds_r.value(), self.leds_g.value(), self.leds_b.value()))
                     led.setPalette(palette)
+                    self.send_colors()
                 elif self.is_clearing:
                     palette = led.palette()
                     palette.setColor(self.backgroundRole(), Qt.black)
                     led.setPalette(palette)
+                    self.send_colors()
             return f
         for row in range(13):
             for col in range(13):
@@ -1,4 +1,6 @@
 import socket
+import struct
+import time
 import netifaces
 import requests
 import threading
@@ -67,6 +69,116 @@ def connect(address):
 
 MAX_ERROR_COUNT = 5
 
+# leds stream protocol, see stream_leds in robot_api.py
+LEDS_STREAM_PORT = 5001
+STREAM_HEADER = struct.Struct("!4sId")
+STREAM_MAGIC = b"LEDS"
+STREAM_ACK_MAGIC = b"LACK"
+STREAM_FPS = 30.0
+# the last frame is sent again if it is not acknowledged in time, as frames are not resent otherwise
+STREAM_RESEND_TIMEOUT = 0.2
+STREAM_MAX_RESENDS = 3
+
+
+class FrameStream:
+    """
+    Stream leds frames to the robot over udp.
+    Frames are sent at most max_fps times per second, only the latest frame waiting is sent.
+    Every frame is acknowledged by the robot, and the round trip times are reported by stats.
+    """
+
+    def __init__(self, ip, port=LEDS_STREAM_PORT, max_fps=STREAM_FPS):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect((ip, port))
+        self.sock.settimeout(0.02)
+        self.period = 1.0 / max_fps
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.pending = None
+        self.last = None
+        self.last_seq = None
+        self.last_time = 0.0
+        self.resends = 0
+        self.next_time = 0.0
+        self.sent_times = {}
+        self.counters = {"sent": 0, "acked": 0, "resent": 0}
+        self.rtts = []
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, colors):
+        """
+        Send a list of 169 (r, g, b) colors, in the order of the leds.
+        """
+        data = bytes(max(0, min(255, int(c))) for color in colors for c in color)
+        with self.lock:
+            self.pending = data
+            if time.monotonic() >= self.next_time:
+                self.transmit()
+
+    def transmit(self):
+        now = time.monotonic()
+        data = self.pending if self.pending is not None else self.last
+        self.seq = (self.seq + 1) % 2 ** 32
+        try:
+            self.sock.send(STREAM_HEADER.pack(STREAM_MAGIC, self.seq, now) + data)
+        except OSError as e:
+            print(e)
+        if self.pending is None:
+            self.resends += 1
+            self.counters["resent"] += 1
+        else:
+            self.resends = 0
+        self.counters["sent"] += 1
+        self.sent_times[self.seq] = now
+        self.pending = None
+        self.last = data
+        self.last_seq = self.seq
+        self.last_time = now
+        self.next_time = now + self.period
+
+    def run(self):
+        while self.running:
+            try:
+                ack = self.sock.recv(STREAM_HEADER.size)
+                magic, seq, sent = STREAM_HEADER.unpack(ack)
+                if magic == STREAM_ACK_MAGIC:
+                    with self.lock:
+                        if self.sent_times.pop(seq, None) is not None:
+                            self.counters["acked"] += 1
+                            self.rtts = self.rtts[-99:] + [time.monotonic() - sent]
+                        if seq == self.last_seq:
+                            self.last_seq = None
+            except (OSError, struct.error):
+                pass
+            with self.lock:
+                now = time.monotonic()
+                if self.pending is not None and now >= self.next_time:
+                    self.transmit()
+                elif (self.last_seq is not None and self.resends < STREAM_MAX_RESENDS
+                        and now - self.last_time > STREAM_RESEND_TIMEOUT):
+                    self.transmit()
+                # forget frames that were never acknowledged
+                for seq in [k for k, t in self.sent_times.items() if now - t > 1.0]:
+                    del self.sent_times[seq]
+
+    def stats(self):
+        """
+        Frames sent, acknowledged and resent, and round trip times in milliseconds, of the last 100 frames.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            if self.rtts:
+                stats["rtt_ms"] = 1000.0 * sum(self.rtts) / len(self.rtts)
+                stats["rtt_max_ms"] = 1000.0 * max(self.rtts)
+            return stats
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
 
 class Robot:
     error_count = 0
@@ -99,6 +211,12 @@ class Robot:
         except Exception as e:
             print(e)
 
+    def stream_leds(self, max_fps=STREAM_FPS):
+        """
+        Open a FrameStream to the leds of the robot.
+        """
+        return FrameStream(self.ip, getattr(self, "leds_stream_port", LEDS_STREAM_PORT), max_fps)
+
     def on_error(self, message):
         print("Error: " + message)
 
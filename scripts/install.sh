@@ -14,11 +14,16 @@ pip install redis
 sudo apt install python-pip -y
 sudo pip install rpi_ws281x adafruit-circuitpython-neopixel
 
+# Audio engine
+sudo apt install libasound2-dev -y
+pip install pyalsaaudio
+
 # Chromium browser
 sudo apt install chromium-browser -y
 
 # TTS
+sudo apt install espeak-ng -y
 python3 -m pip install gTTS
-sudo apt install mpg123
+sudo apt install mpg123 ffmpeg -y
 
 
@@ -18,6 +18,7 @@ sudo /usr/bin/python driver_leds.py &
 /usr/bin/python driver_touch_sensors.py &
 /usr/bin/python driver_microphone.py &
 /usr/bin/python driver_speech.py &
+/usr/bin/python driver_keywords.py &
 
 /usr/bin/python http_server.py &
 /usr/bin/python robot_api.py &
@@ -0,0 +1,331 @@
+#! /usr/bin/env python
+
+
+"""
+
+Audio capture.
+
+The microphone driver captures audio continuously, in frames of 20 ms (16 bit, mono, 16 kHz),
+into an AudioRing: a ring buffer in shared memory, that other nodes read without copying audio through redis.
+
+Each frame is stored with the time it was captured, its RMS level, and whether a VoiceDetector heard voice in it.
+
+Frames are read from an AlsaSource on the robot, or from a FileSource that plays a WAV file, for tests.
+
+Uses the pyalsaaudio library for the AlsaSource.
+
+"""
+
+
+import struct
+import threading
+import time
+import wave
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import audio_engine
+
+try:
+    import alsaaudio
+except ImportError:
+    alsaaudio = None
+
+
+RATE = 16000
+# 320 samples are 20 ms at 16 kHz
+FRAME_SAMPLES = 320
+# 10 seconds of audio
+RING_FRAMES = 500
+RING_NAME = "elmo_microphone"
+
+# magic, rate, samples per frame, frames, frames written
+RING_HEADER = struct.Struct("<4sIIIQ")
+RING_MAGIC = b"RING"
+# level of a silent frame, in dB full scale
+SILENCE_DB = -96.0
+
+
+def frame_level(frame):
+    """
+    RMS level of a frame, in dB full scale.
+    """
+    samples = frame.astype(np.float32)
+    rms = float(np.sqrt(np.mean(samples * samples)))
+    if rms == 0.0:
+        return SILENCE_DB
+    return max(SILENCE_DB, 20.0 * np.log10(rms / 32768.0))
+
+
+class AudioRing:
+
+    """
+    AudioRing class.
+    Ring buffer of fixed-size audio frames, in shared memory, written by one process and read by any.
+    Use create in the writer, and attach in the readers.
+    Frames are numbered from 0, and frame n is kept in slot n % frames until it is overwritten.
+    The header holds the number of frames written, updated after each frame.
+    """
+
+    def __init__(self, memory, owner):
+        self.memory = memory
+        self.owner = owner
+        magic, self.rate, self.frame_samples, self.frames, _ = RING_HEADER.unpack_from(memory.buf)
+        if magic != RING_MAGIC:
+            raise ValueError("not an audio ring")
+        offset = RING_HEADER.size
+        self.times = np.ndarray((self.frames,), np.float64, memory.buf, offset)
+        offset += self.times.nbytes
+        self.levels = np.ndarray((self.frames,), np.float32, memory.buf, offset)
+        offset += self.levels.nbytes
+        self.voice = np.ndarray((self.frames,), np.bool_, memory.buf, offset)
+        offset += self.voice.nbytes
+        self.samples = np.ndarray((self.frames, self.frame_samples), np.int16, memory.buf, offset)
+
+    @staticmethod
+    def size(frames, frame_samples):
+        return RING_HEADER.size + frames * (8 + 4 + 1 + 2 * frame_samples)
+
+    @classmethod
+    def create(cls, name=RING_NAME, frames=RING_FRAMES, frame_samples=FRAME_SAMPLES, rate=RATE):
+        """
+        Create the ring, replacing a ring left by a writer that did not close it.
+        """
+        try:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        memory = shared_memory.SharedMemory(name, create=True, size=cls.size(frames, frame_samples))
+        RING_HEADER.pack_into(memory.buf, 0, RING_MAGIC, rate, frame_samples, frames, 0)
+        return cls(memory, True)
+
+    @classmethod
+    def attach(cls, name=RING_NAME):
+        """
+        Attach to a ring created by another process.
+        Raises FileNotFoundError if the ring does not exist.
+        """
+        memory = shared_memory.SharedMemory(name)
+        # the writer owns the memory, readers must not unlink it when they exit
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return cls(memory, False)
+
+    def written(self):
+        """
+        Number of frames written.
+        """
+        return RING_HEADER.unpack_from(self.memory.buf)[4]
+
+    def write(self, frame, t, level, voice):
+        n = self.written()
+        slot = n % self.frames
+        self.samples[slot] = frame
+        self.times[slot] = t
+        self.levels[slot] = level
+        self.voice[slot] = voice
+        struct.pack_into("<Q", self.memory.buf, RING_HEADER.size - 8, n + 1)
+
+    def read(self, start, count=None):
+        """
+        Read frames from frame number start, up to count frames, or all the frames written.
+        Frames that were overwritten are skipped.
+        Returns the number of the first frame read, and copies of the samples, times, levels and voice of the frames.
+        """
+        end = self.written()
+        start = max(start, end - self.frames + 1)
+        if count is not None:
+            end = min(end, start + count)
+        slots = np.arange(start, end) % self.frames
+        frames = (self.samples[slots], self.times[slots], self.levels[slots], self.voice[slots])
+        # the writer may have overwritten the first slot while it was copied
+        if self.written() - start >= self.frames:
+            return self.read(start + 1, count)
+        return start, frames
+
+    def close(self):
+        # views of the memory must be released before it is closed
+        self.times = self.levels = self.voice = self.samples = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class RingReader:
+
+    """
+    RingReader class.
+    Reads the frames of an AudioRing in order, from the frames written when it is created.
+    Use read to wait for new frames, and count dropped frames that were overwritten before they were read.
+    """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.next = ring.written()
+        self.dropped = 0
+        # half a frame
+        self.poll = ring.frame_samples / ring.rate / 2
+
+    def read(self, timeout=1.0):
+        """
+        Wait for new frames, up to timeout seconds.
+        Returns the samples, times, levels and voice of the new frames, which may be empty.
+        """
+        deadline = time.monotonic() + timeout
+        while self.ring.written() <= self.next and time.monotonic() < deadline:
+            time.sleep(self.poll)
+        start, frames = self.ring.read(self.next)
+        self.dropped += start - self.next
+        self.next = start + len(frames[0])
+        return frames
+
+
+class VoiceDetector:
+
+    """
+    VoiceDetector class.
+    Energy based voice activity detection.
+    Tracks the noise floor, falling to quieter frames at once and rising slowly,
+    and detects voice in frames threshold dB above it, and above minimum dB.
+    Voice lasts hangover frames after the last loud frame, so pauses between words do not split speech.
+    """
+
+    def __init__(self, threshold=10.0, minimum=-50.0, hangover=15, rise=0.05):
+        self.threshold = threshold
+        self.minimum = minimum
+        self.hangover = hangover
+        self.rise = rise
+        self.floor = None
+        self.remaining = 0
+
+    def update(self, level):
+        """
+        Update with the level of a frame, in dB full scale.
+        Returns True if the frame is voice.
+        """
+        if self.floor is None or level < self.floor:
+            self.floor = level
+        else:
+            # in dB per frame
+            self.floor += self.rise
+        if level > self.floor + self.threshold and level > self.minimum:
+            self.remaining = self.hangover
+        elif self.remaining > 0:
+            self.remaining -= 1
+        return self.remaining > 0
+
+
+class AlsaSource:
+
+    """
+    AlsaSource class.
+    Reads frames from an ALSA capture device.
+    """
+
+    def __init__(self, device="default", frame_samples=FRAME_SAMPLES, rate=RATE):
+        if alsaaudio is None:
+            raise ImportError("couldnt find pyalsaaudio")
+        self.pcm = alsaaudio.PCM(
+            type=alsaaudio.PCM_CAPTURE,
+            mode=alsaaudio.PCM_NORMAL,
+            device=device,
+            channels=1,
+            rate=rate,
+            format=alsaaudio.PCM_FORMAT_S16_LE,
+            periodsize=frame_samples,
+        )
+        self.frame_samples = frame_samples
+        self.pending = b""
+
+    def read(self):
+        """
+        Read the next frame, an int16 array of frame_samples samples.
+        Blocks until it is captured.
+        """
+        size = 2 * self.frame_samples
+        while len(self.pending) < size:
+            length, data = self.pcm.read()
+            if length > 0:
+                self.pending += data
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return np.frombuffer(data, "<i2")
+
+    def close(self):
+        self.pcm.close()
+
+
+class FileSource:
+
+    """
+    FileSource class.
+    Reads frames from a WAV file, at the pace of a device, for tests.
+    Returns None at the end of the file, unless loop is set.
+    """
+
+    def __init__(self, path, frame_samples=FRAME_SAMPLES, rate=RATE, loop=False, realtime=True):
+        with open(path, "rb") as f:
+            pcm = audio_engine.decode_wav(f.read(), rate, 1)[:, 0]
+        # pad to whole frames
+        pcm = np.concatenate((pcm, np.zeros(-len(pcm) % frame_samples, np.int16)))
+        self.frames = pcm.reshape(-1, frame_samples)
+        self.period = frame_samples / rate
+        self.loop = loop
+        self.realtime = realtime
+        self.index = 0
+        self.due = time.monotonic()
+
+    def read(self):
+        if self.index == len(self.frames):
+            if not self.loop or not len(self.frames):
+                return None
+            self.index = 0
+        if self.realtime:
+            self.due += self.period
+            wait = self.due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                # late, do not catch up with a burst
+                self.due = time.monotonic()
+        frame = self.frames[self.index]
+        self.index += 1
+        return frame
+
+    def close(self):
+        pass
+
+
+class Recorder:
+
+    """
+    Recorder class.
+    Records the frames of an AudioRing to a WAV file, in a thread, until stop is called.
+    """
+
+    def __init__(self, ring, path):
+        self.reader = RingReader(ring)
+        self.file = wave.open(path, "wb")
+        self.file.setnchannels(1)
+        self.file.setsampwidth(2)
+        self.file.setframerate(ring.rate)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            samples, _, _, _ = self.reader.read(0.1)
+            if len(samples):
+                self.file.writeframes(samples.tobytes())
+
+    def stop(self):
+        """
+        Stop recording, and close the file.
+        Returns the number of frames that were dropped, overwritten before they were recorded.
+        """
+        self.running = False
+        self.thread.join()
+        self.file.close()
+        return self.reader.dropped
@@ -0,0 +1,447 @@
+#! /usr/bin/env python
+
+
+"""
+
+Audio engine.
+
+Plays sounds in process, on an audio device that is opened once and kept open.
+
+Sounds are decoded from WAV files to PCM buffers (16 bit, stereo, 48 kHz), cached by a SoundCache.
+CHANNELS is the number of audio channels of the buffers, channels of the mixer are named.
+
+The engine writes fixed-size blocks to a sink: an AlsaSink on the robot, or a NullSink for benchmarks and tests.
+Silence is written while nothing is playing, so a sound starts on the next block.
+
+The engine mixes the channels music, effects and speech, with a gain each.
+Music is ducked while effects or speech play, and effects are ducked while speech plays.
+Volume is applied in the mix, so it changes without touching the mixer of the audio device.
+
+Uses the pyalsaaudio library for the AlsaSink.
+
+"""
+
+
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import alsaaudio
+except ImportError:
+    alsaaudio = None
+
+
+RATE = 48000
+CHANNELS = 2
+# 256 frames are 5.3 ms at 48 kHz
+BLOCK_FRAMES = 256
+PERIODS = 4
+SOUND_CACHE_BYTES = 64 * 1024 * 1024
+
+MIXER_CHANNELS = ("effects", "music", "speech")
+DEFAULT_CHANNEL = "effects"
+# channels ducked by each channel, while it plays
+DUCKING = {
+    "music": ("effects", "speech"),
+    "effects": ("speech",),
+}
+DUCK_GAIN = 0.3
+# time for a level to ramp from 0.0 to 1.0, when the volume or a gain changes, or a channel is ducked
+RAMP_TIME = 0.1
+# range of the volume, from 1 to 100
+VOLUME_RANGE_DB = 40.0
+# RMS level of normalized sounds, in dB full scale
+NORMALIZE_LEVEL_DB = -20.0
+MAX_NORMALIZE_GAIN = 4.0
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def decode_wav(data, rate=RATE, channels=CHANNELS):
+    """
+    Decode a WAV file to a PCM buffer: an int16 array of shape (frames, channels), at rate.
+    Supports 8, 16, 24 and 32 bit integer and 32 bit float samples, with any number of channels and any rate.
+    Mono files are copied to every channel, other files keep their first channels.
+    Raises ValueError if the data is not a supported WAV file.
+    """
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("not a WAV file")
+    fmt = None
+    samples = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk, size = struct.unpack_from("<4sI", data, offset)
+        body = data[offset + 8:offset + 8 + size]
+        if chunk == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", body)
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE:
+                # the format is the first field of the sub format guid
+                fmt = (struct.unpack_from("<H", body, 24)[0],) + fmt[1:]
+        elif chunk == b"data":
+            samples = body
+        # chunks are padded to an even size
+        offset += 8 + size + (size & 1)
+    if fmt is None or samples is None:
+        raise ValueError("WAV file without format or data")
+    encoding, file_channels, file_rate, _, _, bits = fmt
+    width = bits // 8
+    samples = samples[:len(samples) - len(samples) % (width * file_channels)]
+    if encoding == WAVE_FORMAT_IEEE_FLOAT and width == 4:
+        pcm = np.clip(np.frombuffer(samples, "<f4") * 32767.0, -32768, 32767).astype(np.int16)
+    elif encoding != WAVE_FORMAT_PCM:
+        raise ValueError(f"unsupported WAV format {encoding}")
+    elif width == 1:
+        pcm = ((np.frombuffer(samples, np.uint8).astype(np.int16) - 128) << 8).astype(np.int16)
+    elif width == 2:
+        pcm = np.frombuffer(samples, "<i2")
+    elif width == 3:
+        # keep the two most significant bytes of each sample
+        pcm = np.frombuffer(samples, np.uint8).reshape(-1, 3)[:, 1:].copy().view("<i2").ravel()
+    elif width == 4:
+        pcm = (np.frombuffer(samples, "<i4") >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"unsupported WAV sample width {bits}")
+    pcm = pcm.reshape(-1, file_channels)
+    if file_channels == 1:
+        pcm = np.repeat(pcm, channels, axis=1)
+    else:
+        pcm = pcm[:, :channels]
+    if file_rate != rate and len(pcm):
+        # linear interpolation is enough for voice and effects
+        frames = int(round(len(pcm) * rate / file_rate))
+        position = np.arange(frames) * (file_rate / rate)
+        source = np.arange(len(pcm))
+        pcm = np.stack([np.interp(position, source, pcm[:, c]) for c in range(pcm.shape[1])], axis=1)
+        pcm = np.round(pcm).astype(np.int16)
+    return np.ascontiguousarray(pcm, np.int16)
+
+
+def encode_wav(sound):
+    """
+    Encode a PCM buffer, an int16 array of shape (frames, CHANNELS) at RATE, to a WAV file.
+    """
+    data = np.ascontiguousarray(sound, "<i2").tobytes()
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(data), b"WAVE",
+        b"fmt ", 16, WAVE_FORMAT_PCM, CHANNELS, RATE, RATE * CHANNELS * 2, CHANNELS * 2, 16,
+        b"data", len(data),
+    )
+    return header + data
+
+
+def volume_gain(volume):
+    """
+    Gain of a volume between 0 and 100, on a decibel scale, as mixers do. Volume 0 is silent.
+    """
+    if volume <= 0:
+        return 0.0
+    return 10.0 ** ((min(volume, 100) - 100) * VOLUME_RANGE_DB / 100.0 / 20.0)
+
+
+def normalization_gain(sound, level=NORMALIZE_LEVEL_DB):
+    """
+    Gain that brings the RMS level of a sound to level, in dB full scale.
+    Limited to MAX_NORMALIZE_GAIN, and so that the peaks of the sound do not clip.
+    """
+    if not len(sound):
+        return 1.0
+    samples = sound.astype(np.float32)
+    rms = float(np.sqrt(np.mean(samples * samples)))
+    peak = float(np.abs(samples).max())
+    if rms == 0.0:
+        return 1.0
+    gain = 10.0 ** (level / 20.0) * 32767.0 / rms
+    return min(gain, MAX_NORMALIZE_GAIN, 32767.0 / peak)
+
+
+class SoundCache:
+
+    """
+    SoundCache class.
+    LRU cache of decoded sounds, read from WAV files, with their normalization gain.
+    The cache is bounded by the size of the decoded buffers, in bytes.
+    Sounds are decoded again when the modification time of their file changes.
+    """
+
+    def __init__(self, max_bytes=SOUND_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Get the decoded sound of the file at path, and its normalization gain.
+        Raises OSError if the file can not be read, and ValueError if it can not be decoded.
+        """
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == mtime:
+                self.hits += 1
+                self.entries.move_to_end(path)
+                return entry[1], entry[2]
+            self.misses += 1
+        with open(path, "rb") as f:
+            sound = decode_wav(f.read())
+        gain = normalization_gain(sound)
+        with self.lock:
+            self.invalidate(path)
+            self.entries[path] = (mtime, sound, gain)
+            self.bytes += sound.nbytes
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+        return sound, gain
+
+    def resident(self, path):
+        """
+        Whether the current version of the file at path is decoded in the cache.
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return False
+        with self.lock:
+            entry = self.entries.get(path)
+            return entry is not None and entry[0] == mtime
+
+    def invalidate(self, path=None):
+        """
+        Drop a sound from the cache, or all sounds if no path is given.
+        """
+        if path is None:
+            self.entries.clear()
+            self.bytes = 0
+        elif path in self.entries:
+            self.bytes -= self.entries.pop(path)[1].nbytes
+
+    def stats(self):
+        return {
+            "sounds": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class AlsaSink:
+
+    """
+    AlsaSink class.
+    Writes blocks to an ALSA playback device, kept open.
+    Writes block when the device buffer, of periods blocks, is full.
+    The volume is applied by the engine, so the mixer control of the device is set to full volume once.
+    """
+
+    def __init__(self, device="default", block=BLOCK_FRAMES, periods=PERIODS, control="Master"):
+        if alsaaudio is None:
+            raise ImportError("couldnt find pyalsaaudio")
+        self.pcm = alsaaudio.PCM(
+            type=alsaaudio.PCM_PLAYBACK,
+            mode=alsaaudio.PCM_NORMAL,
+            device=device,
+            channels=CHANNELS,
+            rate=RATE,
+            format=alsaaudio.PCM_FORMAT_S16_LE,
+            periodsize=block,
+            periods=periods,
+        )
+        self.buffered = (periods - 1) * block
+        try:
+            alsaaudio.Mixer(control).setvolume(100)
+        except alsaaudio.ALSAAudioError:
+            # devices without the control are left as they are
+            pass
+
+    def write(self, block):
+        self.pcm.write(block.tobytes())
+
+    def latency(self):
+        """
+        Time until the last block written starts playing, in seconds.
+        """
+        return self.buffered / RATE
+
+    def close(self):
+        self.pcm.close()
+
+
+class NullSink:
+
+    """
+    NullSink class.
+    Discards blocks at the pace of a device with a buffer of periods blocks.
+    """
+
+    def __init__(self, block=BLOCK_FRAMES, periods=PERIODS):
+        self.buffer = periods * block / RATE
+        self.queued = 0.0
+        self.last = 0.0
+
+    def write(self, block):
+        now = time.monotonic()
+        if self.queued < now:
+            # start, or recover from an underrun
+            self.queued = now
+        self.last = len(block) / RATE
+        self.queued += self.last
+        # block while the buffer is full
+        wait = self.queued - now - self.buffer
+        if wait > 0:
+            time.sleep(wait)
+
+    def latency(self):
+        return max(0.0, self.queued - self.last - time.monotonic())
+
+    def close(self):
+        pass
+
+
+class Channel:
+
+    """
+    Channel class.
+    A channel of the mixer, playing one sound at a time.
+    level is the gain applied at the end of the last block, including the volume and ducking.
+    sound_gain is the gain of the sound being played.
+    """
+
+    def __init__(self, gain=1.0):
+        self.sound = None
+        self.tag = None
+        self.position = 0
+        self.sound_gain = 1.0
+        self.gain = gain
+        self.level = gain
+
+
+class AudioEngine:
+
+    """
+    AudioEngine class.
+    Mixes the sounds of several channels, each playing one sound at a time, on a sink.
+    A thread mixes and writes a block at a time.
+    Each channel has a gain, and is ducked to duck_gain while the channels that duck it are playing.
+    The volume, a gain, applies to all channels.
+    Levels ramp to changes of the volume, gains and ducking in RAMP_TIME.
+    Use play to replace the sound being played on a channel, and stop to stop it.
+    on_event is called from the engine thread with (event, channel, tag, t), where event is
+    "start" when the sound starts, "finish" when it ends, or "stop" when it is stopped or replaced,
+    tag is the tag given to play, and t is the time (as time.time) the event is heard.
+    """
+
+    def __init__(self, sink, on_event=None, block=BLOCK_FRAMES, channels=MIXER_CHANNELS, ducking=DUCKING):
+        self.sink = sink
+        self.on_event = on_event
+        self.block = block
+        self.channels = {name: Channel() for name in channels}
+        self.ducking = ducking
+        self.duck_gain = DUCK_GAIN
+        self.volume = 1.0
+        # largest change of level in a block
+        self.step = block / RATE / RAMP_TIME
+        self.lock = threading.Lock()
+        self.events = []
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def play(self, sound, tag=None, channel=DEFAULT_CHANNEL, gain=1.0):
+        """
+        Play a sound, an int16 array of shape (frames, CHANNELS), replacing the sound being played on the channel.
+        gain is the gain of the sound, e.g. its normalization gain.
+        """
+        with self.lock:
+            self.stop_channel(channel)
+            c = self.channels[channel]
+            c.sound = sound
+            c.tag = tag
+            c.position = 0
+            c.sound_gain = gain
+
+    def stop(self, channel=None):
+        """
+        Stop the sound being played on a channel, or on all channels if none is given.
+        """
+        with self.lock:
+            for name in [channel] if channel is not None else self.channels:
+                self.stop_channel(name)
+
+    def stop_channel(self, channel):
+        c = self.channels[channel]
+        if c.sound is not None:
+            self.events.append(("stop", channel, c.tag, 0))
+        c.sound = None
+        c.tag = None
+
+    def playing(self, channel=DEFAULT_CHANNEL):
+        """
+        Tag of the sound being played on a channel, or None.
+        """
+        return self.channels[channel].tag
+
+    def set_gain(self, channel, gain):
+        with self.lock:
+            self.channels[channel].gain = gain
+
+    def set_volume(self, volume):
+        """
+        Set the volume, a gain between 0.0 and 1.0, see volume_gain.
+        """
+        self.volume = volume
+
+    def next_block(self):
+        """
+        Mix the next block of the sounds being played, with the events it causes.
+        Events hold the offset in frames where they happen in the block.
+        Levels are ramped along the block, so gain and ducking changes do not click.
+        """
+        events = self.events
+        self.events = []
+        mix = np.zeros((self.block, CHANNELS), np.float32)
+        active = [name for name, c in self.channels.items() if c.sound is not None]
+        for name, c in self.channels.items():
+            target = c.gain * self.volume
+            if any(other in active for other in self.ducking.get(name, ())):
+                target *= self.duck_gain
+            level = c.level + max(-self.step, min(self.step, target - c.level))
+            if c.sound is not None:
+                if c.position == 0:
+                    events.append(("start", name, c.tag, 0))
+                chunk = c.sound[c.position:c.position + self.block]
+                ramp = np.linspace(c.level, level, len(chunk), endpoint=False, dtype=np.float32) * c.sound_gain
+                mix[:len(chunk)] += chunk * ramp[:, None]
+                c.position += self.block
+                if c.position >= len(c.sound):
+                    events.append(("finish", name, c.tag, len(chunk)))
+                    c.sound = None
+                    c.tag = None
+            c.level = level
+        return np.clip(mix, -32768, 32767).astype(np.int16), events
+
+    def run(self):
+        while self.running:
+            with self.lock:
+                block, events = self.next_block()
+            self.sink.write(block)
+            if events and self.on_event is not None:
+                heard = time.time() + self.sink.latency()
+                for event, channel, tag, offset in events:
+                    self.on_event(event, channel, tag, heard + offset / RATE)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sink.close()
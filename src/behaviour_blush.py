@@ -45,13 +45,11 @@ class BehaviourBlush:
         self.onboard.image = image_url
         sound_url = self.server.url_for_sound("love.wav")
         self.speakers.url = sound_url
-        icon_url = self.server.url_for_icon("heartbeat.gif")
-        self.leds.load_from_url(icon_url) 
+        self.leds.set_icon("heartbeat.gif")
         time.sleep(5.0)
         image_url = self.server.url_for_image("normal.png")
         self.onboard.image = image_url
-        icon_url = self.server.url_for_icon("elmo_idm.png")
-        self.leds.load_from_url(icon_url)
+        self.leds.set_icon("elmo_idm.png")
 
     def run(self):
         """
@@ -35,6 +35,8 @@ class ModeManager:
         self.server.wait_for_ready()
         self.gpio = mw.GPIO()
         self.node = mw.Node("behaviour_change_mode")
+        self.watcher = self.node.watch(self.gpio, "button_pressed")
+        self.behaviours.watch("change_mode", watcher=self.watcher)
         self.modes = [
             MODE_IDLE,
             MODE_MUSIC,
@@ -47,24 +49,21 @@ class ModeManager:
         Load default icon.
         """
         self.node.loginfo("idle mode")
-        url = self.server.url_for_icon("elmo_idm.png")
-        self.leds.load_from_url(url)
+        self.leds.set_icon("elmo_idm.png")
 
     def music_mode(self):
         """
         Load music icon.
         """
         self.node.loginfo("music mode")
-        url = self.server.url_for_icon("music.png")
-        self.leds.load_from_url(url)
+        self.leds.set_icon("music.png")
     
     def call_mode(self):
         """
         Load call icon.
         """
         self.node.loginfo("call mode")
-        url = self.server.url_for_icon("call.png")
-        self.leds.load_from_url(url)
+        self.leds.set_icon("call.png")
     
     def next_mode(self):
         """
@@ -93,6 +92,7 @@ class ModeManager:
             was_pressed = False
             self.next_mode()
             while not self.node.is_shutdown():
+                self.watcher.wait(1.0)
                 if not self.behaviours.change_mode:
                     continue
                 is_pressed = self.gpio.button_pressed
@@ -100,6 +100,7 @@ class ModeManager:
                     self.next_mode()
                 was_pressed = is_pressed
         finally:
+            self.watcher.close()
             self.node.shutdown()
 
 
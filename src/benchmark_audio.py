@@ -0,0 +1,69 @@
+"""
+Latency benchmark of the audio engine, on a NullSink.
+Measures the time from a play request until the sound is handed to the sink, and until it is heard,
+with cold and cached sounds, and compares it with starting a process and a shell, as the old driver did.
+Usage: python benchmark_audio.py [sound ...]
+"""
+
+import os
+import sys
+import time
+import threading
+import multiprocessing
+import numpy as np
+
+import audio_engine
+
+SOUNDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "sounds")
+DEFAULT_SOUNDS = ["simon_sounds/1.wav", "simon_sounds/correct.wav", "emotions_game/transitions/lets_go.wav"]
+REPEAT = 20
+
+
+def measure_engine(engine, events, load, path):
+    """
+    Time from the play request until the sound is handed to the sink, and until it is heard, in seconds.
+    """
+    events.clear()
+    start = time.monotonic()
+    wall = time.time()
+    engine.play(load(path), path)
+    while "start" not in events:
+        time.sleep(0.0005)
+    handed, heard = events["start"]
+    engine.stop()
+    time.sleep(0.01)
+    return handed - start, heard - wall
+
+
+def measure_process():
+    """
+    Time to start a process that runs a shell command, as the old driver did for every sound, in seconds.
+    """
+    start = time.monotonic()
+    process = multiprocessing.Process(target=os.system, args=("true",))
+    process.start()
+    process.join()
+    return time.monotonic() - start
+
+
+def summary(samples):
+    samples = 1000.0 * np.array(samples)
+    return f"{np.median(samples):7.2f}ms median {samples.max():7.2f}ms max"
+
+
+if __name__ == "__main__":
+    sounds = [os.path.join(SOUNDS_PATH, s) for s in sys.argv[1:] or DEFAULT_SOUNDS]
+    events = {}
+    def on_event(event, channel, tag, t):
+        events[event] = (time.monotonic(), t)
+    engine = audio_engine.AudioEngine(audio_engine.NullSink(), on_event)
+    for path in sounds:
+        name = os.path.relpath(path, SOUNDS_PATH)
+        cold = [measure_engine(engine, events, lambda p: audio_engine.decode_wav(open(p, "rb").read()), path) for _ in range(REPEAT)]
+        cache = audio_engine.SoundCache()
+        cached = [measure_engine(engine, events, lambda p: cache.get(p)[0], path) for _ in range(REPEAT)]
+        print(name)
+        print(f"  decode and play:  handed {summary([c[0] for c in cold])}, heard {summary([c[1] for c in cold])}")
+        print(f"  cached and play:  handed {summary([c[0] for c in cached])}, heard {summary([c[1] for c in cached])}")
+    print(f"process and shell, before any download or decoding: {summary([measure_process() for _ in range(REPEAT)])}")
+    engine.close()
@@ -0,0 +1,58 @@
+"""
+Microbenchmark of the LED icon decoder.
+Compares the original per-pixel decoding of Leds.load_from_url with middleware.decode_icon.
+Usage: python benchmark_icons.py [icon ...]
+"""
+
+import os
+import sys
+import time
+from io import BytesIO
+from PIL import Image
+import numpy as np
+
+from middleware import decode_icon
+
+ICONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "icons")
+DEFAULT_ICONS = ["emotions_game/loading_4.gif", "heartbeat.gif", "emotions_game/heart.gif", "music.png"]
+
+
+def decode_icon_per_pixel(data):
+    """
+    Original decoder: one image conversion and one getpixel per led.
+    """
+    image = Image.open(BytesIO(data))
+    frames = []
+    for i in range(getattr(image, "n_frames", 1)):
+        image.seek(i)
+        colors = []
+        for row in range(13):
+            for col in range(13):
+                im = image.convert("RGB")
+                color = im.getpixel((12 - col, row))[0:3]
+                colors.append(color)
+        frames.append(colors)
+    return frames
+
+
+def measure(function, data, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    icons = sys.argv[1:] or DEFAULT_ICONS
+    print(f"{'icon':<28} {'frames':>6} {'per pixel':>12} {'numpy':>12} {'speedup':>8}")
+    for name in icons:
+        with open(os.path.join(ICONS_PATH, name), "rb") as f:
+            data = f.read()
+        frames, durations = decode_icon(data)
+        # both decoders must agree
+        assert np.array_equal(frames, np.array(decode_icon_per_pixel(data), np.uint8))
+        old = measure(decode_icon_per_pixel, data, 3)
+        new = measure(decode_icon, data, 20)
+        print(f"{name:<28} {len(frames):>6} {old * 1000:>10.2f}ms {new * 1000:>10.2f}ms {old / new:>7.1f}x")
@@ -41,6 +41,8 @@ class DriverBattery:
         Initialize node.
         """
         self.battery = mw.Battery()
+        # raw, voltage and percentage are published together, once per loop
+        self.battery.write_behind()
         self.file_handle =  io.open("/dev/i2c-1", "rb", buffering=0)
         fcntl.ioctl(self.file_handle, I2C_SLAVE_COMMAND, self.battery.i2c_address)
         self.node = mw.Node("driver_battery")
@@ -72,6 +74,7 @@ class DriverBattery:
         """
         try:
             self.battery.ready = True
+            self.battery.flush()
             while not self.node.is_shutdown():
                 time.sleep(0.1)
                 raw = self.read_ad()
@@ -83,9 +86,12 @@ class DriverBattery:
                     self.voltage_buffer.pop(0)
                     m = np.mean(self.voltage_buffer)
                     self.battery.percentage = battery_percentage(m)
+                self.battery.flush()
         except KeyboardInterrupt:
             pass
         finally:
+            # send the writes buffered when the loop stopped
+            self.battery.flush()
             self.node.shutdown()
 
 
@@ -28,6 +28,7 @@ class DriverGpio:
         """
         self.node = mw.Node("driver_gpio")
         self.gpio = mw.GPIO()
+        self.watcher = self.node.watch(self.gpio, "audio_enable", "monitor_enable")
 
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
@@ -66,17 +67,19 @@ class DriverGpio:
         try:
             self.gpio.ready = True
             while not self.node.is_shutdown():
-                time.sleep(0.1)
-                if self.gpio.audio_enable and not self.gpio.audio_enabled:
+                # wake up on commands, but keep sampling the pins at 10 Hz
+                self.watcher.wait(0.1)
+                gpio = self.gpio.snapshot("audio_enable", "audio_enabled", "monitor_enable", "monitor_enabled")
+                if gpio["audio_enable"] and not gpio["audio_enabled"]:
                     self.enable_audio(True)
                     self.gpio.audio_enabled = True
-                elif not self.gpio.audio_enable and self.gpio.audio_enabled:
+                elif not gpio["audio_enable"] and gpio["audio_enabled"]:
                     self.enable_audio(False)
                     self.gpio.audio_enabled = False
-                if self.gpio.monitor_enable and not self.gpio.monitor_enabled:
+                if gpio["monitor_enable"] and not gpio["monitor_enabled"]:
                     self.enable_monitor(True)
                     self.gpio.monitor_enabled = True
-                elif not self.gpio.monitor_enable and self.gpio.monitor_enabled:
+                elif not gpio["monitor_enable"] and gpio["monitor_enabled"]:
                     self.enable_monitor(False)
                     self.gpio.monitor_enabled = False
                 if GPIO.input(self.gpio.button_pin):
@@ -103,6 +106,7 @@ class DriverGpio:
             self.gpio.monitor_enabled = False
             time.sleep(0.1)
             GPIO.cleanup()
+            self.watcher.close()
             self.node.shutdown()
 
 
@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+
+
+"""
+
+Driver node.
+
+This node spots keywords in the audio of the microphone, offline.
+
+Reads the frames of the microphone ring, cuts utterances with their voice activity,
+and recognizes them with a KeywordSpotter, see keyword_spotting.
+
+Recognized words are written to Onboard.speech, as the speech recognition of the onboard page does.
+
+"""
+
+
+import os
+import time
+import wave
+
+import middleware as mw
+import audio_capture
+import keyword_spotting
+import speech_synth
+
+
+RING_TIMEOUT = 2.0
+
+
+class DriverKeywords:
+
+    def __init__(self):
+        """
+        Connect to middleware.
+        Initialize node.
+        """
+        self.node = mw.Node("driver_keywords")
+        self.keywords = mw.Keywords()
+        self.onboard = mw.Onboard()
+        self.microphone = mw.Microphone()
+        self.watcher = self.node.watch(self.keywords, "vocabulary", "threshold")
+        self.ring = None
+        self.reader = None
+        self.segmenter = keyword_spotting.Segmenter()
+        self.load_templates()
+
+    def load_templates(self):
+        """
+        Load the templates of the vocabulary, rendering the words without recorded templates with espeak.
+        """
+        self.spotter = keyword_spotting.KeywordSpotter(self.keywords.vocabulary, self.keywords.threshold)
+        synthesizer = speech_synth.PhraseCache(mw.Speech().cache_path, speech_synth.Espeak())
+        missing = self.spotter.load(self.keywords.templates_path, synthesizer)
+        if missing:
+            self.node.logwarn("no templates for %s, they will not be recognized" % ", ".join(missing))
+
+    def attach(self):
+        """
+        Attach to the microphone ring, once the microphone driver created it.
+        """
+        try:
+            self.ring = audio_capture.AudioRing.attach(self.microphone.ring)
+        except (FileNotFoundError, ValueError):
+            return False
+        self.reader = audio_capture.RingReader(self.ring)
+        self.last_frame = time.monotonic()
+        return True
+
+    def detach(self):
+        self.ring.close()
+        self.ring = None
+
+    def enroll(self, word, samples):
+        """
+        Save an utterance as a template of a word.
+        """
+        folder = os.path.join(self.keywords.templates_path, word)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, "%d.wav" % int(time.time() * 1000))
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(keyword_spotting.RATE)
+            f.writeframes(samples.tobytes())
+        values = {"enrolling": None}
+        if word not in self.spotter.templates:
+            self.spotter.templates[word] = []
+            # so that the change of the vocabulary does not reload the templates
+            self.spotter.vocabulary.append(word)
+            values["vocabulary"] = self.keywords.vocabulary + [word]
+        self.spotter.add(word, samples)
+        self.keywords.update(values)
+        self.node.loginfo("enrolled %s" % path)
+
+    def recognize(self, samples, t):
+        """
+        Recognize an utterance, that ended at time t, and publish the word recognized.
+        """
+        start = time.time()
+        word, distances = self.spotter.spot(samples)
+        values = {
+            "last": {k: round(v, 2) for k, v in distances.items()},
+            "stats": {"latency": round(time.time() - t, 3), "matching": round(time.time() - start, 3)},
+        }
+        if word is not None:
+            values["detected"] = {"word": word, "distance": round(distances[word], 2), "time": t}
+        self.keywords.update(values)
+        if word is not None:
+            self.onboard.update({"speech": word, "speech_time": t})
+
+    def run(self):
+        """
+        Main loop.
+        """
+        try:
+            self.keywords.ready = True
+            while not self.node.is_shutdown():
+                if self.ring is None and not self.attach():
+                    self.watcher.wait(1.0)
+                    continue
+                samples, times, _, voice = self.reader.read(0.1)
+                if len(samples):
+                    self.last_frame = time.monotonic()
+                elif time.monotonic() - self.last_frame > RING_TIMEOUT:
+                    # the microphone driver stopped, or restarted with a new ring
+                    self.detach()
+                    continue
+                for frame, t, heard in zip(samples, times, voice):
+                    utterance = self.segmenter.push(frame, t, heard)
+                    if utterance is None:
+                        continue
+                    word = self.keywords.enrolling
+                    if word:
+                        self.enroll(word, utterance[0])
+                    else:
+                        self.recognize(*utterance)
+                changed = self.watcher.wait(0)
+                if "vocabulary" in changed and self.keywords.vocabulary != self.spotter.vocabulary:
+                    self.load_templates()
+                elif "threshold" in changed:
+                    self.spotter.threshold = self.keywords.threshold
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.watcher.close()
+            self.node.shutdown()
+            if self.ring is not None:
+                self.detach()
+
+
+if __name__ == '__main__':
+    driver = DriverKeywords()
+    driver.run()
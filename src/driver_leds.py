@@ -9,15 +9,161 @@ This node manages the neopixel matrix.
 
 Uses the neopixel library to control the leds.
 
+Animations are played by a single scheduler on the monotonic clock.
+
+Icons are read from the static folder of the http server, and kept decoded in an IconCache.
+
+Frames are clamped with numpy and written to the neopixel buffer in bulk, at most max_fps times per second.
+Frames that are replaced before they are shown are counted as dropped.
+
+Gamma correction and brightness are applied with a 256 entry lookup table, rebuilt when they change.
+
+Effects of the leds_effects module are rendered at the frame rate of the driver.
+
 """
 
 
 import time
 import board
 import neopixel
+import numpy as np
 
 
 import middleware as mw
+import leds_effects
+
+
+# used for frames without a duration, as browsers do
+DEFAULT_FRAME_DURATION = 0.1
+# channels of the neopixel buffer, for neopixel.GRB
+PIXEL_CHANNELS = [1, 0, 2]
+STATS_PERIOD = 1.0
+
+
+class AnimationPlayer:
+
+    """
+    AnimationPlayer class.
+    Plays one animation at a time, on the monotonic clock.
+    Use start to replace the animation, and advance to get the frame to show.
+    """
+
+    def __init__(self):
+        self.frames = None
+        self.dropped = 0
+
+    def playing(self):
+        return self.frames is not None
+
+    def start(self, animation, now):
+        """
+        Start playing an animation, stopping the previous one.
+        The first frame is due now.
+        """
+        self.frames = animation["frames"]
+        self.durations = [d if d > 0 else DEFAULT_FRAME_DURATION for d in animation["durations"]]
+        self.mode = animation["mode"]
+        self.index = -1
+        self.deadline = now
+        if not len(self.frames):
+            self.frames = None
+
+    def stop(self):
+        self.frames = None
+
+    def timeout(self, now):
+        """
+        Time until the next frame is due.
+        """
+        return max(0.0, self.deadline - now)
+
+    def advance(self, now):
+        """
+        Get the frame to show at time now, or None if the shown frame is still current.
+        Frames that are already over are skipped, and counted in dropped.
+        When the animation ends, stops and returns the final frame.
+        """
+        if self.frames is None or now < self.deadline:
+            return None
+        if self.mode == "loop" and now - self.deadline > sum(self.durations):
+            # too late to catch up, restart from here
+            self.deadline = now
+        skipped = -1
+        while now >= self.deadline:
+            skipped += 1
+            self.index += 1
+            if self.index == len(self.frames):
+                if self.mode == "loop":
+                    self.index = 0
+                else:
+                    self.dropped += skipped
+                    final = self.frames[-1]
+                    if self.mode == "once":
+                        final = np.zeros_like(final)
+                    self.frames = None
+                    return final
+            self.deadline += self.durations[self.index]
+        self.dropped += skipped
+        return self.frames[self.index]
+
+
+class ColorCorrection:
+
+    """
+    ColorCorrection class.
+    Maps color components to the values written to the leds, with a 256 entry lookup table.
+    Applies gamma correction, then scales by brightness.
+    Use ramp to change the brightness smoothly, calling update until it returns False.
+    """
+
+    def __init__(self, gamma, brightness):
+        self.brightness = brightness
+        self.ramp_to = None
+        self.set_gamma(gamma)
+
+    def set_gamma(self, gamma):
+        self.gamma = gamma
+        self.table = 255.0 * (np.arange(256) / 255.0) ** gamma
+        self.set_brightness(self.brightness)
+
+    def set_brightness(self, brightness):
+        self.brightness = brightness
+        self.lut = np.round(self.table * brightness).astype(np.uint8)
+
+    def ramp(self, brightness, duration, now):
+        """
+        Start changing the brightness, over duration seconds.
+        """
+        if duration <= 0:
+            self.ramp_to = None
+            self.set_brightness(brightness)
+            return
+        self.ramp_from = self.brightness
+        self.ramp_to = brightness
+        self.ramp_start = now
+        self.ramp_duration = duration
+
+    def ramping(self):
+        return self.ramp_to is not None
+
+    def update(self, now):
+        """
+        Update the brightness of the ramp for time now.
+        Returns True if the brightness changed.
+        """
+        if self.ramp_to is None:
+            return False
+        t = min(1.0, (now - self.ramp_start) / self.ramp_duration)
+        # interpolate perceived brightness, for fades that look linear
+        start = self.ramp_from ** (1.0 / self.gamma)
+        end = self.ramp_to ** (1.0 / self.gamma)
+        self.set_brightness((start + (end - start) * t) ** self.gamma)
+        if t == 1.0:
+            self.ramp_to = None
+        return True
+
+    def apply(self, frame):
+        return self.lut[frame]
 
 
 class DriverLeds:
@@ -30,34 +176,197 @@ class DriverLeds:
         """
         self.node = mw.Node("driver_leds")
         self.leds = mw.Leds()
-        self.colors = [[0, 0, 0]] * self.leds.number
-        self.pixels = neopixel.NeoPixel(board.D18, self.leds.number, brightness=self.leds.brightness, auto_write=False)
-        print("brightness: %s, %s" % (self.leds.brightness, type(self.leds.brightness)))
-    
+        self.server = mw.Server()
+        self.watcher = self.node.watch(self.leds, "colors", "frame", "animation", "icon", "effect", "brightness", "gamma", "max_fps")
+        self.server.watch("icons_changed", watcher=self.watcher)
+        self.player = AnimationPlayer()
+        self.effect = None
+        self.icons = mw.IconCache(self.server.path_for_icons(), self.leds.icon_cache_size)
+        if self.leds.preload_icons:
+            count = self.icons.warm_up()
+            self.node.loginfo("decoded %d icons" % count)
+        self.number = self.leds.number
+        self.period = 1.0 / self.leds.max_fps
+        self.correction = ColorCorrection(self.leds.gamma, self.leds.brightness)
+        self.colors = None
+        self.pending = None
+        self.next_write = 0.0
+        self.shown = 0
+        self.dropped = 0
+        # brightness is applied to the frames, so the buffer can be written in bulk
+        self.pixels = neopixel.NeoPixel(board.D18, self.number, brightness=1.0, auto_write=False, pixel_order=neopixel.GRB)
+        print("brightness: %s, gamma: %s" % (self.correction.brightness, self.correction.gamma))
+
+    def to_frame(self, colors):
+        """
+        Convert colors to a frame: a uint8 array with a color per led.
+        Components are clamped between 0 and 255, missing leds are black.
+        """
+        colors = np.asarray(colors)
+        if colors.dtype != np.uint8:
+            colors = np.clip(colors, 0, 255).astype(np.uint8)
+        colors = colors.reshape(-1, 3)
+        if len(colors) == self.number:
+            return colors
+        frame = np.zeros((self.number, 3), np.uint8)
+        frame[:min(len(colors), self.number)] = colors[:self.number]
+        return frame
+
+    def queue(self, colors):
+        """
+        Queue colors to be written, replacing the frame that is queued, if any.
+        """
+        frame = self.to_frame(colors)
+        if self.pending is not None and not np.array_equal(frame, self.pending):
+            self.dropped += 1
+        self.pending = frame
+
+    def redraw(self):
+        """
+        Write the frame that is shown again, after the color correction changed.
+        """
+        if self.pending is None and self.colors is not None:
+            self.pending = self.colors
+        self.colors = None
+
+    def write(self, frame):
+        """
+        Write a frame to the leds, unless it is already shown.
+        """
+        if self.colors is not None and np.array_equal(frame, self.colors):
+            return
+        self.pixels.buf[:] = self.correction.apply(frame[:, PIXEL_CHANNELS]).tobytes()
+        self.pixels.show()
+        self.colors = frame
+        self.shown += 1
+
+    def show_icon(self, icon, now):
+        """
+        Show an icon set with Leds.set_icon.
+        """
+        try:
+            frames, durations = self.icons.get(icon["name"])
+        except OSError as e:
+            self.node.logwarn("can not load icon %s: %s" % (icon["name"], e))
+            return
+        if len(frames) == 1:
+            self.player.stop()
+            self.queue(frames[0])
+            self.leds.colors = frames[0]
+        else:
+            self.player.start({"frames": frames, "durations": durations, "mode": icon["mode"]}, now)
+
+    def start_effect(self, params, now):
+        """
+        Start an effect set with the effect methods of Leds.
+        """
+        self.player.stop()
+        self.effect = None
+        if params is None:
+            self.queue(self.leds.colors)
+            return
+        shown = self.pending if self.pending is not None else self.colors
+        if shown is None:
+            shown = np.zeros((self.number, 3), np.uint8)
+        try:
+            self.effect = leds_effects.create(params, shown, self.icons.get, now)
+        except (ValueError, OSError) as e:
+            self.node.logwarn("can not start effect %s: %s" % (params, e))
+
+    def publish_stats(self, elapsed):
+        """
+        Publish the frame rate and the frames dropped since the last call.
+        """
+        self.leds.stats = {
+            "fps": round(self.shown / elapsed, 1),
+            "dropped": self.dropped + self.player.dropped,
+        }
+        self.shown = 0
+        self.dropped = 0
+        self.player.dropped = 0
+
     def run(self):
         """
         Main loop.
         """
         try:
             self.leds.ready = True
+            self.queue(self.leds.colors)
+            last_stats = time.monotonic()
             while not self.node.is_shutdown():
-                time.sleep(0.1)
-                colors = self.leds.colors[:]
-                if colors != self.colors:
-                    # print("writing")
-                    for i in range(self.leds.number):
-                        r = max(0, min(255, int(colors[i][0])))
-                        g = max(0, min(255, int(colors[i][1])))
-                        b = max(0, min(255, int(colors[i][2])))
-                        self.pixels[i] = [r, g, b]
-                    self.pixels.show()
-                    self.colors = colors
+                now = time.monotonic()
+                timeout = 1.0
+                if self.player.playing():
+                    timeout = min(timeout, self.player.timeout(now))
+                if self.pending is not None or self.effect is not None or self.correction.ramping():
+                    timeout = min(timeout, max(0.0, self.next_write - now))
+                changed = self.watcher.wait(timeout)
+                now = time.monotonic()
+                if "icons_changed" in changed:
+                    self.icons.invalidate(self.server.icons_changed)
+                if "max_fps" in changed:
+                    self.period = 1.0 / self.leds.max_fps
+                if "gamma" in changed:
+                    self.correction.set_gamma(self.leds.gamma)
+                    self.redraw()
+                if "brightness" in changed:
+                    self.correction.ramp(self.leds.brightness, self.leds.brightness_ramp, now)
+                    if not self.correction.ramping():
+                        self.redraw()
+                if "icon" in changed:
+                    self.effect = None
+                    icon = self.leds.icon
+                    if icon is not None:
+                        self.show_icon(icon, now)
+                elif "animation" in changed:
+                    self.effect = None
+                    animation = self.leds.animation
+                    if animation is None:
+                        self.player.stop()
+                        self.queue(self.leds.colors)
+                    else:
+                        self.player.start(animation, now)
+                elif "frame" in changed:
+                    # frames and colors take over the animation or effect being played
+                    self.player.stop()
+                    self.effect = None
+                    frame = self.leds.frame
+                    if frame is not None:
+                        self.queue(frame)
+                elif "effect" in changed:
+                    self.start_effect(self.leds.effect, now)
+                elif "colors" in changed:
+                    self.player.stop()
+                    self.effect = None
+                    self.queue(self.leds.colors)
+                if self.player.playing():
+                    frame = self.player.advance(now)
+                    if frame is not None:
+                        self.queue(frame)
+                        if not self.player.playing():
+                            # the animation ended, leave colors showing its final frame
+                            self.leds.colors = frame
+                if self.effect is not None and now >= self.next_write:
+                    self.queue(self.effect.render(now))
+                    if self.effect.done(now):
+                        # the effect ended, leave colors showing its final frame
+                        self.effect = None
+                        self.leds.colors = self.pending
+                if now >= self.next_write and self.correction.update(now):
+                    self.redraw()
+                if self.pending is not None and now >= self.next_write:
+                    self.write(self.pending)
+                    self.pending = None
+                    self.next_write = now + self.period
+                if now - last_stats >= STATS_PERIOD:
+                    self.publish_stats(now - last_stats)
+                    last_stats = now
         except KeyboardInterrupt:
             pass
         finally:
-            for i in range(self.leds.number):
-                self.pixels[i] = [0, 0, 0]
+            self.pixels.fill((0, 0, 0))
             self.pixels.show()
+            self.watcher.close()
             self.node.shutdown()
 
 
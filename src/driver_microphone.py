@@ -7,15 +7,21 @@ Driver node.
 
 This node manages the microphone.
 
-Stores captured audio to wave file called mic.wav, in the multimedia server's static resource folder.
+Captures audio continuously into a shared memory AudioRing, that other nodes can read, see audio_capture.
+
+Publishes the level of the audio and whether voice is heard, detected with a VoiceDetector.
+
+Stores captured audio to wave file called mic.wav, in the multimedia server's static resource folder, while record is set.
 
 """
 
 
 import os
+import threading
 import time
 
 import middleware as mw
+import audio_capture
 
 
 class DriverMicrophone:
@@ -24,37 +30,101 @@ class DriverMicrophone:
         """
         Connect to middleware.
         Initialize node.
+        Open the capture device, or the source file.
         """
         self.node = mw.Node("driver_microphone")
         self.microphone = mw.Microphone()
         self.server = mw.Server()
-    
+        self.watcher = self.node.watch(self.microphone, "record", "vad_threshold")
+        self.ring = audio_capture.AudioRing.create(self.microphone.ring)
+        self.detector = audio_capture.VoiceDetector(self.microphone.vad_threshold)
+        self.recorder = None
+        self.thread = threading.Thread(target=self.capture, daemon=True)
+        self.stopped = threading.Event()
+        source = self.microphone.source
+        try:
+            if source:
+                self.source = audio_capture.FileSource(source, loop=True)
+            else:
+                self.source = audio_capture.AlsaSource()
+        except Exception as e:
+            self.node.logerror("can not open the microphone, audio will not be captured: %s" % e)
+            self.source = None
+
     def start_recording_audio(self):
-        # start recording audio using arecord
-        os.system("arecord -f cd %s/sounds/mic.wav &" % self.server.static_path)
+        self.recorder = audio_capture.Recorder(self.ring, os.path.join(self.server.static_path, "sounds", "mic.wav"))
         self.microphone.is_recording = True
-    
+
     def stop_recording_audio(self):
-        # stop recording audio
-        os.system("killall arecord")
+        dropped = self.recorder.stop()
+        if dropped:
+            self.node.logwarn("%d frames were dropped from the recording" % dropped)
+        self.recorder = None
         self.microphone.is_recording = False
-    
+
+    def capture(self):
+        """
+        Capture frames into the ring, run in the capture thread.
+        """
+        period = 1.0 / self.microphone.level_rate
+        next_level = 0.0
+        voice = False
+        # is_shutdown is called by the main loop only, as it times the iterations of the loop
+        while not self.stopped.is_set() and not self.node.shutdown_requested.is_set():
+            frame = self.source.read()
+            if frame is None:
+                break
+            t = time.time()
+            level = audio_capture.frame_level(frame)
+            heard = self.detector.update(level)
+            self.ring.write(frame, t, level, heard)
+            values = {}
+            if heard != voice:
+                voice = heard
+                values["voice"] = voice
+                values["voice_started" if voice else "voice_ended"] = t
+            now = time.monotonic()
+            if now >= next_level:
+                next_level = now + period
+                values["level"] = round(level, 1)
+                values["noise_floor"] = round(self.detector.floor, 1)
+                values["stats"] = {"frames": self.ring.written(), "rate": self.ring.rate}
+            if values:
+                self.microphone.update(values)
+
     def run(self):
         """
         Main loop.
         """
         try:
+            if self.source is not None:
+                self.thread.start()
+            self.microphone.is_recording = False
             self.microphone.ready = True
             while not self.node.is_shutdown():
-                time.sleep(0.1)
-                if self.microphone.record and not self.microphone.is_recording:
+                changed = self.watcher.wait(1.0)
+                if "vad_threshold" in changed:
+                    self.detector.threshold = self.microphone.vad_threshold
+                if self.microphone.record and self.recorder is None:
                     self.start_recording_audio()
-                elif not self.microphone.record and self.microphone.is_recording:
+                elif not self.microphone.record and self.recorder is not None:
                     self.stop_recording_audio()
         except KeyboardInterrupt:
             pass
         finally:
+            if self.recorder is not None:
+                self.stop_recording_audio()
+            self.watcher.close()
             self.node.shutdown()
+            self.stopped.set()
+            if self.source is not None:
+                self.thread.join(1.0)
+                if self.thread.is_alive():
+                    # the source is blocked, the ring is left to the next driver, that replaces it
+                    self.node.logwarn("the capture thread did not stop")
+                    return
+                self.source.close()
+            self.ring.close()
 
 
 if __name__ == '__main__':
@@ -61,72 +61,74 @@ class DriverPanTilt:
             self.tilt.ready = True
             while not self.node.is_shutdown():
                 try:
+                    # read all fields in a single round trip
+                    pan, tilt = mw.read_many(self.pan, self.tilt)
                     # calibrate pid
-                    if self.pan.pid_p != self.pan.pid_current_p:
-                        self.servo_pan.set_position_p(self.pan.pid_p)
+                    if pan["pid_p"] != pan["pid_current_p"]:
+                        self.servo_pan.set_position_p(pan["pid_p"])
                         time.sleep(0.2)
-                        self.pan.pid_current_p = self.pan.pid_p
-                    if self.pan.pid_d != self.pan.pid_current_d:
-                        self.servo_pan.set_position_d(self.pan.pid_d)
+                        self.pan.pid_current_p = pan["pid_p"]
+                    if pan["pid_d"] != pan["pid_current_d"]:
+                        self.servo_pan.set_position_d(pan["pid_d"])
                         time.sleep(0.2)
-                        self.pan.pid_current_d = self.pan.pid_d
-                    if self.tilt.pid_p != self.tilt.pid_current_p:
-                        self.servo_tilt.set_position_p(self.tilt.pid_p)
+                        self.pan.pid_current_d = pan["pid_d"]
+                    if tilt["pid_p"] != tilt["pid_current_p"]:
+                        self.servo_tilt.set_position_p(tilt["pid_p"])
                         time.sleep(0.2)
-                        self.tilt.pid_current_p = self.tilt.pid_p
-                    if self.tilt.pid_d != self.tilt.pid_current_d:
-                        self.servo_tilt.set_position_d(self.tilt.pid_d)
+                        self.tilt.pid_current_p = tilt["pid_p"]
+                    if tilt["pid_d"] != tilt["pid_current_d"]:
+                        self.servo_tilt.set_position_d(tilt["pid_d"])
                         time.sleep(0.2)
-                        self.tilt.pid_current_d = self.tilt.pid_d
+                        self.tilt.pid_current_d = tilt["pid_d"]
                     # torque
-                    if self.pan.enable and not self.pan.enabled:
+                    if pan["enable"] and not pan["enabled"]:
                         self.servo_pan.torque_on()
                         time.sleep(0.2)
-                        self.pan.enabled = True
-                    elif not self.pan.enable and self.pan.enabled:
+                        self.pan.enabled = pan["enabled"] = True
+                    elif not pan["enable"] and pan["enabled"]:
                         self.servo_pan.torque_off()
                         time.sleep(0.2)
-                        self.pan.enabled = False
-                    if self.tilt.enable and not self.tilt.enabled:
+                        self.pan.enabled = pan["enabled"] = False
+                    if tilt["enable"] and not tilt["enabled"]:
                         self.servo_tilt.torque_on()
                         time.sleep(0.2)
-                        self.tilt.enabled = True
-                    elif not self.tilt.enable and self.tilt.enabled:
+                        self.tilt.enabled = tilt["enabled"] = True
+                    elif not tilt["enable"] and tilt["enabled"]:
                         self.servo_tilt.torque_off()
                         time.sleep(0.2)
-                        self.tilt.enabled = False
+                        self.tilt.enabled = tilt["enabled"] = False
                     # set pan angle
-                    if self.pan.enabled and self.pan.angle_ref != self.pan.angle:
-                        self.pan.angle_ref = self.pan.angle
-                        angle = max(self.pan.min_angle, min(self.pan.max_angle, self.pan.angle))
+                    if pan["enabled"] and pan["angle_ref"] != pan["angle"]:
+                        self.pan.angle_ref = pan["angle"]
+                        angle = max(pan["min_angle"], min(pan["max_angle"], pan["angle"]))
                         # calculate playtime based on motion range.
-                        motion_range = abs(self.pan.current_angle - angle)
-                        max_motion_range = abs(self.pan.max_angle - self.pan.min_angle)
+                        motion_range = abs(pan["current_angle"] - angle)
+                        max_motion_range = abs(pan["max_angle"] - pan["min_angle"])
                         motion_range_percent = motion_range / max_motion_range
-                        playtime = int(self.pan.min_playtime + (self.pan.max_playtime - self.pan.min_playtime) * motion_range_percent)
+                        playtime = int(pan["min_playtime"] + (pan["max_playtime"] - pan["min_playtime"]) * motion_range_percent)
                         # self.node.loginfo("setting pan angle to %s with playtime %s" % (angle, playtime))
-                        angle += self.pan.angle_bias
+                        angle += pan["angle_bias"]
                         self.servo_pan.set_servo_angle(angle, playtime, 0)
                         time.sleep(0.2)
                         # self.node.loginfo("pan angle set")
                     # set tilt angle
-                    if self.tilt.enabled and self.tilt.angle_ref != self.tilt.angle:
-                        self.tilt.angle_ref = self.tilt.angle
-                        angle = max(self.tilt.min_angle, min(self.tilt.max_angle, self.tilt.angle))
+                    if tilt["enabled"] and tilt["angle_ref"] != tilt["angle"]:
+                        self.tilt.angle_ref = tilt["angle"]
+                        angle = max(tilt["min_angle"], min(tilt["max_angle"], tilt["angle"]))
                         # calculate playtime based on motion range.
-                        motion_range = abs(self.tilt.current_angle - angle)
-                        max_motion_range = abs(self.tilt.max_angle - self.tilt.min_angle)
+                        motion_range = abs(tilt["current_angle"] - angle)
+                        max_motion_range = abs(tilt["max_angle"] - tilt["min_angle"])
                         motion_range_percent = motion_range / max_motion_range
-                        playtime = int(self.tilt.min_playtime + (self.tilt.max_playtime - self.tilt.min_playtime) * motion_range_percent)
+                        playtime = int(tilt["min_playtime"] + (tilt["max_playtime"] - tilt["min_playtime"]) * motion_range_percent)
                         # self.node.loginfo("setting tilt angle to %s with playtime %s" % (angle, playtime))
-                        angle += self.tilt.angle_bias
+                        angle += tilt["angle_bias"]
                         self.servo_tilt.set_servo_angle(angle, playtime, 0)
                         time.sleep(0.2)
                         # self.node.loginfo("tilt angle set")
                     # update current angles
-                    self.pan.current_angle = self.servo_pan.get_servo_angle() - self.pan.angle_bias
+                    self.pan.current_angle = self.servo_pan.get_servo_angle() - pan["angle_bias"]
                     time.sleep(0.2)
-                    self.tilt.current_angle = self.servo_tilt.get_servo_angle() - self.tilt.angle_bias
+                    self.tilt.current_angle = self.servo_tilt.get_servo_angle() - tilt["angle_bias"]
                     time.sleep(0.2)
                     # update current temperature
                     self.pan.temperature = self.servo_pan.get_servo_temperature()
@@ -31,6 +31,9 @@ class DriverPower:
         self.gpio = mw.GPIO()
         self.battery = mw.Battery()
         self.node = mw.Node("driver_power")
+        self.watcher = self.node.watch(self.power)
+        self.gpio.watch("robot_shutdown", watcher=self.watcher)
+        self.battery.watch("percentage", watcher=self.watcher)
     
     def reboot(self):
         self.node.loginfo("Rebooting")
@@ -46,21 +49,26 @@ class DriverPower:
         """
         try:
             while not self.node.is_shutdown():
-                time.sleep(0.1)
+                self.watcher.wait(1.0)
+                power, gpio, battery = mw.read_many(
+                    self.power,
+                    (self.gpio, "robot_shutdown"),
+                    (self.battery, "percentage"),
+                )
                 # reboot flag of the middleware.Power class
-                if self.power.reboot:
+                if power["reboot"]:
                     self.reboot()
                     break
                 # shutdown flag of the middleware.Power class
-                if self.power.shutdown:
+                if power["shutdown"]:
                     self.shutdown()
                     break
                 # GPIO shutdown event
-                if self.power.gpio_shutdown and self.gpio.robot_shutdown:
+                if power["gpio_shutdown"] and gpio["robot_shutdown"]:
                     self.shutdown()
                     break
                 # battery at 0%
-                if self.power.battery_shutdown and self.battery.percentage <= 0:
+                if power["battery_shutdown"] and battery["percentage"] <= 0:
                     self.shutdown()
                     break
         except KeyboardInterrupt:
@@ -68,6 +76,7 @@ class DriverPower:
         except Exception as e:
             self.node.logerror(e)
         finally:
+            self.watcher.close()
             self.node.shutdown()
 
 
@@ -7,14 +7,21 @@ Driver node.
 
 This node manages the speakers.
 
-Uses the aplay command to play sounds.
+Plays sounds with an AudioEngine, that keeps the audio device open.
+
+Sounds of the channels effects, music and speech are mixed by the engine, with the gains set in Speakers.
+
+Sounds of the http server are read from the disk and kept decoded in a SoundCache, other urls are downloaded.
+The volume and the gain of each sound are applied by the engine, in the mix.
+
+Sounds set with Speakers.preload are decoded in the background, and the residency of the cache is published in Speakers.cache.
 
 """
 
-import os
-import multiprocessing
+import threading
 import time
 import middleware as mw
+import audio_engine
 
 
 
@@ -24,28 +31,119 @@ class DriverSpeakers:
         """
         Connect to middleware.
         Initialize node.
+        Open the audio device.
         """
         self.speakers = mw.Speakers()
-        self.volume = 0
+        self.server = mw.Server()
         self.node = mw.Node("driver_speakers")
-        self.process = None
+        self.fields = {c: mw.speaker_field(c, "url") for c in mw.SPEAKER_CHANNELS}
+        self.gains = {c: f"{c}_gain" for c in mw.SPEAKER_CHANNELS}
+        self.watched = (
+            "volume", "duck_gain", "preload_urls", "normalize", "sound_gains",
+            *self.fields.values(), *self.gains.values(),
+        )
+        self.watcher = self.node.watch(self.speakers, *self.watched)
+        self.sounds = audio_engine.SoundCache(self.speakers.sound_cache_size)
+        self.preloaded = []
+        self.preloader = None
+        try:
+            sink = audio_engine.AlsaSink()
+        except Exception as e:
+            self.node.logerror("can not open the audio device, sounds will not be heard: %s" % e)
+            sink = audio_engine.NullSink()
+        self.engine = audio_engine.AudioEngine(sink, self.on_event, channels=mw.SPEAKER_CHANNELS)
+        self.urls = dict.fromkeys(mw.SPEAKER_CHANNELS)
+        # the url played on each channel is updated by the main loop and the engine thread
+        self.lock = threading.Lock()
+
+    def load_sound(self, url):
+        """
+        Load the decoded sound of a url, and its normalization gain.
+        """
+        path = self.server.resolve(url)
+        if path is not None:
+            return self.sounds.get(path)
+        sound = audio_engine.decode_wav(self.server.read(url))
+        return sound, audio_engine.normalization_gain(sound)
+
+    def preload(self, urls):
+        """
+        Decode sounds into the cache, run in the preloader thread.
+        """
+        start = time.monotonic()
+        for url in urls:
+            path = self.server.resolve(url)
+            if path is None:
+                self.node.logwarn("can not preload %s, it is not on this machine" % url)
+                continue
+            try:
+                self.sounds.get(path)
+            except Exception as e:
+                self.node.logwarn("can not preload %s: %s" % (url, e))
+        self.node.loginfo("preloaded %d sounds in %.2fs" % (len(urls), time.monotonic() - start))
+        self.publish_cache()
 
-    def play_sound(self, url):
+    def publish_cache(self):
+        """
+        Publish the cache statistics, with the preloaded sounds that are resident and missing.
         """
-        Play a sound.
+        missing = []
+        for url in self.preloaded:
+            path = self.server.resolve(url)
+            if path is None or not self.sounds.resident(path):
+                missing.append(url)
+        stats = self.sounds.stats()
+        stats["preloaded"] = len(self.preloaded) - len(missing)
+        stats["missing"] = missing
+        self.speakers.cache = stats
+
+    def play_sound(self, url, channel, values):
         """
-        self.speakers.playing = url
-        print(f'playing {url}')
-        os.system(f'/usr/bin/curl {url} | /usr/bin/aplay')
-        self.speakers.url = None
-        self.speakers.playing = None
-    
-    def stop_sound(self):
+        Play a sound on a channel.
+        Its gain is set in sound_gains, or is its normalization gain if normalize is set.
+        """
+        print(f'playing {url} on {channel}')
+        try:
+            sound, gain = self.load_sound(url)
+            if url in values["sound_gains"]:
+                gain = values["sound_gains"][url]
+            elif not values["normalize"]:
+                gain = 1.0
+            self.engine.play(sound, url, channel, gain)
+        except Exception as e:
+            self.node.logwarn("can not play %s: %s" % (url, e))
+            # unless another sound was set meanwhile
+            self.speakers.update_if(self.fields[channel], url, {self.fields[channel]: None})
+        if self.preloader is None or not self.preloader.is_alive():
+            self.publish_cache()
+
+    def stop_sound(self, channel):
+        """
+        Stop playing the sound of a channel.
+        """
+        print(f'stopping {channel}')
+        self.engine.stop(channel)
+
+    def on_event(self, event, channel, url, t):
         """
-        Stop playing a sound, by killing the aplay process.
+        Publish the state of the engine, called from the engine thread.
         """
-        print(f'stopping')
-        os.system("/usr/bin/killall aplay")
+        if event == "start":
+            self.speakers.update({mw.speaker_field(channel, "playing"): url, mw.speaker_field(channel, "started"): t})
+        elif event == "finish":
+            field = self.fields[channel]
+            with self.lock:
+                if url != self.urls[channel] or self.engine.playing(channel) is not None:
+                    # another sound was set meanwhile
+                    return
+                values = {mw.speaker_field(channel, "playing"): None, mw.speaker_field(channel, "finished"): t}
+                # so that the same url can be played again, unless another sound was set in the database
+                if self.speakers.update_if(field, url, {**values, field: None}):
+                    self.urls[channel] = None
+                else:
+                    self.speakers.update(values)
+        elif event == "stop" and self.engine.playing(channel) is None:
+            self.speakers.update({mw.speaker_field(channel, "playing"): None, mw.speaker_field(channel, "finished"): t})
 
     def run(self):
         """
@@ -54,25 +152,30 @@ class DriverSpeakers:
         try:
             self.speakers.ready = True
             while not self.node.is_shutdown():
-                time.sleep(0.1)
-                url = self.speakers.url
-                playing = self.speakers.playing
-                volume = self.speakers.volume
-                # play sound
-                if url != playing:
-                    self.stop_sound()
-                    self.process = multiprocessing.Process(target=self.play_sound, args=(url,))
-                    self.process.start()
-                # stop sound
-                if playing and url is None:
-                    self.stop_sound()
-                    self.speakers.playing = None
-                # change volume
-                if self.volume != volume:
-                    if 0 == os.system(f'/usr/bin/amixer sset "Master" {volume}%'):
-                        self.volume = volume
+                self.watcher.wait(1.0)
+                values, = mw.read_many((self.speakers, *self.watched))
+                self.engine.set_volume(audio_engine.volume_gain(values["volume"]))
+                self.engine.duck_gain = values["duck_gain"]
+                # preload sounds, without delaying the sounds played meanwhile
+                if values["preload_urls"] != self.preloaded:
+                    self.preloaded = values["preload_urls"]
+                    self.preloader = threading.Thread(target=self.preload, args=(self.preloaded,), daemon=True)
+                    self.preloader.start()
+                for channel, field in self.fields.items():
+                    self.engine.set_gain(channel, values[self.gains[channel]])
+                    # play or stop sound
+                    url = values[field]
+                    with self.lock:
+                        changed = url != self.urls[channel]
+                        self.urls[channel] = url
+                    if changed:
+                        if url is None:
+                            self.stop_sound(channel)
+                        else:
+                            self.play_sound(url, channel, values)
         finally:
-            self.stop_sound()
+            self.engine.close()
+            self.watcher.close()
             self.node.shutdown()
 
 
@@ -7,19 +7,19 @@ Driver node.
 
 This node manages speech.
 
-Uses the gtts-cli command to generate speech and the aplay command to play it.
+Renders text with a synthesizer of the speech_synth module, espeak by default, which runs offline.
 
-gtts-cli is a command line interface to the Google Text-to-Speech API.
+Rendered phrases are cached on the disk, so a phrase is rendered once, and the phrases of Speech.phrases are rendered when the node starts.
 
-Internet connection is required.
+Speech is played on the speech channel of the speakers, by the speakers driver.
 
 """
 
 
-import os
-import time
+import threading
 
 import middleware as mw
+import speech_synth
 
 
 class DriverSpeech:
@@ -29,16 +29,56 @@ class DriverSpeech:
         Initialize node.
         """
         self.speech = mw.Speech()
+        self.speakers = mw.Speakers()
         self.node = mw.Node("driver_speech")
-    
+        self.watcher = self.node.watch(self.speech, "say", "engine", "phrases")
+        self.speakers.watch("speech_url", watcher=self.watcher)
+        self.cache = None
+        self.url = None
+        self.set_engine(self.speech.engine)
+
+    def set_engine(self, name):
+        """
+        Use the synthesizer called name, or espeak if it can not be used.
+        """
+        try:
+            synthesizer = speech_synth.create(name)
+        except (ValueError, ImportError) as e:
+            self.node.logerror("can not use the %s synthesizer, using espeak: %s" % (name, e))
+            synthesizer = speech_synth.Espeak()
+        self.cache = speech_synth.PhraseCache(self.speech.cache_path, synthesizer)
+
+    def prerender(self, language, phrases):
+        """
+        Render phrases that are not cached, in a thread so that speech is not delayed.
+        """
+        def render():
+            for text in phrases:
+                try:
+                    cache.render(language, text)
+                except RuntimeError as e:
+                    self.node.logwarn("can not render %s: %s" % (text, e))
+            self.speech.stats = cache.stats()
+        cache = self.cache
+        threading.Thread(target=render, daemon=True).start()
+
     def speak(self, language, text):
         """
-        Speak a text.
+        Speak a text, on the speech channel of the speakers.
         """
-        command = '/usr/bin/rm -f /tmp/f.mp3 /tmp/f.wav && /home/idmind/.local/bin/gtts-cli -l %s "%s" --output /tmp/f.mp3 && /usr/bin/ffmpeg -i /tmp/f.mp3 /tmp/f.wav && /usr/bin/aplay /tmp/f.wav && /usr/bin/rm -f /tmp/f.mp3 /tmp/f.wav' % (language, text)
-        os.system(command)
+        try:
+            self.url = self.cache.render(language, text)
+        except RuntimeError as e:
+            self.node.logwarn("can not say %s: %s" % (text, e))
+            self.done()
+            return
+        self.speakers.play(self.url, "speech")
+        self.speech.stats = self.cache.stats()
+
+    def done(self):
+        self.url = None
         self.speech.saying = ""
-        self.speech.say = ""    
+        self.speech.say = ""
 
     def run(self):
         """
@@ -46,17 +86,29 @@ class DriverSpeech:
         """
         try:
             self.speech.ready = True
+            self.prerender(self.speech.language, self.speech.phrases)
             while not self.node.is_shutdown():
-                time.sleep(0.1)
-                if self.speech.saying != self.speech.say:
-                    self.speech.saying = self.speech.say
-                    self.speak(self.speech.language, self.speech.say)
+                changed = self.watcher.wait(1.0)
+                if "engine" in changed:
+                    self.set_engine(self.speech.engine)
+                if "engine" in changed or "phrases" in changed:
+                    self.prerender(self.speech.language, self.speech.phrases)
+                say = self.speech.say
+                if say and say != self.speech.saying:
+                    self.speech.saying = say
+                    self.speak(self.speech.language, say)
+                elif self.url is not None and self.speakers.speech_url != self.url:
+                    # finished, or replaced by another sound
+                    self.done()
+                elif not say and self.url is not None:
+                    self.speakers.stop("speech")
         except KeyboardInterrupt:
             pass
         finally:
+            self.watcher.close()
             self.node.shutdown()
 
 
 if __name__ == '__main__':
     node = DriverSpeech()
-    node.run()
\ No newline at end of file
+    node.run()
@@ -29,6 +29,8 @@ class DriverTouchSensors:
         i2c = busio.I2C(board.SCL, board.SDA)
         self.mpr121 = adafruit_mpr121.MPR121(i2c)
         self.touch_sensors = mw.TouchSensors()
+        # raw values are published together, once per loop
+        self.touch_sensors.write_behind()
         self.node = mw.Node("driver_touch_sensors")
 
     def run(self):
@@ -37,14 +39,18 @@ class DriverTouchSensors:
         """
         try:
             self.touch_sensors.ready = True
+            self.touch_sensors.flush()
             while not self.node.is_shutdown():
                 self.touch_sensors.chest_raw = self.mpr121.filtered_data(0)
                 self.touch_sensors.head_0_raw = self.mpr121.filtered_data(1)
                 self.touch_sensors.head_1_raw = self.mpr121.filtered_data(2)
                 self.touch_sensors.head_2_raw = self.mpr121.filtered_data(3)
-                self.touch_sensors.head_3_raw = self.mpr121.filtered_data(4)    
+                self.touch_sensors.head_3_raw = self.mpr121.filtered_data(4)
+                self.touch_sensors.flush()
                 time.sleep(0.1)
         finally:
+            # send the writes buffered when the loop stopped
+            self.touch_sensors.flush()
             self.node.shutdown()
 
 
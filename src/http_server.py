@@ -74,7 +74,7 @@ def onboard_handle():
 def onboard_speech():
     r = request.json["result"]
     print("speech: " + r)
-    onboard.speech = r
+    onboard.update({"speech": r, "speech_time": time.time()})
     return jsonify({})
 
 
@@ -104,6 +104,7 @@ def icons():
         path = server.static_path + "/icons/"
         file.save(path + filename)
         print("file saved to " + path + filename)
+        server.icons_changed = filename
         return jsonify("OK")
 
 
@@ -113,6 +114,7 @@ def delete_icon(name):
         full_name = server.static_path + "/icons/" + name
         print("deleting " + full_name)
         os.remove(full_name)
+        server.icons_changed = name
         return jsonify("OK")
 
 
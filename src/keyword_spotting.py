@@ -0,0 +1,224 @@
+#! /usr/bin/env python
+
+
+"""
+
+Keyword spotting.
+
+Recognizes a small vocabulary of words, offline, in the audio captured by the microphone driver.
+
+Utterances are cut from the microphone ring with the voice activity of its frames, by a Segmenter.
+Their MFCC features are matched against templates of each word with dynamic time warping (DTW),
+and the closest word is recognized if its distance is below a threshold.
+
+Templates are WAV files, recorded by enrolling words, in a folder per word.
+Words without recorded templates use a template rendered by the espeak synthesizer, which matches voices less well.
+
+"""
+
+
+import os
+
+import numpy as np
+
+import audio_capture
+import audio_engine
+
+
+RATE = audio_capture.RATE
+# 25 ms windows, every 10 ms
+WINDOW = 400
+HOP = 160
+FFT_SIZE = 512
+MEL_BANDS = 26
+# cepstral coefficients kept, without c0
+CEPSTRA = 12
+PRE_EMPHASIS = 0.97
+
+# frames of 20 ms, kept before voice is detected, as detection starts late
+PRE_ROLL = 10
+# longest utterance, 1.6 s
+MAX_UTTERANCE = 80
+# shortest utterance, 0.16 s
+MIN_UTTERANCE = 8
+
+VOCABULARY = ["yes", "no", "start", "stop", "angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
+
+def mel_filterbank(bands=MEL_BANDS, size=FFT_SIZE, rate=RATE):
+    """
+    Triangular filters, equally spaced on the mel scale, as a (bands, size // 2 + 1) matrix.
+    """
+    mel = np.linspace(0.0, 2595.0 * np.log10(1.0 + rate / 2 / 700.0), bands + 2)
+    hz = 700.0 * (10.0 ** (mel / 2595.0) - 1.0)
+    bins = np.fft.rfftfreq(size, 1.0 / rate)
+    low, center, high = hz[:-2, None], hz[1:-1, None], hz[2:, None]
+    rising = (bins - low) / (center - low)
+    falling = (high - bins) / (high - center)
+    return np.maximum(0.0, np.minimum(rising, falling))
+
+
+FILTERBANK = mel_filterbank()
+# DCT-II matrix, for the kept coefficients
+DCT = np.cos(np.pi / MEL_BANDS * (np.arange(MEL_BANDS) + 0.5)[None, :] * np.arange(1, CEPSTRA + 1)[:, None])
+HAMMING = np.hamming(WINDOW)
+
+
+def mfcc(samples):
+    """
+    Features of int16 samples at RATE: MFCC, without c0, and their deltas, for each 10 ms.
+    Returns an array of shape (frames, 2 * CEPSTRA), with the mean of the MFCC removed.
+    """
+    signal = samples.astype(np.float32) / 32768.0
+    signal = np.append(signal[:1], signal[1:] - PRE_EMPHASIS * signal[:-1])
+    if len(signal) < WINDOW:
+        signal = np.pad(signal, (0, WINDOW - len(signal)))
+    frames = np.lib.stride_tricks.sliding_window_view(signal, WINDOW)[::HOP] * HAMMING
+    power = np.abs(np.fft.rfft(frames, FFT_SIZE)) ** 2
+    energies = np.log(power @ FILTERBANK.T + 1e-10)
+    cepstra = energies @ DCT.T
+    # cepstral mean normalization, against the microphone and the room
+    cepstra -= cepstra.mean(axis=0)
+    deltas = np.gradient(cepstra, axis=0) if len(cepstra) > 1 else np.zeros_like(cepstra)
+    return np.hstack((cepstra, deltas))
+
+
+def dtw_distance(features, template):
+    """
+    Distance between the features of an utterance and a template, with dynamic time warping.
+    The whole template is matched against any part of the utterance, which may have silence around the word.
+    Each frame of the utterance advances the template by 0, 1 or 2 frames,
+    so each step depends on the previous frame only, and is computed for the whole template at once.
+    Returns the mean distance between the frames matched.
+    """
+    # euclidean distances between all frames
+    cost = np.sqrt(np.maximum(0.0,
+        (features ** 2).sum(1)[:, None] + (template ** 2).sum(1)[None, :] - 2.0 * features @ template.T))
+    m = len(template)
+    total = np.full(m, np.inf)
+    length = np.zeros(m)
+    best = np.inf
+    for row in cost:
+        # predecessors: same template frame, previous one, or the one before
+        candidates = np.full((3, m), np.inf)
+        candidates[0] = total
+        candidates[1, 1:] = total[:-1]
+        candidates[2, 2:] = total[:-2]
+        lengths = np.zeros((3, m))
+        lengths[0] = length
+        lengths[1, 1:] = length[:-1]
+        lengths[2, 2:] = length[:-2]
+        step = np.argmin(candidates, axis=0)
+        total = candidates[step, np.arange(m)] + row
+        length = lengths[step, np.arange(m)] + 1
+        # the match can start at any frame of the utterance
+        if row[0] < total[0]:
+            total[0] = row[0]
+            length[0] = 1
+        best = min(best, total[-1] / length[-1])
+    return best
+
+
+class Segmenter:
+
+    """
+    Segmenter class.
+    Cuts utterances from frames of the microphone ring, with their voice activity.
+    An utterance starts pre_roll frames before voice is detected, and ends when voice ends,
+    or after max_frames frames. Utterances shorter than min_frames are ignored.
+    """
+
+    def __init__(self, pre_roll=PRE_ROLL, max_frames=MAX_UTTERANCE, min_frames=MIN_UTTERANCE):
+        self.pre_roll = pre_roll
+        self.max_frames = max_frames
+        self.min_frames = min_frames
+        self.history = []
+        self.frames = None
+
+    def push(self, frame, t, voice):
+        """
+        Add a frame captured at time t.
+        Returns the samples of an utterance, and the time its last frame was captured, when it ends, or None.
+        """
+        if self.frames is None:
+            if not voice:
+                self.history = (self.history + [frame])[-self.pre_roll:]
+                return None
+            self.frames = self.history
+            self.history = []
+            self.voiced = 0
+        self.frames.append(frame)
+        self.voiced += voice
+        if voice and len(self.frames) < self.max_frames:
+            return None
+        frames, self.frames = self.frames, None
+        if self.voiced < self.min_frames:
+            return None
+        return np.concatenate(frames), t
+
+
+class KeywordSpotter:
+
+    """
+    KeywordSpotter class.
+    Recognizes the words of a vocabulary, matching utterances against their templates.
+    Use add to add a template, and spot to recognize an utterance.
+    """
+
+    def __init__(self, vocabulary=VOCABULARY, threshold=24.0):
+        self.vocabulary = list(vocabulary)
+        self.threshold = threshold
+        self.templates = {word: [] for word in self.vocabulary}
+
+    def add(self, word, samples):
+        """
+        Add a template of a word, from int16 samples at RATE.
+        """
+        self.templates[word].append(mfcc(samples))
+
+    def load(self, path, synthesizer=None):
+        """
+        Load the templates of the vocabulary, from the WAV files in path/<word>/.
+        Words without templates are rendered by synthesizer, a speech_synth.PhraseCache, if given.
+        Returns the words without templates.
+        """
+        missing = []
+        for word in self.vocabulary:
+            folder = os.path.join(path, word)
+            names = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+            for name in names:
+                if name.endswith(".wav"):
+                    with open(os.path.join(folder, name), "rb") as f:
+                        self.add(word, audio_engine.decode_wav(f.read(), RATE, 1)[:, 0])
+            if not self.templates[word] and synthesizer is not None:
+                try:
+                    with open(synthesizer.render("en", word), "rb") as f:
+                        self.add(word, audio_engine.decode_wav(f.read(), RATE, 1)[:, 0])
+                except RuntimeError:
+                    pass
+            if not self.templates[word]:
+                missing.append(word)
+        return missing
+
+    def distances(self, samples):
+        """
+        Distance of an utterance to each word, the distance to its closest template.
+        """
+        features = mfcc(samples)
+        return {
+            word: min(dtw_distance(features, template) for template in templates)
+            for word, templates in self.templates.items() if templates
+        }
+
+    def spot(self, samples):
+        """
+        Recognize an utterance.
+        Returns the closest word, or None if it is not close enough, and the distances to each word.
+        """
+        distances = self.distances(samples)
+        if not distances:
+            return None, distances
+        word = min(distances, key=distances.get)
+        if distances[word] > self.threshold:
+            return None, distances
+        return word, distances
@@ -0,0 +1,235 @@
+#! /usr/bin/env python
+
+
+"""
+
+Procedural effects for the led matrix.
+
+Effects are rendered by the leds driver, one frame at a time, as numpy array operations.
+
+They are started with the effect methods of middleware.Leds, which store their parameters in the leds_effect field.
+
+Frames are float arrays with a color per led, in led order.
+Effects that draw on the matrix work on (row, column) images, converted with to_leds and from_leds.
+
+"""
+
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+
+from middleware import ICON_SIZE
+
+
+def to_leds(image):
+    """
+    Convert a (row, column) image to a frame in led order, as decode_icon does.
+    """
+    return image[:, ::-1].reshape(-1, 3)
+
+
+def from_leds(frame):
+    """
+    Convert a frame in led order to a (row, column) image.
+    """
+    return np.asarray(frame).reshape(ICON_SIZE, ICON_SIZE, 3)[:, ::-1]
+
+
+def render_text(text):
+    """
+    Render text to a bitmap as tall as the matrix, with values between 0.0 and 1.0.
+    """
+    font = ImageFont.load_default()
+    left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=font)
+    image = Image.new("L", (max(1, right - left), ICON_SIZE))
+    ImageDraw.Draw(image).text((-left, (ICON_SIZE - (bottom - top)) // 2 - top), text, fill=255, font=font)
+    return np.asarray(image) / 255.0
+
+
+class Effect:
+
+    """
+    Effect class.
+    Extend this class to define effects.
+    Effects are created with the frame that is shown, a function that resolves icon names to decoded icons,
+    the current time and the parameters of the effect.
+    If duration is None, the effect runs until it is replaced.
+    Raises ValueError if a duration, period, speed or fade is not positive.
+    """
+
+    def __init__(self, shown, resolve, now, duration=None):
+        if duration is not None and not duration > 0:
+            raise ValueError(f"duration must be positive, not {duration}")
+        self.shown = np.asarray(shown, float)
+        self.start = now
+        self.duration = duration
+
+    def progress(self, now):
+        """
+        Fraction of the duration elapsed, between 0.0 and 1.0.
+        """
+        if not self.duration:
+            return 1.0
+        return min(1.0, (now - self.start) / self.duration)
+
+    def done(self, now):
+        return self.duration is not None and now - self.start >= self.duration
+
+    def render(self, now):
+        raise NotImplementedError
+
+
+class Crossfade(Effect):
+
+    """
+    Fade from the frame that is shown to an icon, or to a color.
+    """
+
+    def __init__(self, shown, resolve, now, icon=None, color=(0, 0, 0), duration=1.0):
+        super().__init__(shown, resolve, now, duration)
+        if icon is not None:
+            frames, _ = resolve(icon)
+            self.target = frames[0].astype(float)
+        else:
+            self.target = np.empty_like(self.shown)
+            self.target[:] = color
+
+    def render(self, now):
+        t = self.progress(now)
+        return self.shown + (self.target - self.shown) * t
+
+
+class Pulse(Effect):
+
+    """
+    Pulse a color, between minimum and full intensity, once every period seconds.
+    """
+
+    def __init__(self, shown, resolve, now, color=(255, 255, 255), period=1.0, minimum=0.0, duration=None):
+        super().__init__(shown, resolve, now, duration)
+        if not period > 0:
+            raise ValueError(f"period must be positive, not {period}")
+        self.color = np.asarray(color, float)
+        self.period = period
+        self.minimum = minimum
+
+    def render(self, now):
+        phase = 2.0 * np.pi * (now - self.start) / self.period
+        level = self.minimum + (1.0 - self.minimum) * (0.5 - 0.5 * np.cos(phase))
+        frame = np.empty_like(self.shown)
+        frame[:] = self.color * level
+        return frame
+
+
+class Wipe(Effect):
+
+    """
+    Cover the frame that is shown with a color, one row or column at a time.
+    direction is where the wipe moves to: "down", "up", "left" or "right".
+    """
+
+    def __init__(self, shown, resolve, now, color=(255, 255, 255), duration=1.0, direction="down"):
+        super().__init__(shown, resolve, now, duration)
+        if direction not in ("down", "up", "left", "right"):
+            raise ValueError(f"unknown wipe direction {direction}")
+        self.color = np.asarray(color, float)
+        self.direction = direction
+        self.image = from_leds(self.shown)
+
+    def render(self, now):
+        # coverage of each row, 0.0 to 1.0, blending the row at the edge
+        covered = np.clip(self.progress(now) * ICON_SIZE - np.arange(ICON_SIZE), 0.0, 1.0)
+        if self.direction in ("up", "left"):
+            covered = covered[::-1]
+        if self.direction in ("down", "up"):
+            covered = covered[:, None, None]
+        else:
+            covered = covered[None, :, None]
+        return to_leds(self.image + (self.color - self.image) * covered)
+
+
+class Scroll(Effect):
+
+    """
+    Scroll text, or an icon, from right to left, at speed columns per second.
+    Text is drawn with color. Scrolls loops times, or forever if loops is 0.
+    """
+
+    def __init__(self, shown, resolve, now, text=None, icon=None, color=(255, 255, 255), speed=8.0, loops=1):
+        if not speed > 0:
+            raise ValueError(f"speed must be positive, not {speed}")
+        if loops < 0:
+            raise ValueError(f"loops must not be negative, not {loops}")
+        if text is not None:
+            bitmap = render_text(text)[:, :, None] * np.asarray(color, float)
+        elif icon is not None:
+            frames, _ = resolve(icon)
+            bitmap = from_leds(frames[0]).astype(float)
+        else:
+            raise ValueError("scroll needs text or an icon")
+        # enter from the right, leave on the left
+        blank = np.zeros((ICON_SIZE, ICON_SIZE, 3))
+        self.bitmap = np.concatenate((blank, bitmap, blank), axis=1)
+        self.speed = speed
+        self.columns = self.bitmap.shape[1] - ICON_SIZE
+        duration = None if loops == 0 else loops * self.columns / speed
+        super().__init__(shown, resolve, now, duration)
+
+    def render(self, now):
+        offset = int((now - self.start) * self.speed) % self.columns
+        if self.done(now):
+            offset = self.columns
+        return to_leds(self.bitmap[:, offset:offset + ICON_SIZE])
+
+
+class Sparkle(Effect):
+
+    """
+    Light random leds with a color, that fade out in fade seconds.
+    density is the number of sparkles per led per second.
+    """
+
+    def __init__(self, shown, resolve, now, color=(255, 255, 255), density=0.5, fade=0.3, duration=None):
+        super().__init__(shown, resolve, now, duration)
+        if not fade > 0:
+            raise ValueError(f"fade must be positive, not {fade}")
+        self.color = np.asarray(color, float)
+        self.density = density
+        self.fade = fade
+        self.level = np.zeros(len(self.shown))
+        self.last = now
+        self.random = np.random.default_rng()
+
+    def render(self, now):
+        dt = now - self.last
+        self.last = now
+        self.level *= np.exp(-dt / self.fade)
+        self.level[self.random.random(len(self.level)) < self.density * dt] = 1.0
+        if self.done(now):
+            self.level[:] = 0.0
+        return self.level[:, None] * self.color
+
+
+EFFECTS = {
+    "crossfade": Crossfade,
+    "pulse": Pulse,
+    "wipe": Wipe,
+    "scroll": Scroll,
+    "sparkle": Sparkle,
+}
+
+
+def create(params, shown, resolve, now):
+    """
+    Create the effect described by params, as stored in leds_effect.
+    Raises ValueError if the effect is unknown, or its parameters are unknown or invalid.
+    """
+    params = dict(params)
+    name = params.pop("name", None)
+    if name not in EFFECTS:
+        raise ValueError(f"unknown effect {name}")
+    try:
+        return EFFECTS[name](shown, resolve, now, **params)
+    except TypeError as e:
+        raise ValueError(f"bad parameters for effect {name}: {e}")
@@ -3,30 +3,43 @@
 
 """
 
-Load initial middleware keys and values into redis.
+Load initial middleware keys and values into the database.
 
 """
 
 
 import json
 import os
-import redis
 
+import middleware as mw
 
-client = redis.Redis()
+
+# Enable the notifications of the database, once for every node.
+mw.connection.enable_notifications()
+
+# Store the defaults of every field, then override them with the initial config.
+mw.seed_all()
+
+
+def load(config):
+    """
+    Store the values of a config, that maps keys to values.
+    Keys of DBEntry fields are written by their entries, so values are validated and encoded as the fields do.
+    """
+    config = dict(config)
+    for entry_class in mw.registry.values():
+        values = {k: config.pop(f.key) for k, f in entry_class.schema.items() if f.key in config}
+        if values:
+            entry_class().update(values)
+    # keys of no entry
+    mw.set_many(config)
 
 
 # Load initial config.
 with open("../cfg/initial.json") as f:
-    config = json.load(f)
-
-for key, value in config.items():
-    client.set(key, json.dumps(value))
+    load(json.load(f))
 
 # Load custom robot config.
 if "elmo.json" in os.listdir("/home/idmind"):
     with open("/home/idmind/elmo.json") as f:
-        config = json.load(f)
-
-    for key, value in config.items():
-        client.set(key, json.dumps(value))
+        load(json.load(f))
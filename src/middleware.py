@@ -9,10 +9,19 @@ This module provides a set of classes to interact with the middleware.
 
 Defines several classes to interact with the underlying redis database.
 
+The database is accessed through a backend, defined in the middleware_backends module.
+By default the backend is a redis server, but an in-memory backend can be used to run nodes without one.
+
 Classes that extend DBEntry define data that will be stored in the database.
 
 Clients can use these classes to exchange messages between each other.
 
+Clients can watch fields for changes, instead of polling them, using the Watcher class.
+
+Fields that rarely change can be cached in process memory, by listing them in the cached attribute of a DBEntry.
+
+Fields can also keep a bounded history of their values, which clients read using the TimeSeries class.
+
 Additionally, the module defines several tools to manage node processes.
 
 Clients can use the Node class to signal that they are running, and check for shutdown events.
@@ -24,7 +33,6 @@ When used as a script, the module provides a command line interface to manage no
 """
 
 
-import redis
 import json
 import os
 import signal
@@ -32,33 +40,218 @@ import psutil
 import time
 import sys
 import requests
+import socket
+from urllib.parse import urlsplit, unquote
 from io import BytesIO
 from PIL import Image
 import threading
+import struct
+from array import array
+import numpy as np
+from collections import OrderedDict
+
+from middleware_backends import DEFAULT_URL, RedisBackend, MemoryBackend, SubscriptionClosed
 
 
 
 def get_connection():
     """
-    Get a connection to the redis database.
+    Get a connection to the database.
+    The backend is selected by the MIDDLEWARE_URL environment variable:
+    redis://host:port/db or unix:///path/to/socket connect to a redis server,
+    using a pool of connections limited by the max_connections query parameter, if given.
+    memory:// keeps the keys in process memory.
+    Defaults to the local redis server.
     """
-    return redis.Redis()
+    url = os.environ.get("MIDDLEWARE_URL", DEFAULT_URL)
+    if url.startswith("memory:"):
+        return MemoryBackend()
+    return RedisBackend(url)
 
 # global connection
 connection = get_connection()
 
+def set_backend(backend):
+    """
+    Replace the global connection with the given backend.
+    """
+    global connection, cache
+    cache.close()
+    connection = backend
+    cache = Cache()
+
+
+# values encoded with a binary codec start with this marker, followed by the codec name
+CODEC_MARKER = b"\x00"
+
+# binary codecs, by name
+codecs = {}
 
-def set_key(key, value):
+def register_codec(name, encode, decode):
+    """
+    Register a binary codec.
+    encode converts a value to bytes, raising ValueError or TypeError if it can not.
+    decode converts the bytes back to a value.
+    """
+    codecs[name] = (encode, decode)
+
+def encode_value(value, codec=None):
+    """
+    Encode a value to store in the redis database.
+    Uses the given binary codec, falling back to JSON if the codec can not encode the value.
+    """
+    if codec is not None:
+        encode, _ = codecs[codec]
+        try:
+            return CODEC_MARKER + codec.encode() + CODEC_MARKER + encode(value)
+        except (ValueError, TypeError, struct.error):
+            pass
+    return json.dumps(value)
+
+def decode_value(data):
+    """
+    Decode a value stored in the redis database.
+    The codec is identified by the type tag stored with the value.
+    """
+    if data[:1] == CODEC_MARKER:
+        end = data.index(CODEC_MARKER, 1)
+        _, decode = codecs[data[1:end].decode()]
+        return decode(data[end + 1:])
+    return json.loads(data)
+
+def encode_rgb8(colors):
+    if isinstance(colors, np.ndarray):
+        if colors.ndim != 2 or colors.shape[1] != 3:
+            raise ValueError("colors must be 3-tuples")
+        return colors.astype(np.uint8).tobytes()
+    data = bytes(c for color in colors for c in color)
+    if len(data) != 3 * len(colors):
+        raise ValueError("colors must be 3-tuples")
+    return data
+
+def decode_rgb8(data):
+    return [list(data[i:i + 3]) for i in range(0, len(data), 3)]
+
+def decode_rgb8_array(data):
+    return np.frombuffer(data, np.uint8).reshape(-1, 3)
+
+ANIMATION_HEADER = struct.Struct("<BHH")
+
+def encode_animation(animation):
+    mode = animation["mode"].encode()
+    frames = np.asarray(animation["frames"], np.uint8)
+    durations = array("d", animation["durations"])
+    if frames.ndim != 3 or frames.shape[2] != 3 or len(durations) != len(frames):
+        raise ValueError("frames must be lists of 3-tuples, with one duration each")
+    header = ANIMATION_HEADER.pack(len(mode), frames.shape[0], frames.shape[1])
+    return header + mode + durations.tobytes() + frames.tobytes()
+
+def decode_animation(data):
+    length, n_frames, n_colors = ANIMATION_HEADER.unpack_from(data)
+    start = ANIMATION_HEADER.size + length
+    end = start + 8 * n_frames
+    return {
+        "mode": data[ANIMATION_HEADER.size:start].decode(),
+        "durations": array("d", data[start:end]).tolist(),
+        "frames": np.frombuffer(data[end:], np.uint8).reshape(n_frames, n_colors, 3),
+    }
+
+# lists of rgb colors, with components between 0 and 255, packed as 3 bytes per color
+register_codec("rgb8", encode_rgb8, decode_rgb8)
+# the same, decoded as a read-only numpy array of shape (n, 3)
+register_codec("frame", encode_rgb8, decode_rgb8_array)
+# dicts with a play mode, frame durations in seconds and a frames array, packed as rgb8
+register_codec("animation", encode_animation, decode_animation)
+
+
+def set_key(key, value, codec=None, ttl=None):
     """
     Set a key in the redis database.
+    Optionally, encode the value with a binary codec.
+    Optionally, delete the key after ttl seconds.
     """
-    connection.set(key, json.dumps(value))
+    connection.set(key, encode_value(value, codec), ttl=ttl)
 
 def get_key(key):
     """
     Get a key from the redis database.
     """
-    return json.loads(connection.get(key))
+    return decode_value(connection.get(key))
+
+def set_many(values, codecs={}):
+    """
+    Set several keys in the redis database, in a single round trip.
+    Optionally, encode values with the binary codecs given for their keys.
+    """
+    if values:
+        connection.mset({k: encode_value(v, codecs.get(k)) for k, v in values.items()})
+
+def set_many_if(key, expected, values):
+    """
+    Set several keys in the redis database, atomically, only if key still holds the value expected.
+    Returns True if the keys were set.
+    """
+    return connection.mset_if(key, encode_value(expected), {k: encode_value(v) for k, v in values.items()})
+
+def get_many(keys, defaults={}, codecs={}):
+    """
+    Get several keys from the redis database, in a single round trip.
+    Returns a dict mapping each key to its value.
+    Missing keys that have a value in defaults are initialized with it,
+    encoded with the binary codec given for the key, if any.
+    Other missing keys are reported as None.
+    """
+    values = {}
+    missing = {}
+    for key, data in zip(keys, connection.mget(keys)):
+        if data is not None:
+            values[key] = decode_value(data)
+        elif key in defaults:
+            values[key] = missing[key] = defaults[key]
+        else:
+            values[key] = None
+    if missing:
+        # do not overwrite values written meanwhile by other clients
+        connection.set_missing({k: encode_value(v, codecs.get(k)) for k, v in missing.items()})
+    return values
+
+def read_many(*entries):
+    """
+    Read fields of several DBEntry objects, in a single round trip.
+    Each argument is either a DBEntry, to read all of its fields,
+    or a tuple with a DBEntry followed by the names of the fields to read.
+    Returns a list with one dict per argument, mapping field names to values.
+    """
+    reads = []
+    for entry in entries:
+        if isinstance(entry, DBEntry):
+            entry, fields = entry, tuple(entry.fields)
+        else:
+            entry, fields = entry[0], tuple(entry[1:]) or tuple(entry[0].fields)
+        reads.append((entry, fields))
+    keys = []
+    defaults = {}
+    key_codecs = {}
+    values = {}
+    versions = {}
+    for entry, fields in reads:
+        for k in fields:
+            field = entry.schema[k]
+            if field.cached:
+                found, value = cache.lookup(field.key)
+                if found:
+                    values[field.key] = value
+                    continue
+                versions[field.key] = cache.version(field.key)
+            keys.append(field.key)
+            defaults[field.key] = field.default
+            if field.codec is not None:
+                key_codecs[field.key] = field.codec
+    if keys:
+        values.update(get_many(keys, defaults, key_codecs))
+    for key, version in versions.items():
+        cache.store(key, values[key], version)
+    return [{k: values[entry.schema[k].key] for k in fields} for entry, fields in reads]
 
 def has_key(key):
     """
@@ -70,7 +263,7 @@ def has_any_key(prefix):
     """
     Check if any key with the given prefix exists in the redis database.
     """
-    return len(connection.keys(prefix + "*")) > 0
+    return has_any(prefix + "*")
 
 def delete_all():
     """
@@ -78,20 +271,276 @@ def delete_all():
     """
     connection.flushall()
 
+# number of keys fetched per SCAN and MGET request
+SCAN_BATCH = 100
+
+def scan_keys(*prefixes):
+    """
+    List keys from the redis database, without blocking it.
+    Optionally, filter by prefix. Filtering is done by the database.
+    """
+    keys = set()
+    for prefix in prefixes or ("",):
+        keys.update(k.decode() for k in connection.scan(prefix + "*", SCAN_BATCH))
+    return sorted(keys)
+
+def read_all(*prefixes):
+    """
+    Read keys from the redis database, in batches of SCAN_BATCH keys.
+    Optionally, filter by prefix.
+    Returns a dict mapping keys to values.
+    """
+    keys = scan_keys(*prefixes)
+    values = {}
+    for i in range(0, len(keys), SCAN_BATCH):
+        batch = keys[i:i + SCAN_BATCH]
+        for key, data in zip(batch, connection.mget(batch)):
+            # skip keys deleted since they were listed
+            if data is not None:
+                values[key] = decode_value(data)
+    return values
+
 def get_all(*prefixes):
     """
     Get all keys from the redis database.
     Optionally, filter by prefix.
     """
-    for k in sorted(connection.keys()):
-        if len(prefixes) == 0 or any([k.decode().startswith(p) for p in prefixes]):
-            print(f'{k.decode()}:\t{get_key(k.decode())}')
+    for key, value in read_all(*prefixes).items():
+        print(f'{key}:\t{value}')
+
+def collect_changes(subscription, rate=10.0, timeout=1.0):
+    """
+    Wait up to timeout seconds for a key notified by a subscription,
+    then collect the keys notified in the next 1 / rate seconds.
+    Returns the set of keys that changed, empty on timeout.
+    Time series are skipped, their keys hold streams, not values.
+    """
+    changed = set()
+    deadline = time.monotonic() + timeout
+    while not changed and time.monotonic() < deadline:
+        key = subscription.get(deadline - time.monotonic())
+        if key is not None and not key.startswith(SERIES_PREFIX):
+            changed.add(key)
+    deadline = time.monotonic() + 1.0 / rate
+    while changed and time.monotonic() < deadline:
+        key = subscription.get(deadline - time.monotonic())
+        if key is not None and not key.startswith(SERIES_PREFIX):
+            changed.add(key)
+    return changed
+
+def monitor_changes(*prefixes, rate=10.0):
+    """
+    Print keys from the redis database when they change.
+    Optionally, filter by prefix.
+    Changes are printed at most rate times per second,
+    keys that change several times in between are printed once, with their latest value.
+    """
+    subscription = connection.subscribe()
+    for prefix in prefixes or ("",):
+        subscription.add_pattern(prefix + "*")
+    try:
+        while True:
+            keys = sorted(collect_changes(subscription, rate))
+            if not keys:
+                continue
+            print("---")
+            for key, data in zip(keys, connection.mget(keys)):
+                value = "<deleted>" if data is None else decode_value(data)
+                print(f'{key}:\t{value}')
+    finally:
+        subscription.close()
 
 def has_any(key):
     """
     Check if any key with the given prefix exists in the redis database.
     """
-    return len(connection.keys(key)) > 0
+    return next(iter(connection.scan(key, SCAN_BATCH)), None) is not None
+
+class Watcher:
+    """
+    Watcher class.
+    Subscribes to changes of a set of keys, notified by the backend.
+    Use add() to watch a key.
+    Use wait() to block until any of the watched keys changes.
+    Use close() to unsubscribe.
+    """
+
+    def __init__(self, *keys):
+        self.names = {}
+        # node whose loop waits on the watcher, see Node.watch
+        self.node = None
+        self.subscription = connection.subscribe()
+        for key in keys:
+            self.add(key)
+
+    def add(self, key, name=None):
+        """
+        Watch a key.
+        wait() reports changes to the key using the given name, or the key itself.
+        """
+        self.names[key] = key if name is None else name
+        self.subscription.add(key)
+        return self
+
+    def wait(self, timeout=None):
+        """
+        Block until any watched key changes, or timeout seconds elapse.
+        Returns the set of names of the keys that changed, empty on timeout.
+        Changes that arrive together are reported at once.
+        """
+        if self.node is None:
+            return self._wait(timeout)
+        self.node.waiting = True
+        try:
+            return self._wait(timeout)
+        finally:
+            self.node.waiting = False
+            self.node.last_wake = time.time()
+
+    def _wait(self, timeout):
+        changed = set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not changed:
+            if deadline is None:
+                remaining = 1.0
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+            key = self.subscription.get(remaining)
+            if key in self.names:
+                changed.add(self.names[key])
+        # collect notifications that are already queued
+        while changed:
+            key = self.subscription.get(0)
+            if key is None:
+                break
+            if key in self.names:
+                changed.add(self.names[key])
+        return changed
+
+    def close(self):
+        self.subscription.close()
+
+
+# seconds after which cached values are read again, even without notifications
+CACHE_TTL = 5.0
+
+
+class Cache:
+    """
+    Cache class.
+    Keeps values of the middleware in process memory.
+    Values are invalidated when redis notifies a change of the key,
+    and expire after ttl seconds in case a notification is lost.
+    Use stats() to check the hit and miss counters.
+    """
+
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.values = {}
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.subscription = None
+
+    def lookup(self, key):
+        """
+        Look up a key.
+        Returns a tuple (found, value).
+        """
+        with self.lock:
+            if key in self.values:
+                value, timestamp = self.values[key]
+                if time.monotonic() - timestamp < self.ttl:
+                    self.hits += 1
+                    return True, value
+                del self.values[key]
+            self.misses += 1
+            return False, None
+
+    def version(self, key):
+        """
+        Get the version of a key, before reading it from redis.
+        Subscribes to notifications of the key on first use.
+        """
+        with self.lock:
+            if key not in self.versions:
+                self.versions[key] = 0
+                self._subscribe(key)
+            return self.versions[key]
+
+    def store(self, key, value, version):
+        """
+        Store a value read from redis.
+        The value is discarded if the key changed since version was taken.
+        """
+        with self.lock:
+            if self.versions.get(key) == version:
+                self.values[key] = (value, time.monotonic())
+
+    def invalidate(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+            if key in self.versions:
+                self.versions[key] += 1
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            for key in self.versions:
+                self.versions[key] += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.values),
+            }
+
+    def _subscribe(self, key):
+        if self.subscription is None:
+            self.subscription = connection.subscribe()
+            thread = threading.Thread(target=self._listen, args=(self.subscription,), daemon=True)
+            thread.start()
+        self.subscription.add(key)
+
+    def close(self):
+        """
+        Stop receiving notifications, and clear the cache.
+        """
+        if self.subscription is not None:
+            self.subscription.close()
+            self.subscription = None
+        self.clear()
+
+    def _listen(self, subscription):
+        try:
+            while self.subscription is subscription:
+                key = subscription.get(1.0)
+                if key is not None:
+                    self.invalidate(key)
+        except SubscriptionClosed:
+            # the subscription was closed by close()
+            pass
+
+
+# process-local cache, shared by all DBEntry objects
+cache = Cache()
+
+
+# seconds between heartbeats of a node
+HEARTBEAT_PERIOD = 0.25
+# seconds after which the heartbeat of a node expires, if it is not renewed
+HEARTBEAT_TTL = 1.0
+# seconds without loop iterations after which a node is considered stalled
+STALL_TIMEOUT = 0.5
+# loop periods without iterations after which a slow node is considered stalled
+STALL_PERIODS = 3
+# key written to ask every node to shutdown
+SHUTDOWN_ALL_KEY = "nodes_shutdown"
 
 
 class Node:
@@ -101,6 +550,8 @@ class Node:
     Use is_shutdown() to check if node should shutdown.
     Use shutdown() to signal node is shutting down.
     Use loginfo(), logwarn() and logerror() to log messages.
+    While running, the node publishes a heartbeat, with the rate and time of its last loop iteration.
+    Shutdown requests are pushed to the node, so is_shutdown() does not access the database.
     """
 
     INFO = 0
@@ -109,10 +560,24 @@ class Node:
 
     def __init__(self, name, log_level=INFO):
         self.name = name
+        self.log_level = log_level
+        self.shutdown_requested = threading.Event()
+        self.running = True
+        self.last_iteration = time.time()
+        self.iterations = 0
+        self.period = None
+        # whether the loop is blocked on a watcher of the node, and when it last woke up, see Node.watch
+        self.waiting = False
+        self.last_wake = None
         set_key("node_" + name, os.getpid())
         set_key(name + "_is_shutdown", False)
+        self.watcher = Watcher()
+        self.watcher.add(name + "_is_shutdown", "is_shutdown")
+        self.watcher.add(SHUTDOWN_ALL_KEY, "shutdown_all")
+        threading.Thread(target=self._listen, daemon=True).start()
+        self.beat()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
         print(f'{name}: running')
-        self.log_level = log_level
 
     def loginfo(self, message):
         if self.log_level <= Node.INFO:
@@ -130,11 +595,79 @@ class Node:
         self.log_level = level
 
     def is_shutdown(self):
-        return get_key(self.name + "_is_shutdown")
+        """
+        Check if the node should shutdown.
+        Call once per loop iteration, the calls are timed to publish the loop rate.
+        """
+        now = time.time()
+        if self.iterations > 0:
+            elapsed = now - self.last_iteration
+            self.period = elapsed if self.period is None else 0.8 * self.period + 0.2 * elapsed
+        self.iterations += 1
+        self.last_iteration = now
+        return self.shutdown_requested.is_set()
+
+    def watch(self, entry, *fields):
+        """
+        Watch fields of a DBEntry, along with shutdown requests.
+        Returns a Watcher, that reports shutdown requests as is_shutdown or shutdown_all.
+        Its waits are published in the heartbeat, so that a node blocked on it is not considered stalled.
+        """
+        watcher = Watcher()
+        watcher.node = self
+        watcher.add(self.name + "_is_shutdown", "is_shutdown")
+        watcher.add(SHUTDOWN_ALL_KEY, "shutdown_all")
+        return entry.watch(*fields, watcher=watcher)
+
+    def beat(self):
+        """
+        Publish the heartbeat of the node.
+        """
+        heartbeat = {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "last_iteration": self.last_iteration,
+            "rate": 0.0 if not self.period else 1.0 / self.period,
+            "waiting": self.waiting,
+            "last_wake": self.last_wake,
+        }
+        set_key("heartbeat_" + self.name, heartbeat, ttl=HEARTBEAT_TTL)
+
+    def _shutdown_flag(self):
+        """
+        Check the shutdown key of the node, which is deleted when the node shuts down.
+        """
+        data = connection.get(self.name + "_is_shutdown")
+        return data is not None and decode_value(data)
+
+    def _listen(self):
+        try:
+            while self.running:
+                changed = self.watcher.wait(1.0)
+                if "shutdown_all" in changed or ("is_shutdown" in changed and self._shutdown_flag()):
+                    self.shutdown_requested.set()
+        except SubscriptionClosed:
+            # the watcher was closed by shutdown()
+            pass
+
+    def _heartbeat(self):
+        shutdown_all = connection.get(SHUTDOWN_ALL_KEY)
+        while self.running:
+            time.sleep(HEARTBEAT_PERIOD)
+            if not self.running:
+                break
+            self.beat()
+            # in case a shutdown notification was lost
+            if self._shutdown_flag():
+                self.shutdown_requested.set()
+            data = connection.get(SHUTDOWN_ALL_KEY)
+            if data is not None and data != shutdown_all:
+                self.shutdown_requested.set()
 
     def shutdown(self):
-        connection.delete("node_" + self.name)
-        connection.delete(self.name + "_is_shutdown")
+        self.running = False
+        self.watcher.close()
+        connection.delete("node_" + self.name, self.name + "_is_shutdown", "heartbeat_" + self.name)
         print(f'{self.name}: shutdown')
 
 
@@ -144,24 +677,57 @@ class NodeManager:
     NodeManager class.
     Use this class to list, shutdown or kill all nodes.
     Nodes that hang can be force shutdown.
+    Use status() to check if a node is running, stalled or dead, based on its heartbeat.
     """
 
     def list_nodes(self):
-        return [k.decode()[5:] for k in connection.keys("node_*")]
+        return [k[5:] for k in scan_keys("node_")]
     
     def get_pid(self, name):
         return get_key("node_" + name)
 
+    def get_heartbeat(self, name):
+        data = connection.get("heartbeat_" + name)
+        return None if data is None else decode_value(data)
+
+    def status(self, name):
+        """
+        Get the status of a node.
+        dead: the heartbeat expired, the node process or its heartbeat thread stopped.
+        stalled: the node loop did not iterate for STALL_TIMEOUT seconds since it last iterated or woke up from a watcher.
+        Loops that do not wait on a watcher have STALL_PERIODS loop periods, if longer.
+        running: otherwise, or while the loop is blocked on a watcher, as an idle node is.
+        """
+        heartbeat = self.get_heartbeat(name)
+        if heartbeat is None:
+            return "dead"
+        if heartbeat.get("waiting"):
+            return "running"
+        timeout = STALL_TIMEOUT
+        last_wake = heartbeat.get("last_wake")
+        if last_wake is None and heartbeat["rate"] > 0:
+            # slow loops that sleep between iterations
+            timeout = max(timeout, STALL_PERIODS / heartbeat["rate"])
+        if time.time() - max(heartbeat["last_iteration"], last_wake or 0.0) > timeout:
+            return "stalled"
+        return "running"
+
     def is_running(self, name):        
         pid = self.get_pid(name)
         return psutil.pid_exists(pid)
 
     def is_alive(self, name):
-        return name in self.list_nodes() and self.is_running(name)
+        return name in self.list_nodes() and self.status(name) != "dead"
 
     def shutdown(self, name):
         if self.is_alive(name):
             set_key(name + "_is_shutdown", True)
+
+    def shutdown_all(self):
+        """
+        Ask every node to shutdown, with a single broadcast.
+        """
+        set_key(SHUTDOWN_ALL_KEY, time.time())
     
     def force_shutdown(self, name):
         if name in self.list_nodes():
@@ -170,8 +736,196 @@ class NodeManager:
                 os.kill(pid, signal.SIGKILL)
                 time.sleep(1.0)
             if not self.is_running(name):
-                connection.delete("node_" + name)
-                connection.delete(name + "_is_shutdown")
+                connection.delete("node_" + name, name + "_is_shutdown", "heartbeat_" + name)
+
+
+# number of values kept by a TimeSeries, unless told otherwise
+HISTORY_MAXLEN = 600
+# prefix of the keys of the streams that store time series
+SERIES_PREFIX = "series_"
+
+def id_to_time(entry_id):
+    return int(entry_id.split("-")[0]) / 1000.0
+
+def time_to_id(timestamp):
+    return str(int(timestamp * 1000))
+
+
+class TimeSeries:
+    """
+    TimeSeries class.
+    Bounded history of timestamped values, stored in a stream of the database.
+    Use append() to add a value.
+    Use range(), window() and latest() to read past values, as (timestamp, value) tuples.
+    Use tail() to read values as they are appended.
+    """
+
+    def __init__(self, name, maxlen=HISTORY_MAXLEN, codec=None):
+        self.name = name
+        self.key = SERIES_PREFIX + name
+        self.maxlen = maxlen
+        self.codec = codec
+        self.cursor = None
+
+    def append(self, value):
+        """
+        Append a value, timestamped with the current time.
+        Only the last maxlen values, approximately, are kept.
+        """
+        connection.stream_append(self.key, encode_value(value, self.codec), self.maxlen)
+
+    def range(self, start=None, end=None):
+        """
+        Read values appended between the timestamps start and end, in seconds since the epoch.
+        """
+        entries = connection.stream_range(
+            self.key,
+            None if start is None else time_to_id(start),
+            None if end is None else time_to_id(end),
+        )
+        return [(id_to_time(i), decode_value(v)) for i, v in entries]
+
+    def window(self, seconds):
+        """
+        Read values appended in the last seconds.
+        """
+        return self.range(time.time() - seconds)
+
+    def latest(self, count=1):
+        """
+        Read the last count values.
+        """
+        entries = connection.stream_revrange(self.key, count)
+        return [(id_to_time(i), decode_value(v)) for i, v in reversed(entries)]
+
+    def tail(self, timeout=None):
+        """
+        Read values appended since the previous call, or since the first call.
+        If there are none, wait up to timeout seconds for new values.
+        """
+        if self.cursor is None:
+            entries = connection.stream_revrange(self.key, 1)
+            self.cursor = entries[0][0] if entries else "0-0"
+        entries = connection.stream_read(self.key, self.cursor, timeout)
+        if entries:
+            self.cursor = entries[-1][0]
+        return [(id_to_time(i), decode_value(v)) for i, v in entries]
+
+
+class Field:
+
+    """
+    Field class.
+    Descriptor of a field of a DBEntry, created when the DBEntry subclass is defined.
+    The default attribute is the value stored on first access.
+    If kind is given, written values are converted to it.
+    If minimum or maximum are given, written values are clamped to them.
+    Limits can be numbers, or names of other fields of the same entry that hold the limit.
+    If history is given, the last history written values are also appended to a TimeSeries.
+    """
+
+    def __init__(self, default, kind=None, minimum=None, maximum=None, history=None):
+        self.default = default
+        self.kind = kind
+        self.minimum = minimum
+        self.maximum = maximum
+        self.history = history
+
+    def bind(self, entry_class, name):
+        """
+        Bind the field to a DBEntry subclass.
+        Precomputes the key used to store the field.
+        """
+        self.name = name
+        self.key = f'{entry_class.prefix}_{name}'
+        self.codec = entry_class.codecs.get(name)
+        self.cached = name in entry_class.cached
+        self.series = None
+        if self.history:
+            self.series = TimeSeries(self.key, self.history, self.codec)
+
+    def __get__(self, entry, owner=None):
+        if entry is None:
+            return self
+        pending = entry.pending
+        if pending is not None and self.name in pending:
+            # written in write-behind mode, not flushed yet
+            return pending[self.name]
+        if self.cached:
+            found, value = cache.lookup(self.key)
+            if not found:
+                version = cache.version(self.key)
+                value = self.read()
+                cache.store(self.key, value, version)
+            return value
+        return self.read()
+
+    def __set__(self, entry, value):
+        value = self.validate(entry, value)
+        if entry.pending is not None:
+            with entry.pending_lock:
+                if entry.pending is not None:
+                    entry.pending[self.name] = value
+                    return
+        set_key(self.key, value, self.codec)
+        if self.cached:
+            cache.invalidate(self.key)
+        if self.series is not None:
+            self.series.append(value)
+
+    def read(self):
+        data = connection.get(self.key)
+        if data is None:
+            # first access, store the default value
+            connection.set(self.key, encode_value(self.default, self.codec), nx=True)
+            return get_key(self.key)
+        return decode_value(data)
+
+    def validate(self, entry, value):
+        """
+        Convert and clamp a value before it is written.
+        None is always accepted.
+        """
+        if value is None:
+            return value
+        if self.kind is not None:
+            value = self.kind(value)
+        if self.minimum is not None:
+            minimum = getattr(entry, self.minimum) if isinstance(self.minimum, str) else self.minimum
+            value = max(minimum, value)
+        if self.maximum is not None:
+            maximum = getattr(entry, self.maximum) if isinstance(self.maximum, str) else self.maximum
+            value = min(maximum, value)
+        return value
+
+    def describe(self):
+        """
+        Describe the field, for tooling.
+        """
+        return {
+            "key": self.key,
+            "default": self.default,
+            "type": None if self.kind is None else self.kind.__name__,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "codec": self.codec,
+            "cached": self.cached,
+            "history": self.history,
+        }
+
+
+# DBEntry subclasses, by prefix
+registry = {}
+
+def seed_all():
+    """
+    Store the default value of every missing field of every DBEntry, in a single round trip.
+    """
+    connection.set_missing({
+        f.key: encode_value(f.default, f.codec)
+        for entry_class in registry.values()
+        for f in entry_class.schema.values()
+    })
 
 
 class DBEntry:
@@ -180,26 +934,188 @@ class DBEntry:
     DBEntry class.
     Extend this class to define data that will be stored in the database.
     The fields attribute defines the data that will be stored.
+    Values in fields are either default values or Field objects, to validate written values.
+    Each field becomes a Field descriptor of the class, listed in the schema attribute.
+    After the class is defined, fields maps names to default values.
     The prefix attribute defines the prefix that will be used to store the data.
+    The cached attribute lists fields that are kept in the process-local cache.
+    The codecs attribute maps fields to the binary codec used to store them, instead of JSON.
+    Use update() to write several fields in a single round trip.
+    Use write_behind() to buffer writes, and flush() to send them atomically, in a single round trip.
+    Subclasses are listed in the registry, by prefix.
     """
 
     prefix = ''
     fields = {}
-    def __init__(self):
-        for k in self.fields:
-            setattr(self.__class__, k, property(self.getter(k), self.setter(k)))
-    
-    def getter(self, key):
-        def do_get(self):
-            if not has_key(f'{self.prefix}_{key}'):
-                set_key(f'{self.prefix}_{key}', self.fields[key])
-            return get_key(f'{self.prefix}_{key}')
-        return do_get
-    
-    def setter(self, key):
-        def do_set(self, value):
-            set_key(f'{self.prefix}_{key}', value)
-        return do_set
+    schema = {}
+    cached = ()
+    codecs = {}
+    pending = None
+    flush_interval = None
+    flusher = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        schema = {}
+        for k, v in cls.fields.items():
+            field = v if isinstance(v, Field) else Field(v)
+            field.bind(cls, k)
+            setattr(cls, k, field)
+            schema[k] = field
+        cls.schema = schema
+        cls.fields = {k: field.default for k, field in schema.items()}
+        registry[cls.prefix] = cls
+
+    @classmethod
+    def seed(cls):
+        """
+        Store the default value of every field that is missing, in a single round trip.
+        """
+        connection.set_missing({f.key: encode_value(f.default, f.codec) for f in cls.schema.values()})
+
+    @classmethod
+    def describe(cls):
+        """
+        Describe the fields, for tooling.
+        """
+        return {k: field.describe() for k, field in cls.schema.items()}
+
+    def update(self, values):
+        """
+        Write several fields, validated and encoded as their descriptors do, in a single round trip.
+        values maps field names to values.
+        In write-behind mode, the writes are buffered.
+        """
+        values = {k: self.schema[k].validate(self, v) for k, v in values.items()}
+        if self.pending is not None:
+            with self.pending_lock:
+                if self.pending is not None:
+                    self.pending.update(values)
+                    return
+        self.send(values)
+
+    def update_if(self, name, expected, values):
+        """
+        Write several fields, as update does, only if the field name still holds the value expected, atomically.
+        The writes are not buffered in write-behind mode.
+        Returns True if the fields were written.
+        """
+        values = {k: self.schema[k].validate(self, v) for k, v in values.items()}
+        field = self.schema[name]
+        fields = [self.schema[k] for k in values]
+        encoded = {f.key: encode_value(values[f.name], f.codec) for f in fields}
+        if not connection.mset_if(field.key, encode_value(expected, field.codec), encoded):
+            return False
+        self.sent(values)
+        return True
+
+    def write_behind(self, interval=None):
+        """
+        Buffer writes to this object, instead of sending them right away.
+        Consecutive writes to a field are coalesced, the last one wins.
+        Buffered writes are sent by flush(),
+        which is called every interval seconds, if an interval is given.
+        Calling it again only changes the interval, a single thread flushes the object.
+        """
+        if "pending_lock" not in self.__dict__:
+            # never replaced, writers may hold it
+            self.pending_lock = threading.Lock()
+        with self.pending_lock:
+            if self.pending is None:
+                self.pending = {}
+            self.flush_interval = interval
+            if interval is None or self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self.flush_periodically, daemon=True)
+            self.flusher.start()
+
+    def flush_periodically(self):
+        """
+        Call flush() every flush_interval seconds, until writes are not buffered or no interval is set.
+        """
+        while True:
+            with self.pending_lock:
+                if self.pending is None or self.flush_interval is None:
+                    self.flusher = None
+                    return
+                interval = self.flush_interval
+            time.sleep(interval)
+            self.flush()
+
+    def write_through(self):
+        """
+        Flush buffered writes, and send further writes right away.
+        """
+        if self.pending is None:
+            return
+        with self.pending_lock:
+            # write_through may have been called meanwhile
+            if self.pending is None:
+                return
+            pending, self.pending = self.pending, None
+        self.send(pending)
+
+    def flush(self):
+        """
+        Send buffered writes, in a single transaction.
+        """
+        if self.pending is None:
+            return
+        with self.pending_lock:
+            # so that write_through, called meanwhile, is not undone
+            if self.pending is None:
+                return
+            pending, self.pending = self.pending, {}
+        self.send(pending)
+
+    def send(self, pending):
+        if not pending:
+            return
+        connection.mset({self.schema[k].key: encode_value(v, self.schema[k].codec) for k, v in pending.items()})
+        self.sent(pending)
+
+    def sent(self, pending):
+        """
+        Invalidate the cached fields that were written, and append them to their histories.
+        """
+        fields = [self.schema[k] for k in pending]
+        for field in fields:
+            if field.cached:
+                cache.invalidate(field.key)
+        # fields with a history of the same length are appended together
+        series = {}
+        for field in fields:
+            if field.series is not None:
+                series.setdefault(field.history, {})[field.series.key] = encode_value(pending[field.name], field.codec)
+        for maxlen, values in series.items():
+            connection.stream_append_many(values, maxlen)
+
+    def history(self, name):
+        """
+        Get the TimeSeries with the history of a field, or None if the field keeps no history.
+        """
+        return self.schema[name].series
+
+    def snapshot(self, *fields):
+        """
+        Read several fields in a single round trip.
+        Reads all fields if none are given.
+        Returns a dict mapping field names to values.
+        """
+        return read_many((self, *fields))[0]
+
+    def watch(self, *fields, watcher=None):
+        """
+        Watch fields for changes.
+        Watches all fields if none are given.
+        Adds the fields to watcher, if given, otherwise to a new Watcher.
+        The watcher reports changes using the field names.
+        """
+        if watcher is None:
+            watcher = Watcher()
+        for k in fields or self.fields:
+            watcher.add(self.schema[k].key, k)
+        return watcher
 
 
 class Robot(DBEntry):
@@ -231,12 +1147,28 @@ class Microphone(DBEntry):
     Set record to True to start recording.
     Set record to False to stop recording.
     Check is_recording to see if recording is in progress.
+    The microphone driver captures audio continuously, into the shared memory ring called ring, see audio_capture.
+    Check level for the RMS level of the audio, in dB full scale, updated level_rate times per second.
+    Check voice to see if voice is heard, and voice_started and voice_ended for the times (as time.time) it started and ended.
+    Set source to the path of a WAV file to capture it instead of the microphone, for tests.
     """
     prefix = "microphone"
     fields = {
+        "ready": False,
         "is_recording": False,
-        "record": False
+        "record": False,
+        "ring": "elmo_microphone",
+        "source": None,
+        "level": -96.0,
+        "level_rate": Field(10.0, float, 1.0, 50.0),
+        "noise_floor": -96.0,
+        "voice": False,
+        "voice_started": None,
+        "voice_ended": None,
+        "vad_threshold": Field(10.0, float, 0.0, 60.0),
+        "stats": {},
     }
+    cached = ("ring", "source", "level_rate")
 
 
 class Battery(DBEntry):
@@ -246,18 +1178,129 @@ class Battery(DBEntry):
     Check ready to see if battery driver is ready.
     Check raw to see the raw AD value.
     Check voltage to see the voltage.
+    Use history("voltage") or history("percentage") to read past values.
     Driver will connect to the battery at address defined by i2c_address.
     """
     prefix = "battery"
     fields = {
         'ready': False,
         'raw': 0,
-        'voltage': 0.0,
+        'voltage': Field(0.0, history=3000),
         'i2c_address': 0x48,
         'ad_at_13v': 619.517,
         'ad_at_16v': 765.021,
-        'percentage': 100.0
+        'percentage': Field(100.0, history=3000)
     }
+    cached = ('i2c_address', 'ad_at_13v', 'ad_at_16v')
+
+
+ICON_SIZE = 13
+ANIMATION_MODES = ("once", "hold", "loop")
+ICON_CACHE_BYTES = 8 * 1024 * 1024
+
+def decode_icon(data, size=ICON_SIZE):
+    """
+    Decode a PNG/GIF icon for the LED matrix.
+    Returns (frames, durations): a uint8 array of shape (n_frames, size*size, 3)
+    in LED order, and the duration of each frame in seconds.
+    LED index row*size + col shows pixel (size-1-col, row), so every frame is
+    converted once and mirrored horizontally with a slice.
+    """
+    image = Image.open(BytesIO(data))
+    n_frames = getattr(image, "n_frames", 1)
+    frames = np.empty((n_frames, size * size, 3), np.uint8)
+    durations = []
+    for i in range(n_frames):
+        image.seek(i)
+        rgb = np.asarray(image.convert("RGB"))[:size, :size]
+        frames[i] = rgb[:, ::-1].reshape(-1, 3)
+        durations.append(image.info.get("duration", 0) / 1000.0)
+    return frames, durations
+
+
+
+class IconCache:
+
+    """
+    IconCache class.
+    LRU cache of decoded icons, read from the files in path.
+    The cache is bounded by the size of the decoded frames, in bytes.
+    Icons are decoded again when the modification time of their file changes.
+    Use get to look up an icon by name, e.g. "music.png" or "emotions_game/heart.gif".
+    """
+
+    def __init__(self, path, max_bytes=ICON_CACHE_BYTES):
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        """
+        Get the decoded icon, as returned by decode_icon.
+        Raises FileNotFoundError if the icon does not exist.
+        """
+        path = os.path.abspath(os.path.join(self.path, name))
+        if not path.startswith(self.path + os.sep):
+            raise FileNotFoundError(name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self.invalidate(name)
+            raise
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] == mtime:
+            self.hits += 1
+            self.entries.move_to_end(name)
+            return entry[1], entry[2]
+        self.misses += 1
+        with open(path, "rb") as f:
+            frames, durations = decode_icon(f.read())
+        self.invalidate(name)
+        self.entries[name] = (mtime, frames, durations)
+        self.bytes += frames.nbytes
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, evicted, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+        return frames, durations
+
+    def invalidate(self, name=None):
+        """
+        Drop an icon from the cache, or all icons if no name is given.
+        """
+        if name is None:
+            self.entries.clear()
+            self.bytes = 0
+        elif name in self.entries:
+            self.bytes -= self.entries.pop(name)[1].nbytes
+
+    def warm_up(self):
+        """
+        Decode every icon in path, including subfolders.
+        Files that are not images are skipped.
+        Returns the number of icons decoded.
+        """
+        count = 0
+        for root, _, files in os.walk(self.path):
+            for f in sorted(files):
+                name = os.path.relpath(os.path.join(root, f), self.path)
+                try:
+                    self.get(name)
+                    count += 1
+                except OSError:
+                    pass
+        return count
+
+    def stats(self):
+        return {
+            "icons": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
 
 
 class Leds(DBEntry):
@@ -267,57 +1310,105 @@ class Leds(DBEntry):
     Set colors to a list of 3-element tuples to set the colors.
     The led matrix has 169 leds, arranged in a 13x13 grid.
     Set brightness to a value between 0.0 and 1.0 to set the brightness.
+    Use play to show an animation, that the leds driver plays until it ends or colors are set.
+    Use set_icon to show an icon of the http server, decoded and cached by the leds driver.
+    Set frame instead of colors to stream frames, packed and decoded as numpy arrays.
+    The leds driver shows at most max_fps frames per second, and publishes its frame rate in stats.
+    Frames streamed over udp to the robot api are written to frame, with the stream statistics in stream_stats.
+    Colors are gamma corrected, and changes of brightness are ramped over brightness_ramp seconds.
+    Use crossfade, pulse, wipe, scroll and sparkle to start effects rendered by the leds driver, see leds_effects.
     """
     prefix = "leds"
     fields = {
         'ready': False,
         'number': 169,
         'colors': [[0, 0, 0]] * 169,
-        'brightness': 0.3
+        'brightness': Field(0.3, float, 0.0, 1.0),
+        'brightness_ramp': Field(0.5, float, 0.0, 10.0),
+        'gamma': Field(2.2, float, 1.0, 3.0),
+        'frame': None,
+        'animation': None,
+        'icon': None,
+        'effect': None,
+        'max_fps': Field(60.0, float, 1.0, 60.0),
+        'stats': {},
+        'stream_stats': {},
+        'icon_cache_size': ICON_CACHE_BYTES,
+        'preload_icons': True
     }
+    cached = ('number', 'icon_cache_size', 'preload_icons', 'max_fps')
+    codecs = {'colors': 'rgb8', 'frame': 'frame', 'animation': 'animation'}
 
-    def load_from_url(self, url):
-        # gif
-        if ".gif" in url:
-            response = requests.get(url)
-            img = BytesIO(response.content)
-            image = Image.open(img)
-            # create image buffer
-            frames = []
-            try:
-                while 1:
-                    image.seek(image.tell() + 1)
-                    colors = []
-                    for row in range(13):
-                        for col in range(13):
-                            im = image.convert("RGB")
-                            color = im.getpixel((12 - col, row))[0:3]
-                            colors.append(color)
-                    frames.append(colors)
-            except EOFError:
-                final_color = [[0, 0, 0]] * self.number
-                frames.append(final_color)
-            # schedule the publishing of the messages
-            time_between_frames = image.info["duration"] / 1000.0
-            for i in range(len(frames)):
-                def set_colors(colors):
-                    def update_colors():
-                        self.colors = colors
-                    return update_colors
-                t = threading.Timer(time_between_frames * i, set_colors(frames[i]))
-                t.start()
+    def load_from_url(self, url, mode="once"):
+        frames, durations = decode_icon(Server().read(url))
+        if len(frames) == 1:
+            self.colors = frames[0]
         else:
-            colors = []
-            response = requests.get(url)
-            img = BytesIO(response.content)
-            image = Image.open(img)
-            for row in range(13):
-                for col in range(13):
-                    # color = image.getpixel((col, 12 - row))
-                    color = image.getpixel((12 - col, row))[0:3]
-                    colors.append(color)
-            self.colors = colors
-    
+            self.play(frames, durations, mode)
+
+    def set_icon(self, name, mode="once"):
+        """
+        Show an icon from the icons folder of the http server, e.g. "music.png".
+        Animated icons are played in the given mode, as with play.
+        """
+        if mode not in ANIMATION_MODES:
+            raise ValueError(f"unknown animation mode {mode}")
+        self.icon = {"name": name, "mode": mode}
+
+    def play(self, frames, durations, mode="once"):
+        """
+        Play an animation on the led matrix.
+        frames is a sequence of colors lists, durations the time each frame is shown, in seconds.
+        mode is "once" (clear the leds at the end), "hold" (keep the last frame) or "loop".
+        Replaces the animation being played, if any.
+        Setting colors also stops the animation.
+        """
+        if mode not in ANIMATION_MODES:
+            raise ValueError(f"unknown animation mode {mode}")
+        self.animation = {"mode": mode, "durations": list(durations), "frames": frames}
+
+    def stop(self):
+        """
+        Stop the animation being played, showing colors again.
+        """
+        self.animation = None
+
+    def crossfade(self, icon=None, color=(0, 0, 0), duration=1.0):
+        """
+        Fade from the colors shown to an icon, e.g. "music.png", or to a color.
+        """
+        self.effect = {"name": "crossfade", "icon": icon, "color": list(color), "duration": duration}
+
+    def pulse(self, color, period=1.0, minimum=0.0, duration=None):
+        """
+        Pulse a color once every period seconds, for duration seconds or until replaced.
+        """
+        self.effect = {"name": "pulse", "color": list(color), "period": period, "minimum": minimum, "duration": duration}
+
+    def wipe(self, color, duration=1.0, direction="down"):
+        """
+        Cover the colors shown with a color, moving in direction: "down", "up", "left" or "right".
+        """
+        self.effect = {"name": "wipe", "color": list(color), "duration": duration, "direction": direction}
+
+    def scroll(self, text=None, icon=None, color=(255, 255, 255), speed=8.0, loops=1):
+        """
+        Scroll text, or an icon, across the matrix at speed leds per second, loops times (0 is forever).
+        """
+        self.effect = {"name": "scroll", "text": text, "icon": icon, "color": list(color), "speed": speed, "loops": loops}
+
+    def sparkle(self, color, density=0.5, fade=0.3, duration=None):
+        """
+        Light random leds with a color, density times per led per second, fading out in fade seconds.
+        """
+        self.effect = {"name": "sparkle", "color": list(color), "density": density, "fade": fade, "duration": duration}
+
+    def stop_effect(self):
+        """
+        Stop the effect being rendered, showing colors again.
+        """
+        self.effect = None
+
     def clear(self):
         self.colors = [[0, 0, 0]] * self.number
 
@@ -351,6 +1442,21 @@ class GPIO(DBEntry):
         'button_pressed': False,
         'robot_shutdown': False,
     }
+    cached = ('button_pin', 'shutdown_pin', 'stay_enable_pin', 'audio_pin', 'monitor_pin')
+
+
+SPEAKER_CHANNELS = ("effects", "music", "speech")
+SOUND_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def speaker_field(channel, name):
+    """
+    Name of a field of Speakers for a channel, e.g. "music_url".
+    The fields of the effects channel have no prefix, e.g. "url".
+    """
+    if channel not in SPEAKER_CHANNELS:
+        raise ValueError(f"unknown speakers channel {channel}")
+    return name if channel == "effects" else f"{channel}_{name}"
 
 
 class Speakers(DBEntry):
@@ -360,14 +1466,79 @@ class Speakers(DBEntry):
     Set url to a url to play a sound.
     Set volume to a value between 0 and 100 to set the volume.
     Check playing to see if a sound is playing.
+    Check started and finished for the times (as time.time) the last sound started and finished being heard.
+    Sounds are mixed on the channels effects, music and speech, that play one sound each.
+    url, playing, started and finished are the fields of the effects channel, music_url or speech_url those of the others.
+    Use play and stop to play sounds on a channel.
+    Set effects_gain, music_gain and speech_gain between 0.0 and 1.0 to set the gain of a channel.
+    Music is ducked to duck_gain while effects or speech play, and effects while speech plays.
+    The volume is applied by the speakers driver, in software, and changes are ramped.
+    Set normalize to play sounds at the same loudness, or use set_sound_gain to set the gain of a sound.
+    Use preload to decode sounds ahead of time, in a cache of sound_cache_size bytes.
+    Check cache for its size and hits, and for the preloaded sounds that are resident or missing.
     """
     prefix = "speakers"
     fields = {
         "ready": False,
-        "volume": 70,
+        "volume": Field(70, int, 0, 100),
         "url": None,
         "playing": None,
+        "started": None,
+        "finished": None,
+        "music_url": None,
+        "music_playing": None,
+        "music_started": None,
+        "music_finished": None,
+        "speech_url": None,
+        "speech_playing": None,
+        "speech_started": None,
+        "speech_finished": None,
+        "effects_gain": Field(1.0, float, 0.0, 1.0),
+        "music_gain": Field(1.0, float, 0.0, 1.0),
+        "speech_gain": Field(1.0, float, 0.0, 1.0),
+        "duck_gain": Field(0.3, float, 0.0, 1.0),
+        "normalize": False,
+        "sound_gains": {},
+        "preload_urls": [],
+        "cache": {},
+        "sound_cache_size": SOUND_CACHE_BYTES,
     }
+    cached = ("sound_cache_size",)
+
+    def play(self, url, channel="effects"):
+        """
+        Play a sound on a channel, replacing the sound it plays.
+        """
+        setattr(self, speaker_field(channel, "url"), url)
+
+    def stop(self, channel=None):
+        """
+        Stop the sound of a channel, or of all channels if none is given.
+        """
+        channels = SPEAKER_CHANNELS if channel is None else (channel,)
+        self.update({speaker_field(c, "url"): None for c in channels})
+
+    def set_sound_gain(self, name, gain):
+        """
+        Set the gain a sound is played with, between 0.0 and 4.0, or None to play it as normalize says.
+        name is a name in the sounds folder of the http server, or a url, as for preload.
+        """
+        url = name if "://" in name else Server().url_for_sound(name)
+        gains = dict(self.sound_gains)
+        if gain is None:
+            gains.pop(url, None)
+        else:
+            gains[url] = min(max(float(gain), 0.0), 4.0)
+        self.sound_gains = gains
+
+    def preload(self, names):
+        """
+        Decode sounds ahead of time, so that they start without delay when played.
+        names are names in the sounds folder of the http server, e.g. "emotions_game/picture.wav", or urls.
+        Replaces the sounds preloaded before, which stay cached until they are evicted.
+        """
+        server = Server()
+        self.preload_urls = [name if "://" in name else server.url_for_sound(name) for name in names]
 
 
 class TouchSensors(DBEntry):
@@ -385,6 +1556,7 @@ class TouchSensors(DBEntry):
     Check head_1_raw to see the raw AD value.
     Check head_2_raw to see the raw AD value.
     Check head_3_raw to see the raw AD value.
+    Use history() with the name of a raw field to read its past values.
     """
     prefix = "touch_sensors"
     fields = {
@@ -394,24 +1566,25 @@ class TouchSensors(DBEntry):
         "touch_head_1": False,
         "touch_head_2": False,
         "touch_head_3": False,
-        "chest_raw": 0,
-        "head_0_raw": 0,
-        "head_1_raw": 0,
-        "head_2_raw": 0,
-        "head_3_raw": 0,
-        "sensitivity": 5,
+        "chest_raw": Field(0, history=HISTORY_MAXLEN),
+        "head_0_raw": Field(0, history=HISTORY_MAXLEN),
+        "head_1_raw": Field(0, history=HISTORY_MAXLEN),
+        "head_2_raw": Field(0, history=HISTORY_MAXLEN),
+        "head_3_raw": Field(0, history=HISTORY_MAXLEN),
+        "sensitivity": Field(5, int, 0),
     }
+    cached = ("sensitivity",)
 
     def head_touch(self):
         """
         Check if any head sensor is touched.
         """
-        return any((
-            self.touch_head_0,
-            self.touch_head_1,
-            self.touch_head_2,
-            self.touch_head_3,
-        ))
+        return any(self.snapshot(
+            "touch_head_0",
+            "touch_head_1",
+            "touch_head_2",
+            "touch_head_3",
+        ).values())
 
 
 class Pan(DBEntry):
@@ -427,27 +1600,29 @@ class Pan(DBEntry):
     Set pid_p to a value between 0 and 255 to set the proportional gain.
     Set pid_d to a value between 0 and 255 to set the derivative gain.
     Check temperature to see the temperature.
+    Use history("current_angle") or history("temperature") to read past values.
     """
     prefix = "pan"
     fields = {
         "ready": False,
         "id": 3,
-        "angle": 0,
-        "current_angle": 0,
+        "angle": Field(0, float, "min_angle", "max_angle"),
+        "current_angle": Field(0, history=HISTORY_MAXLEN),
         "angle_ref": None,
         "enable": False,
         "enabled": False,
-        "pid_p": 150,
+        "pid_p": Field(150, int, 0, 255),
         "pid_current_p": 0,
-        "pid_d": 100,
+        "pid_d": Field(100, int, 0, 255),
         "pid_current_d": 0,
         "max_angle": 40,
         "min_angle": -40,
         "min_playtime": 100,
         "max_playtime": 200,
-        "temperature": 0,
+        "temperature": Field(0, history=HISTORY_MAXLEN),
         "angle_bias": 12.0
     }
+    cached = ("id", "max_angle", "min_angle", "min_playtime", "max_playtime", "angle_bias")
 
 
 class Tilt(DBEntry):
@@ -463,27 +1638,29 @@ class Tilt(DBEntry):
     Set pid_p to a value between 0 and 255 to set the proportional gain.
     Set pid_d to a value between 0 and 255 to set the derivative gain.
     Check temperature to see the temperature.
+    Use history("current_angle") or history("temperature") to read past values.
     """
     prefix = "tilt"
     fields = {
         "ready": False,
         "id": 4,
-        "angle": 0,
-        "current_angle": 0,
+        "angle": Field(0, float, "min_angle", "max_angle"),
+        "current_angle": Field(0, history=HISTORY_MAXLEN),
         "angle_ref": None,
         "enable": False,
         "enabled": False,
-        "pid_p": 140,
+        "pid_p": Field(140, int, 0, 255),
         "pid_current_p": 0,
-        "pid_d": 100,
+        "pid_d": Field(100, int, 0, 255),
         "pid_current_d": 0,
         "max_angle": 15,
         "min_angle": -15,
         "min_playtime": 100,
         "max_playtime": 200,
-        "temperature": 0,
+        "temperature": Field(0, history=HISTORY_MAXLEN),
         "angle_bias": 2.3
     }
+    cached = ("id", "max_angle", "min_angle", "min_playtime", "max_playtime", "angle_bias")
 
 
 class Onboard(DBEntry):
@@ -496,6 +1673,7 @@ class Onboard(DBEntry):
     Set url to a url to open a url.
     Set video to a url to play a video.
     Check speech to see if speech is being recognized. 
+    Check speech_time for the time (as time.time) speech was recognized.
     """
     prefix = "onboard"
     fields = {
@@ -505,9 +1683,40 @@ class Onboard(DBEntry):
         "url": None,
         "video": None,
         "speech": None,
+        "speech_time": None,
     }
 
 
+class Keywords(DBEntry):
+    """
+    Database entry.
+    Keyword spotting information.
+    The keyword spotter recognizes the words of vocabulary in the audio of the microphone, offline, see keyword_spotting.
+    Recognized words are written to Onboard.speech, and to detected with their distance and the time they ended.
+    Words are recognized if their distance is below threshold. Check last for the distances of the last utterance.
+    Templates of the words are WAV files in templates_path/<word>/.
+    Use enroll to record the next utterance as a template of a word.
+    """
+    prefix = "keywords"
+    fields = {
+        "ready": False,
+        "vocabulary": ["yes", "no", "start", "stop", "angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"],
+        "threshold": Field(24.0, float, 0.0, 100.0),
+        "templates_path": "keywords",
+        "enrolling": None,
+        "detected": None,
+        "last": {},
+        "stats": {},
+    }
+    cached = ("templates_path",)
+
+    def enroll(self, word):
+        """
+        Record the next utterance as a template of a word, and add the word to the vocabulary.
+        """
+        self.enrolling = word
+
+
 class Speech(DBEntry):
     """
     Database entry.
@@ -516,6 +1725,9 @@ class Speech(DBEntry):
     Set language to a language code to set the language.
     Set say to a string to say something.
     Check saying to see what is being said.
+    Set engine to the synthesizer to use, "espeak" (offline) or "gtts", see speech_synth.
+    Rendered phrases are cached in cache_path, use prerender to render phrases ahead of time.
+    Check stats for the number of phrases cached, and the cache hits and misses.
     """
     prefix = "speech"
     fields = {
@@ -523,15 +1735,33 @@ class Speech(DBEntry):
         "language": "en",
         "say": None,
         "saying": None,
+        "engine": "espeak",
+        "phrases": [],
+        "cache_path": "speech_cache",
+        "stats": {},
     }
+    cached = ("cache_path",)
 
+    def prerender(self, phrases):
+        """
+        Render phrases in the current language, so they are said without delay.
+        The phrases are rendered again when the driver starts, or the engine changes, if they are not cached.
+        """
+        self.phrases = list(phrases)
+
+
+# host names of the http server, when the url is used on the robot
+MEDIA_HOSTS = ("elmo", "localhost", "127.0.0.1", socket.gethostname())
 
 class Server(DBEntry):
     """
     Database entry.
     Server information.
-    Configure the http server port, udp server port and api server port.
+    Configure the http server port, udp server port, api server port and the udp port of the leds stream.
     Configure the path to static resources, served by the http server.
+    icons_changed is set to the name of each icon uploaded or deleted through the http server.
+    Urls of static resources are used by browsers and remote clients.
+    Use resolve or read to access them from the disk instead, when running on the robot.
     """
     prefix = "server"
     fields = {
@@ -539,8 +1769,14 @@ class Server(DBEntry):
         "http_port": 8000,
         "udp_port": 5000,
         "api_port": 8001,
+        "leds_stream_port": 5001,
         "static_path": "static",
+        "icons_changed": None,
     }
+    cached = ("http_port", "udp_port", "api_port", "leds_stream_port", "static_path")
+
+    def path_for_icons(self):
+        return os.path.join(self.static_path, "icons")
 
     # def wait_for_ready(self):
     #     while not self.ready:
@@ -568,38 +1804,75 @@ class Server(DBEntry):
     
     def url_for_camera(self):
         return ""
-    
-    def get_image_list(self):
-        try:
-            url = self.url_for_image("")[:-1]
+
+    def path_for(self, kind, name=""):
+        return os.path.join(self.static_path, kind, name)
+
+    def path_for_image(self, name):
+        return self.path_for("images", name)
+
+    def path_for_sound(self, name):
+        return self.path_for("sounds", name)
+
+    def path_for_icon(self, name):
+        return self.path_for("icons", name)
+
+    def path_for_video(self, name):
+        return self.path_for("videos", name)
+
+    def resolve(self, url):
+        """
+        Resolve a url of the http server to the path of the file it serves, if the file is on this machine.
+        Paths and file:// urls are resolved to paths.
+        Returns None if the url can not be resolved.
+        """
+        parts = urlsplit(url)
+        if parts.scheme in ("", "file"):
+            return unquote(parts.path)
+        if parts.scheme != "http" or parts.hostname not in MEDIA_HOSTS or parts.port != self.http_port:
+            return None
+        static_path = os.path.abspath(self.static_path)
+        path = os.path.abspath(os.path.join(static_path, unquote(parts.path).lstrip("/")))
+        if path.startswith(static_path + os.sep) and os.path.isfile(path):
+            return path
+        return None
+
+    def read(self, url):
+        """
+        Read the content of a url, from the disk if it resolves to a path.
+        """
+        path = self.resolve(url)
+        if path is None:
             response = requests.get(url)
+            return response.content
+        with open(path, "rb") as f:
+            return f.read()
+
+    def get_list(self, kind):
+        """
+        List the files of a kind of media, e.g. "sounds".
+        Lists the static folder, if it is on this machine, otherwise asks the http server.
+        """
+        path = self.path_for(kind)
+        if os.path.isdir(path):
+            return os.listdir(path)
+        try:
+            response = requests.get("http://elmo:8000/" + kind)
             return response.json()
         except:
             return []
+
+    def get_image_list(self):
+        return self.get_list("images")
     
     def get_sound_list(self):
-        try:
-            url = self.url_for_sound("")[:-1]
-            response = requests.get(url)
-            return response.json()
-        except:
-            return []
+        return self.get_list("sounds")
     
     def get_icon_list(self):
-        try:
-            url = self.url_for_icon("")[:-1]
-            response = requests.get(url)
-            return response.json()
-        except:
-            return []
+        return self.get_list("icons")
     
     def get_video_list(self):
-        try:
-            url = self.url_for_video("")[:-1]
-            response = requests.get(url)
-            return response.json()
-        except:
-            return []
+        return self.get_list("videos")
 
 
 class Power(DBEntry):
@@ -639,7 +1912,7 @@ class Behaviours(DBEntry):
 
 
 if __name__ == '__main__':
-    usage = "usage: python3 middleware.py <list|killall|shutdown|force_shutdown|state|monitor|reset>"
+    usage = "usage: python3 middleware.py <list|status|killall|shutdown|force_shutdown|state [prefix...]|monitor [--delta] [--rate hz] [prefix...]|reset|seed|schema>"
     if len(sys.argv) == 1:
         print(usage)
         sys.exit(1)
@@ -647,9 +1920,18 @@ if __name__ == '__main__':
     if sys.argv[1] == "list":
         node_list = manager.list_nodes()
         print(json.dumps(sorted(node_list), indent=2))
+    elif sys.argv[1] == "status":
+        status = {}
+        for name in sorted(manager.list_nodes()):
+            heartbeat = manager.get_heartbeat(name)
+            status[name] = {
+                "status": manager.status(name),
+                "rate": None if heartbeat is None else round(heartbeat["rate"], 1),
+                "last_iteration": None if heartbeat is None else round(time.time() - heartbeat["last_iteration"], 2),
+            }
+        print(json.dumps(status, indent=2))
     elif sys.argv[1] == "killall":
-        for name in manager.list_nodes():
-            manager.shutdown(name)
+        manager.shutdown_all()
     elif sys.argv[1] == "shutdown":
         if len(sys.argv) != 3:
             print("usage: python3 middleware.py shutdown <node_name>")
@@ -661,17 +1943,34 @@ if __name__ == '__main__':
             sys.exit(1)
         manager.force_shutdown(sys.argv[2])
     elif sys.argv[1] == "state":
-        get_all()
+        get_all(*sys.argv[2:])
     elif sys.argv[1] == "monitor":
+        args = sys.argv[2:]
+        delta = "--delta" in args
+        if delta:
+            args.remove("--delta")
+        rate = 10.0
+        if "--rate" in args:
+            i = args.index("--rate")
+            rate = float(args[i + 1])
+            del args[i:i + 2]
         try:
-            while True:
-                print("---")
-                get_all(*sys.argv[2:])
-                time.sleep(0.1)
+            if delta:
+                monitor_changes(*args, rate=rate)
+            else:
+                while True:
+                    print("---")
+                    get_all(*args)
+                    time.sleep(1.0 / rate)
         except KeyboardInterrupt:
             pass
     elif sys.argv[1] == "reset":
         delete_all()
+    elif sys.argv[1] == "seed":
+        seed_all()
+    elif sys.argv[1] == "schema":
+        schema = {prefix: entry_class.describe() for prefix, entry_class in registry.items()}
+        print(json.dumps(schema, indent=2))
     else:
         print(usage)
         sys.exit(1)
@@ -0,0 +1,557 @@
+#! /usr/bin/env python
+
+
+"""
+
+Middleware backends.
+
+This module defines the storage used by the middleware.
+
+The RedisBackend class stores keys in a redis server, shared by every node of the robot.
+
+The MemoryBackend class stores keys in process memory, so nodes can run without a redis server,
+for instance to drive several nodes from a single process in benchmarks and tests.
+
+Both backends notify subscribers when keys change, so they can be used interchangeably.
+
+Both backends also store streams: bounded sequences of timestamped values.
+Each stream entry has an id "<milliseconds>-<sequence>", where milliseconds is the time the entry was added.
+
+"""
+
+
+import fnmatch
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+import redis
+
+
+# default redis server
+DEFAULT_URL = "redis://localhost:6379/0"
+
+# prefix of the channels where redis publishes keyspace notifications, for a database number
+KEYSPACE_CHANNEL = "__keyspace@%d__:"
+# keyspace notification flags needed by subscriptions: keyspace events, of all commands
+NOTIFY_FLAGS = "KA"
+
+
+class SubscriptionClosed(Exception):
+    """
+    Raised when waiting on a subscription that was closed.
+    """
+
+
+class Backend:
+    """
+    Backend class.
+    Interface of the storage used by the middleware.
+    Keys are strings, values are bytes.
+    Values are returned as bytes, or None if the key does not exist.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, nx=False, ttl=None):
+        """
+        Set a key.
+        If nx is True, only set the key if it does not exist.
+        If ttl is given, the key is deleted after ttl seconds.
+        """
+        raise NotImplementedError
+
+    def mget(self, keys):
+        raise NotImplementedError
+
+    def mset(self, values):
+        """
+        Set several keys, atomically.
+        """
+        raise NotImplementedError
+
+    def set_missing(self, values):
+        """
+        Set each key that does not exist yet.
+        """
+        raise NotImplementedError
+
+    def mset_if(self, key, expected, values):
+        """
+        Set several keys, atomically, only if key holds expected.
+        Returns True if the keys were set.
+        """
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def keys(self, pattern="*"):
+        """
+        List keys matching a glob pattern, as bytes.
+        Blocks the backend until every key is checked, prefer scan().
+        """
+        raise NotImplementedError
+
+    def scan(self, pattern="*", count=100):
+        """
+        Iterate over keys matching a glob pattern, as bytes.
+        Keys are fetched in batches of about count keys, without blocking the backend.
+        """
+        raise NotImplementedError
+
+    def flushall(self):
+        raise NotImplementedError
+
+    def enable_notifications(self):
+        """
+        Enable the notifications needed by subscriptions, if the backend needs it.
+        """
+        pass
+
+    def subscribe(self):
+        """
+        Create a Subscription, to be notified of changes to keys.
+        """
+        raise NotImplementedError
+
+    def stream_append(self, key, value, maxlen):
+        """
+        Append a value to a stream, keeping about the last maxlen values.
+        Returns the id of the entry.
+        """
+        raise NotImplementedError
+
+    def stream_append_many(self, values, maxlen):
+        """
+        Append values to several streams, in a single round trip.
+        values maps stream keys to values.
+        """
+        raise NotImplementedError
+
+    def stream_range(self, key, start=None, end=None, count=None):
+        """
+        List entries of a stream, as (id, value) tuples, oldest first.
+        start and end are optional ids, both inclusive.
+        If count is given, list up to count entries.
+        """
+        raise NotImplementedError
+
+    def stream_revrange(self, key, count):
+        """
+        List the last count entries of a stream, as (id, value) tuples, newest first.
+        """
+        raise NotImplementedError
+
+    def stream_read(self, key, after, timeout):
+        """
+        List entries of a stream added after the id after, as (id, value) tuples.
+        If there are none, wait up to timeout seconds for new entries.
+        after can be "$" to only list entries added from now on.
+        """
+        raise NotImplementedError
+
+
+class Subscription:
+    """
+    Subscription class.
+    Use add() to be notified of changes to a key.
+    Use get() to wait for the next change.
+    Use close() to stop receiving notifications.
+    """
+
+    def add(self, key):
+        raise NotImplementedError
+
+    def add_pattern(self, pattern):
+        """
+        Be notified of changes to every key matching a glob pattern.
+        """
+        raise NotImplementedError
+
+    def get(self, timeout):
+        """
+        Wait up to timeout seconds for a change.
+        Returns the changed key, or None on timeout.
+        Raises SubscriptionClosed if the subscription is closed.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class RedisBackend(Backend):
+    """
+    RedisBackend class.
+    Stores keys in a redis server.
+    url selects the server, either redis://host:port/db for tcp or unix:///path/to/socket for a unix socket.
+    Connections are taken from a pool of up to max_connections connections.
+    Changes are notified using redis keyspace notifications.
+    """
+
+    def __init__(self, url=DEFAULT_URL, max_connections=None):
+        self.pool = redis.ConnectionPool.from_url(url, max_connections=max_connections)
+        self.client = redis.Redis(connection_pool=self.pool)
+        self.keyspace = KEYSPACE_CHANNEL % int(self.pool.connection_kwargs.get("db", 0))
+        self.notifications_enabled = False
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, nx=False, ttl=None):
+        px = None if ttl is None else max(1, int(ttl * 1000))
+        self.client.set(key, value, nx=nx, px=px)
+
+    def mget(self, keys):
+        return self.client.mget(keys)
+
+    def mset(self, values):
+        self.client.mset(values)
+
+    def set_missing(self, values):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipeline.set(key, value, nx=True)
+        pipeline.execute()
+
+    def mset_if(self, key, expected, values):
+        with self.client.pipeline() as pipeline:
+            try:
+                pipeline.watch(key)
+                if pipeline.get(key) != to_bytes(expected):
+                    return False
+                pipeline.multi()
+                pipeline.mset(values)
+                pipeline.execute()
+                return True
+            except redis.WatchError:
+                # key changed since it was read
+                return False
+
+    def exists(self, key):
+        return self.client.exists(key) != 0
+
+    def delete(self, *keys):
+        self.client.delete(*keys)
+
+    def keys(self, pattern="*"):
+        return self.client.keys(pattern)
+
+    def scan(self, pattern="*", count=100):
+        return self.client.scan_iter(match=pattern, count=count)
+
+    def flushall(self):
+        self.client.flushall()
+
+    def enable_notifications(self):
+        """
+        Enable keyspace notifications in the redis server, a setting of the whole server.
+        Adds the flags that are missing to the current ones, so the server is only changed if needed.
+        Called by load_config when the robot starts, and by subscribe in case it was not.
+        """
+        if self.notifications_enabled:
+            return
+        try:
+            current = self.client.config_get("notify-keyspace-events").get("notify-keyspace-events", "")
+            if isinstance(current, bytes):
+                current = current.decode()
+            missing = "".join(flag for flag in NOTIFY_FLAGS if flag not in current)
+            if missing:
+                self.client.config_set("notify-keyspace-events", current + missing)
+        except redis.ResponseError:
+            # CONFIG may be disabled, notifications must then be enabled in redis.conf
+            pass
+        self.notifications_enabled = True
+
+    def subscribe(self):
+        self.enable_notifications()
+        return RedisSubscription(self.client, self.keyspace)
+
+    def stream_append(self, key, value, maxlen):
+        return self.client.xadd(key, {"v": value}, maxlen=maxlen, approximate=True).decode()
+
+    def stream_append_many(self, values, maxlen):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipeline.xadd(key, {"v": value}, maxlen=maxlen, approximate=True)
+        pipeline.execute()
+
+    def stream_range(self, key, start=None, end=None, count=None):
+        entries = self.client.xrange(key, start or "-", end or "+", count=count)
+        return [(entry_id.decode(), fields[b"v"]) for entry_id, fields in entries]
+
+    def stream_revrange(self, key, count):
+        entries = self.client.xrevrange(key, count=count)
+        return [(entry_id.decode(), fields[b"v"]) for entry_id, fields in entries]
+
+    def stream_read(self, key, after, timeout):
+        block = 0 if timeout is None else max(1, int(timeout * 1000))
+        streams = self.client.xread({key: after}, block=block)
+        if not streams:
+            return []
+        return [(entry_id.decode(), fields[b"v"]) for entry_id, fields in streams[0][1]]
+
+
+class RedisSubscription(Subscription):
+    """
+    RedisSubscription class.
+    Subscribes to the keyspace notification channels of the keys, in the database of the backend.
+    """
+
+    def __init__(self, client, keyspace):
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self.keyspace = keyspace
+        self.closed = False
+
+    def add(self, key):
+        self.pubsub.subscribe(self.keyspace + key)
+
+    def add_pattern(self, pattern):
+        self.pubsub.psubscribe(self.keyspace + pattern)
+
+    def get(self, timeout):
+        if self.closed:
+            raise SubscriptionClosed()
+        try:
+            message = self.pubsub.get_message(timeout=timeout)
+        except redis.ConnectionError:
+            if self.closed:
+                raise SubscriptionClosed()
+            raise
+        if self.closed:
+            raise SubscriptionClosed()
+        if message is None or message["type"] not in ("message", "pmessage"):
+            return None
+        return message["channel"].decode()[len(self.keyspace):]
+
+    def close(self):
+        self.closed = True
+        self.pubsub.close()
+
+
+class MemoryBackend(Backend):
+    """
+    MemoryBackend class.
+    Stores keys in process memory.
+    Safe to use from several threads of the same process.
+    Subscribers are notified of every write or deletion of a key, like redis keyspace notifications.
+    Keys with a ttl are deleted when they are accessed after expiring.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+        self.subscriptions = {}
+        self.pattern_subscriptions = {}
+        self.streams = {}
+        self.last_stream_id = (0, 0)
+        self.lock = threading.RLock()
+        self.stream_condition = threading.Condition(self.lock)
+
+    def get(self, key):
+        with self.lock:
+            self.expire()
+            return self.values.get(key)
+
+    def set(self, key, value, nx=False, ttl=None):
+        with self.lock:
+            self.expire()
+            if nx and key in self.values:
+                return
+            self.values[key] = to_bytes(value)
+            if ttl is None:
+                self.expiry.pop(key, None)
+            else:
+                self.expiry[key] = time.monotonic() + ttl
+            self.notify(key)
+
+    def mget(self, keys):
+        with self.lock:
+            self.expire()
+            return [self.values.get(key) for key in keys]
+
+    def mset(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] = to_bytes(value)
+                self.expiry.pop(key, None)
+            for key in values:
+                self.notify(key)
+
+    def set_missing(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self.set(key, value, nx=True)
+
+    def mset_if(self, key, expected, values):
+        with self.lock:
+            self.expire()
+            if self.values.get(key) != to_bytes(expected):
+                return False
+            self.mset(values)
+            return True
+
+    def exists(self, key):
+        with self.lock:
+            self.expire()
+            return key in self.values or key in self.streams
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.expiry.pop(key, None)
+                found = self.streams.pop(key, None) is not None
+                if self.values.pop(key, None) is not None or found:
+                    self.notify(key)
+
+    def expire(self):
+        """
+        Delete expired keys.
+        """
+        if self.expiry:
+            now = time.monotonic()
+            self.delete(*[k for k, deadline in self.expiry.items() if deadline <= now])
+
+    def keys(self, pattern="*"):
+        with self.lock:
+            self.expire()
+            return [k.encode() for k in list(self.values) + list(self.streams) if fnmatch.fnmatchcase(k, pattern)]
+
+    def scan(self, pattern="*", count=100):
+        return iter(self.keys(pattern))
+
+    def flushall(self):
+        with self.lock:
+            self.delete(*list(self.values), *list(self.streams))
+
+    def subscribe(self):
+        return MemorySubscription(self)
+
+    def stream_append(self, key, value, maxlen):
+        with self.lock:
+            ms = int(time.time() * 1000)
+            if ms > self.last_stream_id[0]:
+                self.last_stream_id = (ms, 0)
+            else:
+                self.last_stream_id = (self.last_stream_id[0], self.last_stream_id[1] + 1)
+            entry_id = "%d-%d" % self.last_stream_id
+            if key not in self.streams or self.streams[key].maxlen != maxlen:
+                self.streams[key] = deque(self.streams.get(key, ()), maxlen=maxlen)
+            self.streams[key].append((entry_id, to_bytes(value)))
+            self.notify(key)
+            self.stream_condition.notify_all()
+            return entry_id
+
+    def stream_append_many(self, values, maxlen):
+        with self.lock:
+            for key, value in values.items():
+                self.stream_append(key, value, maxlen)
+
+    def stream_range(self, key, start=None, end=None, count=None):
+        with self.lock:
+            entries = [
+                (entry_id, value) for entry_id, value in self.streams.get(key, ())
+                if (start is None or parse_id(entry_id) >= parse_id(start))
+                and (end is None or parse_id(entry_id) <= parse_id(end, upper=True))
+            ]
+            return entries if count is None else entries[:count]
+
+    def stream_revrange(self, key, count):
+        with self.lock:
+            return list(islice(reversed(self.streams.get(key, ())), count))
+
+    def stream_read(self, key, after, timeout):
+        with self.lock:
+            if after == "$":
+                after = "%d-%d" % self.last_stream_id
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                entries = [e for e in self.streams.get(key, ()) if parse_id(e[0]) > parse_id(after)]
+                if entries:
+                    return entries
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return []
+                self.stream_condition.wait(remaining)
+
+    def notify(self, key):
+        for subscription in self.subscriptions.get(key, ()):
+            subscription.push(key)
+        for pattern, subscriptions in self.pattern_subscriptions.items():
+            if fnmatch.fnmatchcase(key, pattern):
+                for subscription in subscriptions:
+                    subscription.push(key)
+
+
+class MemorySubscription(Subscription):
+    """
+    MemorySubscription class.
+    Queues the changes notified by a MemoryBackend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.keys = set()
+        self.patterns = set()
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def add(self, key):
+        with self.backend.lock:
+            self.keys.add(key)
+            self.backend.subscriptions.setdefault(key, set()).add(self)
+
+    def add_pattern(self, pattern):
+        with self.backend.lock:
+            self.patterns.add(pattern)
+            self.backend.pattern_subscriptions.setdefault(pattern, set()).add(self)
+
+    def push(self, key):
+        with self.condition:
+            self.queue.append(key)
+            self.condition.notify()
+
+    def get(self, timeout):
+        with self.condition:
+            if not self.queue and not self.closed:
+                self.condition.wait(timeout)
+            if self.closed:
+                raise SubscriptionClosed()
+            if not self.queue:
+                return None
+            return self.queue.popleft()
+
+    def close(self):
+        with self.backend.lock:
+            for key in self.keys:
+                self.backend.subscriptions[key].discard(self)
+            for pattern in self.patterns:
+                self.backend.pattern_subscriptions[pattern].discard(self)
+            self.keys.clear()
+            self.patterns.clear()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def parse_id(entry_id, upper=False):
+    """
+    Parse a stream entry id to a comparable tuple.
+    An id without sequence number matches any sequence, from the start, or the end if upper.
+    """
+    ms, _, seq = entry_id.partition("-")
+    if not seq:
+        return (int(ms), float("inf") if upper else 0)
+    return (int(ms), int(seq))
+
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
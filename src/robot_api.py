@@ -4,7 +4,9 @@
 import time
 import threading
 import socket
+import struct
 import json
+import numpy as np
 from flask import Flask, jsonify, request
 from werkzeug.utils import secure_filename
 import logging
@@ -16,6 +18,18 @@ import middleware as mw
 
 SERVER_PORT = 8001
 
+# leds stream packets: magic, sequence number and sender time, followed by 3 bytes per led
+# every packet is acknowledged with the same header, and the ack magic
+STREAM_HEADER = struct.Struct("!4sId")
+STREAM_MAGIC = b"LEDS"
+STREAM_ACK_MAGIC = b"LACK"
+STREAM_STATS_PERIOD = 1.0
+# sequence numbers further behind than this are a new stream, from a restarted sender
+STREAM_RESTART_WINDOW = 1000
+# sequence numbers further ahead than this many seconds of frames, at the highest frame rate of the leds,
+# are a new stream too, rather than lost packets
+STREAM_RESTART_TIME = 1.0
+
 
 app = Flask(
     __name__,
@@ -38,66 +52,52 @@ class Robot:
     mw_behaviours = mw.Behaviours()
 
     def __init__(self):
-        self.battery = self.mw_battery.voltage
-        self.battery_percentage = self.mw_battery.percentage
-        self.pan = self.mw_pan.current_angle
-        self.tilt = self.mw_tilt.current_angle
-        self.pan_min = self.mw_pan.min_angle
-        self.pan_max = self.mw_pan.max_angle
-        self.tilt_min = self.mw_tilt.min_angle
-        self.tilt_max = self.mw_tilt.max_angle
-        self.pan_torque = self.mw_pan.enabled
-        self.tilt_torque = self.mw_tilt.enabled
-        self.pan_temperature = self.mw_pan.temperature
-        self.tilt_temperature = self.mw_tilt.temperature
-        self.touch_chest = self.mw_touch_sensors.touch_chest
-        self.touch_head_n = self.mw_touch_sensors.touch_head_0
-        self.touch_head_s = self.mw_touch_sensors.touch_head_1
-        self.touch_head_e = self.mw_touch_sensors.touch_head_2
-        self.touch_head_w = self.mw_touch_sensors.touch_head_3
-        self.behaviour_look_around = self.mw_behaviours.look_around
-        self.behaviour_blush = self.mw_behaviours.blush
-        self.video_list = self.mw_server.get_video_list()
-        self.sound_list = self.mw_server.get_sound_list()
-        self.image_list = self.mw_server.get_image_list()
-        self.icon_list = self.mw_server.get_icon_list()
-        self.volume = self.mw_speakers.volume
-        self.multimedia_port = self.mw_server.http_port
-        self.microphone_is_recording = self.mw_microphone.is_recording
-        self.recognized_speech = self.mw_onboard.speech
+        self.update()
 
     def update(self):
-        self.battery = self.mw_battery.voltage
-        self.battery_percentage = self.mw_battery.percentage
-        self.pan = self.mw_pan.current_angle
-        self.tilt = self.mw_tilt.current_angle
-        self.pan_min = self.mw_pan.min_angle
-        self.pan_max = self.mw_pan.max_angle
-        self.tilt_min = self.mw_tilt.min_angle
-        self.tilt_max = self.mw_tilt.max_angle
-        self.pan_torque = self.mw_pan.enabled
-        self.tilt_torque = self.mw_tilt.enabled
-        self.pan_temperature = self.mw_pan.temperature
-        self.tilt_temperature = self.mw_tilt.temperature
-        self.touch_chest = self.mw_touch_sensors.touch_chest
-        self.touch_head_n = self.mw_touch_sensors.touch_head_0
-        self.touch_head_s = self.mw_touch_sensors.touch_head_1
-        self.touch_head_e = self.mw_touch_sensors.touch_head_2
-        self.touch_head_w = self.mw_touch_sensors.touch_head_3
-        self.behaviour_look_around = self.mw_behaviours.look_around
-        self.behaviour_blush = self.mw_behaviours.blush
-        self.video_list = self.mw_server.get_video_list()
-        self.sound_list = self.mw_server.get_sound_list()
-        self.image_list = self.mw_server.get_image_list()
-        self.icon_list = self.mw_server.get_icon_list()
-        self.volume = self.mw_speakers.volume
-        self.multimedia_port = self.mw_server.http_port
-        self.microphone_is_recording = self.mw_microphone.is_recording
-        self.recognized_speech = self.mw_onboard.speech
+        # read every field in a single round trip to the middleware
+        battery, pan, tilt, touch, behaviours, speakers, server, microphone, onboard, leds = mw.read_many(
+            (self.mw_battery, "voltage", "percentage"),
+            (self.mw_pan, "current_angle", "min_angle", "max_angle", "enabled", "temperature"),
+            (self.mw_tilt, "current_angle", "min_angle", "max_angle", "enabled", "temperature"),
+            (self.mw_touch_sensors, "touch_chest", "touch_head_0", "touch_head_1", "touch_head_2", "touch_head_3"),
+            (self.mw_behaviours, "look_around", "blush"),
+            (self.mw_speakers, "volume"),
+            (self.mw_server, "http_port", "leds_stream_port"),
+            (self.mw_microphone, "is_recording"),
+            (self.mw_onboard, "speech"),
+            (self.mw_leds, "stats", "stream_stats"),
+        )
+        self.battery = battery["voltage"]
+        self.battery_percentage = battery["percentage"]
+        self.pan = pan["current_angle"]
+        self.tilt = tilt["current_angle"]
+        self.pan_min = pan["min_angle"]
+        self.pan_max = pan["max_angle"]
+        self.tilt_min = tilt["min_angle"]
+        self.tilt_max = tilt["max_angle"]
+        self.pan_torque = pan["enabled"]
+        self.tilt_torque = tilt["enabled"]
+        self.pan_temperature = pan["temperature"]
+        self.tilt_temperature = tilt["temperature"]
+        self.touch_chest = touch["touch_chest"]
+        self.touch_head_n = touch["touch_head_0"]
+        self.touch_head_s = touch["touch_head_1"]
+        self.touch_head_e = touch["touch_head_2"]
+        self.touch_head_w = touch["touch_head_3"]
+        self.behaviour_look_around = behaviours["look_around"]
+        self.behaviour_blush = behaviours["blush"]
         self.video_list = self.mw_server.get_video_list()
         self.sound_list = self.mw_server.get_sound_list()
         self.image_list = self.mw_server.get_image_list()
         self.icon_list = self.mw_server.get_icon_list()
+        self.volume = speakers["volume"]
+        self.multimedia_port = server["http_port"]
+        self.leds_stream_port = server["leds_stream_port"]
+        self.leds_stats = leds["stats"]
+        self.leds_stream_stats = leds["stream_stats"]
+        self.microphone_is_recording = microphone["is_recording"]
+        self.recognized_speech = onboard["speech"]
 
     def enable_look_around(self, control):
         self.mw_behaviours.look_around = bool(control)
@@ -165,8 +165,7 @@ class Robot:
         return True, "OK"
 
     def update_leds_icon(self, name):
-        url = self.mw_server.url_for_icon(name)
-        self.mw_leds.load_from_url(url)
+        self.mw_leds.set_icon(name)
         return True, "OK"
 
     def set_screen(self, image=None, video=None, text=None, url=None):
@@ -211,6 +210,16 @@ def status():
     return jsonify(robot.__dict__)
 
 
+@app.route("/history/<name>")
+def history(name):
+    try:
+        seconds = float(request.args.get("seconds", 60))
+        samples = mw.TimeSeries(name).window(seconds)
+        return jsonify({ "success": True, "samples": samples })
+    except Exception as e:
+        return jsonify({ "success": False, "message": str(e) })
+
+
 @app.route("/command", methods=["POST"])
 def command():
     try:
@@ -305,10 +314,86 @@ def quick_connect():
             pass
 
 
+def stream_leds():
+    """
+    Receive leds frames over udp, and write the latest one to the leds.
+    Packets that arrive together are coalesced, showing only the newest.
+    Packets older than the last one shown are discarded.
+    Large jumps of the sequence number, backward or forward, start a new stream.
+    """
+    mw_leds = mw.Leds()
+    mw_server = mw.Server()
+    size = STREAM_HEADER.size + 3 * mw_leds.number
+    restart_gap = max(1, int(STREAM_RESTART_TIME * mw_leds.max_fps))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("0.0.0.0", mw_server.leds_stream_port))
+    sender = None
+    last = None
+    stats = {"received": 0, "lost": 0, "late": 0, "skipped": 0}
+    shown = 0
+    last_stats = time.monotonic()
+    while True:
+        packets = []
+        try:
+            sock.settimeout(STREAM_STATS_PERIOD)
+            # one more byte than a frame, to detect larger packets
+            packets.append(sock.recvfrom(size + 1))
+            # drain the packets that are already queued
+            sock.setblocking(False)
+            while True:
+                packets.append(sock.recvfrom(size + 1))
+        except OSError:
+            # timed out, no more queued packets, or a network error
+            pass
+        latest = None
+        for data, addr in packets:
+            try:
+                if len(data) != size or data[:4] != STREAM_MAGIC:
+                    continue
+                _, seq, sent = STREAM_HEADER.unpack_from(data)
+                sock.sendto(STREAM_HEADER.pack(STREAM_ACK_MAGIC, seq, sent), addr)
+                stats["received"] += 1
+                ahead = (seq - last) % 2 ** 32 if last is not None else 1
+                if addr != sender or STREAM_RESTART_WINDOW < 2 ** 32 - ahead < 2 ** 31 or restart_gap < ahead < 2 ** 31:
+                    # a new sender, or a restarted one
+                    sender = addr
+                    ahead = 1
+                elif ahead == 0 or ahead >= 2 ** 31:
+                    stats["late"] += 1
+                    continue
+                stats["lost"] += ahead - 1
+                if latest is not None:
+                    stats["skipped"] += 1
+                latest = data
+                last = seq
+            except Exception as e:
+                # a bad packet must not stop the stream
+                print("Error reading leds stream packet: " + str(e))
+        if latest is not None:
+            try:
+                mw_leds.frame = np.frombuffer(latest, np.uint8, offset=STREAM_HEADER.size).reshape(-1, 3)
+                shown += 1
+            except Exception as e:
+                print("Error showing leds stream frame: " + str(e))
+        now = time.monotonic()
+        if now - last_stats >= STREAM_STATS_PERIOD:
+            stats["fps"] = round(shown / (now - last_stats), 1)
+            stats["sender"] = None if sender is None else "%s:%d" % sender
+            try:
+                mw_leds.stream_stats = stats
+            except Exception as e:
+                print("Error updating leds stream stats: " + str(e))
+            shown = 0
+            last_stats = now
+
+
 if __name__ == '__main__':
     udp_server_thread = threading.Thread(target=quick_connect)
     udp_server_thread.setDaemon(True)
     udp_server_thread.start()
+    leds_stream_thread = threading.Thread(target=stream_leds)
+    leds_stream_thread.setDaemon(True)
+    leds_stream_thread.start()
     server_thread = threading.Thread(target=lambda: app.run(host="0.0.0.0", port=SERVER_PORT))
     server_thread.setDaemon(True)
     server_thread.start()
@@ -48,7 +48,8 @@ class ElmoServer:
         grab_image(): Capture an image
         set_image(image_name): Set the image
         set_icon(icon_name): Set the icon
-        play_sound(sound): Play a sound
+        play_sound(sound, channel): Play a sound, on a channel of the speakers
+        preload_sounds(sounds): Decode sounds ahead of time on the robot
         close_all(): Close all connections
 
     """
@@ -402,14 +403,28 @@ class ElmoServer:
         """
         self.send_message(f"icon::{icon_name}")
 
-    def play_sound(self, sound):
+    def play_sound(self, sound, channel=None):
         """
         Plays the specified sound.
 
         Args:
             sound (str): The source name of the sound to be played.
+            channel (str): The channel of the speakers to play it on: "effects", "music" or "speech".
+                Sounds are played on the effects channel by default.
         """
-        self.send_message(f"sound::{sound}")
+        if channel is None:
+            self.send_message(f"sound::{sound}")
+        else:
+            self.send_message(f"sound::{sound}::{channel}")
+
+    def preload_sounds(self, sounds):
+        """
+        Asks the robot to decode sounds ahead of time, so that they play without delay.
+
+        Args:
+            sounds (list): The source names of the sounds to preload.
+        """
+        self.send_message(f"preload::{','.join(sounds)}")
 
     def close_all(self):
         """
@@ -12,6 +12,12 @@ transitions = ["alright", "checkpoint", "dont_blink", "feeling_inspired",
                 "one_emotion_down", "say_cheese", "showtime", "next_challenge", 
                 "lets_go", "surprise_me"]
 
+# Sounds played during the game, preloaded when it starts
+game_sounds = ([f"emotions/{emotion}.wav" for emotion in emotions]
+               + [f"transitions/{transition}.wav" for transition in transitions]
+               + ["first_emotion.wav", "picture.wav", "bad_feedback.wav", "good_effort.wav",
+                  "good_feedback.wav", "end_game_song.wav", "winner.wav"])
+
 # Load the Haar Cascade model
 face_classifier = cv2.CascadeClassifier(cv2.data.haarcascades + 
                                         "haarcascade_frontalface_default.xml")
@@ -496,6 +502,7 @@ class SimonSays:
         self.elmo.set_image("normal.png")
         self.elmo.set_icon("black.png")
         self.elmo.move_pan(0)  # Look in the middle
+        self.elmo.preload_sounds(game_sounds)
 
         time.sleep(2)
         
@@ -521,7 +528,7 @@ class SimonSays:
             self.elmo.set_image("normal.png")
             self.elmo.move_pan(0)  # Look in the middle
             self.elmo.set_icon("fireworks.gif")
-            self.elmo.play_sound("end_game_song.wav")
+            self.elmo.play_sound("end_game_song.wav", "music")
 
             time.sleep(3)
 
@@ -536,7 +543,7 @@ class SimonSays:
                 self.elmo.move_right()
 
             time.sleep(2)
-            self.elmo.play_sound("winner.wav") # Congrats winner
+            self.elmo.play_sound("winner.wav", "speech") # Congrats winner, over the song
             time.sleep(6)
             
             self.dynamic_conclusion() # Thanks players for playing
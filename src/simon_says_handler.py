@@ -32,12 +32,14 @@ def parse_message(message):
     command and value.
 
     Args:
-        message (str): The message to be parsed in the format "command::value".
+        message (str): The message to be parsed in the format "command::value",
+            or "sound::value::channel" to play a sound on a channel of the speakers.
     """
     splitMessage = message.split("::")
 
-    if len(splitMessage) != 2:
+    if len(splitMessage) not in (2, 3) or (len(splitMessage) == 3 and splitMessage[0] != "sound"):
         print("Invalid message")
+        return
 
     command = splitMessage[0]
     value = splitMessage[1]
@@ -64,12 +66,18 @@ def parse_message(message):
     elif command == "sound":
         sound_src = os.path.join(sound_path, f"{value}")
         sound_url = server.url_for_sound(sound_src)
-        speakers.url = sound_url
+        channel = splitMessage[2] if len(splitMessage) == 3 else "effects"
+        try:
+            speakers.play(sound_url, channel)
+        except ValueError as e:
+            print(e)
+
+    elif command == "preload":
+        speakers.preload([os.path.join(sound_path, name) for name in value.split(",") if name])
 
     elif command == "icon":
         icon_src = os.path.join(icon_path, f"{value}")
-        icon_url = server.url_for_icon(icon_src)
-        leds.load_from_url(icon_url)
+        leds.set_icon(icon_src)
 
     elif command == "game":
         if value == "off":
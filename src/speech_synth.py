@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+
+
+"""
+
+Speech synthesis.
+
+Synthesizers render text to PCM buffers, in the format of the audio engine (16 bit, stereo, 48 kHz).
+
+The espeak synthesizer runs offline, with the espeak-ng command, and is the default.
+The gtts synthesizer uses the Google Text-to-Speech API, through the gTTS library, and needs an internet connection.
+Its mp3 output is decoded by ffmpeg, through pipes.
+
+Rendered phrases are kept in a PhraseCache, as WAV files on the disk, keyed by synthesizer, language and text.
+
+"""
+
+
+import hashlib
+import os
+import subprocess
+import threading
+
+import numpy as np
+
+import audio_engine
+
+try:
+    from gtts import gTTS
+except ImportError:
+    gTTS = None
+
+
+class Synthesizer:
+
+    """
+    Synthesizer class.
+    Extend this class to define synthesizers, with a name used in the cache keys.
+    """
+
+    name = None
+
+    def synthesize(self, language, text):
+        """
+        Render text to a PCM buffer: an int16 array of shape (frames, CHANNELS), at RATE.
+        Raises RuntimeError if the text can not be rendered.
+        """
+        raise NotImplementedError
+
+
+class Espeak(Synthesizer):
+
+    """
+    Offline synthesizer, that runs espeak-ng and reads the WAV file it writes to its output.
+    """
+
+    name = "espeak"
+
+    def __init__(self, command="espeak-ng", speed=160):
+        self.command = command
+        self.speed = speed
+
+    def synthesize(self, language, text):
+        try:
+            result = subprocess.run(
+                [self.command, "--stdout", "-v", language, "-s", str(self.speed), text],
+                capture_output=True, check=True,
+            )
+            return audio_engine.decode_wav(result.stdout)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            raise RuntimeError(f"espeak failed: {e}")
+
+
+class Gtts(Synthesizer):
+
+    """
+    Online synthesizer, that uses the Google Text-to-Speech API.
+    """
+
+    name = "gtts"
+
+    def __init__(self, ffmpeg="ffmpeg"):
+        if gTTS is None:
+            raise ImportError("couldnt find gtts")
+        self.ffmpeg = ffmpeg
+
+    def synthesize(self, language, text):
+        mp3 = bytearray()
+        try:
+            for chunk in gTTS(text, lang=language).stream():
+                mp3 += chunk
+            result = subprocess.run(
+                [self.ffmpeg, "-loglevel", "error", "-i", "pipe:0",
+                 "-f", "s16le", "-ac", str(audio_engine.CHANNELS), "-ar", str(audio_engine.RATE), "pipe:1"],
+                input=bytes(mp3), capture_output=True, check=True,
+            )
+        except Exception as e:
+            raise RuntimeError(f"gtts failed: {e}")
+        pcm = np.frombuffer(result.stdout, "<i2")
+        pcm = pcm[:len(pcm) - len(pcm) % audio_engine.CHANNELS]
+        return pcm.reshape(-1, audio_engine.CHANNELS).astype(np.int16)
+
+
+SYNTHESIZERS = {
+    "espeak": Espeak,
+    "gtts": Gtts,
+}
+
+
+def create(name, **params):
+    """
+    Create the synthesizer called name.
+    Raises ValueError if it is unknown, and ImportError if it can not be used here.
+    """
+    if name not in SYNTHESIZERS:
+        raise ValueError(f"unknown synthesizer {name}")
+    return SYNTHESIZERS[name](**params)
+
+
+class PhraseCache:
+
+    """
+    PhraseCache class.
+    Cache of rendered phrases, kept as WAV files in a folder, so they survive restarts.
+    Files are named after a hash of the synthesizer, language and text,
+    and written atomically, so concurrent renders of a phrase do not clobber each other.
+    """
+
+    def __init__(self, path, synthesizer):
+        self.path = os.path.abspath(path)
+        self.synthesizer = synthesizer
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def path_for(self, language, text):
+        key = "\0".join((self.synthesizer.name, language, text)).encode("utf-8")
+        return os.path.join(self.path, f"{self.synthesizer.name}-{hashlib.sha1(key).hexdigest()}.wav")
+
+    def cached(self, language, text):
+        return os.path.exists(self.path_for(language, text))
+
+    def render(self, language, text):
+        """
+        Get the path of the WAV file of a phrase, rendering it if it is not cached.
+        Raises RuntimeError if the phrase can not be rendered.
+        """
+        path = self.path_for(language, text)
+        if os.path.exists(path):
+            with self.lock:
+                self.hits += 1
+            return path
+        with self.lock:
+            self.misses += 1
+        data = audio_engine.encode_wav(self.synthesizer.synthesize(language, text))
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+        return path
+
+    def stats(self):
+        return {
+            "phrases": sum(1 for name in os.listdir(self.path) if name.endswith(".wav")),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
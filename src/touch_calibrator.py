@@ -26,6 +26,7 @@ import middleware as mw
 
 
 WINDOW_SIZE = 100
+RAW_FIELDS = ("chest_raw", "head_0_raw", "head_1_raw", "head_2_raw", "head_3_raw")
 
 
 class TouchCalibrator:
@@ -39,6 +40,7 @@ class TouchCalibrator:
             "head_3": [],
         }
         self.touch_sensors = mw.TouchSensors()
+        self.touch_sensors.write_behind()
         self.node = mw.Node("touch_calibrator")
 
     def run(self):
@@ -51,11 +53,12 @@ class TouchCalibrator:
             self.node.loginfo("calibrating")
             while not self.node.is_shutdown(): 
                 time.sleep(0.1)
-                chest_raw = self.touch_sensors.chest_raw
-                head_0_raw = self.touch_sensors.head_0_raw
-                head_1_raw = self.touch_sensors.head_1_raw
-                head_2_raw = self.touch_sensors.head_2_raw
-                head_3_raw = self.touch_sensors.head_3_raw
+                raw = self.touch_sensors.snapshot(*RAW_FIELDS)
+                chest_raw = raw["chest_raw"]
+                head_0_raw = raw["head_0_raw"]
+                head_1_raw = raw["head_1_raw"]
+                head_2_raw = raw["head_2_raw"]
+                head_3_raw = raw["head_3_raw"]
                 self.windows["chest"].append(chest_raw)
                 self.windows["head_0"].append(head_0_raw)
                 self.windows["head_1"].append(head_1_raw)
@@ -67,11 +70,12 @@ class TouchCalibrator:
             while not self.node.is_shutdown():
                 time.sleep(0.1)
                 # get values
-                chest_raw = self.touch_sensors.chest_raw
-                head_0_raw = self.touch_sensors.head_0_raw
-                head_1_raw = self.touch_sensors.head_1_raw
-                head_2_raw = self.touch_sensors.head_2_raw
-                head_3_raw = self.touch_sensors.head_3_raw
+                raw = self.touch_sensors.snapshot(*RAW_FIELDS, "sensitivity")
+                chest_raw = raw["chest_raw"]
+                head_0_raw = raw["head_0_raw"]
+                head_1_raw = raw["head_1_raw"]
+                head_2_raw = raw["head_2_raw"]
+                head_3_raw = raw["head_3_raw"]
                 # add to buffers
                 self.windows["chest"].append(chest_raw)
                 self.windows["head_0"].append(head_0_raw)
@@ -85,7 +89,7 @@ class TouchCalibrator:
                 self.windows["head_2"] = self.windows["head_2"][-WINDOW_SIZE:]
                 self.windows["head_3"] = self.windows["head_3"][-WINDOW_SIZE:]
                 # calculate bounds
-                sensitivity = self.touch_sensors.sensitivity
+                sensitivity = raw["sensitivity"]
                 chest_mean = np.mean(self.windows["chest"])
                 chest_upper, chest_lower = chest_mean + sensitivity, chest_mean - sensitivity
                 head_0_mean = np.mean(self.windows["head_0"])
@@ -113,7 +117,10 @@ class TouchCalibrator:
                 self.touch_sensors.touch_head_1 = touch_head_1
                 self.touch_sensors.touch_head_2 = touch_head_2
                 self.touch_sensors.touch_head_3 = touch_head_3
+                self.touch_sensors.flush()
         finally:
+            # send the writes buffered when the loop stopped
+            self.touch_sensors.flush()
             self.node.shutdown()
 
 
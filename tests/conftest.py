@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# nodes are modules of src, run from that folder
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ["MIDDLEWARE_URL"] = "memory://"
+
+import middleware as mw
+from middleware_backends import MemoryBackend
+
+
+@pytest.fixture(autouse=True)
+def backend():
+    """
+    Run each test on an empty MemoryBackend.
+    """
+    backend = MemoryBackend()
+    mw.set_backend(backend)
+    yield backend
+    mw.cache.close()
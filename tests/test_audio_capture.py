@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pytest
+
+import audio_capture
+from audio_capture import AudioRing, RingReader, VoiceDetector
+
+
+FRAME_SAMPLES = 8
+
+
+@pytest.fixture
+def ring():
+    ring = AudioRing.create("test_ring_%d" % os.getpid(), frames=4, frame_samples=FRAME_SAMPLES)
+    yield ring
+    ring.close()
+
+
+def write(ring, first, count):
+    for n in range(first, first + count):
+        ring.write(np.full(FRAME_SAMPLES, n, np.int16), float(n), -20.0, n % 2 == 0)
+
+
+def test_ring_read(ring):
+    write(ring, 0, 3)
+    start, (samples, times, levels, voice) = ring.read(0)
+    assert start == 0
+    assert samples[:, 0].tolist() == [0, 1, 2]
+    assert times.tolist() == [0.0, 1.0, 2.0]
+    assert levels.tolist() == [-20.0] * 3
+    assert voice.tolist() == [True, False, True]
+
+
+def test_ring_wraps(ring):
+    write(ring, 0, 10)
+    assert ring.written() == 10
+    start, (samples, times, _, _) = ring.read(0)
+    # the oldest slot is kept free for the frame being written
+    assert start == 7
+    assert samples[:, 0].tolist() == [7, 8, 9]
+    assert times.tolist() == [7.0, 8.0, 9.0]
+
+
+def test_ring_read_count(ring):
+    write(ring, 0, 3)
+    start, (samples, _, _, _) = ring.read(1, count=1)
+    assert start == 1
+    assert samples[:, 0].tolist() == [1]
+
+
+def test_reader_reads_new_frames(ring):
+    write(ring, 0, 2)
+    reader = RingReader(ring)
+    samples, _, _, _ = reader.read(0.0)
+    assert len(samples) == 0
+    write(ring, 2, 2)
+    samples, _, _, _ = reader.read(0.0)
+    assert samples[:, 0].tolist() == [2, 3]
+    assert reader.dropped == 0
+
+
+def test_reader_drops_overwritten_frames(ring):
+    reader = RingReader(ring)
+    write(ring, 0, 10)
+    samples, _, _, _ = reader.read(0.0)
+    assert samples[:, 0].tolist() == [7, 8, 9]
+    assert reader.dropped == 7
+    write(ring, 10, 1)
+    samples, _, _, _ = reader.read(0.0)
+    assert samples[:, 0].tolist() == [10]
+    assert reader.dropped == 7
+
+
+def test_create_replaces_a_stale_ring():
+    name = "test_ring_%d" % os.getpid()
+    stale = AudioRing.create(name, frames=4, frame_samples=FRAME_SAMPLES)
+    write(stale, 0, 2)
+    ring = AudioRing.create(name, frames=4, frame_samples=FRAME_SAMPLES)
+    assert ring.written() == 0
+    # unlinked by create
+    stale.owner = False
+    stale.close()
+    ring.close()
+
+
+def test_frame_level():
+    assert audio_capture.frame_level(np.zeros(320, np.int16)) == audio_capture.SILENCE_DB
+    assert audio_capture.frame_level(np.full(320, 32767, np.int16)) == pytest.approx(0.0, abs=0.01)
+    assert audio_capture.frame_level(np.full(320, 3277, np.int16)) == pytest.approx(-20.0, abs=0.01)
+
+
+def test_voice_detector():
+    detector = VoiceDetector(threshold=10.0, minimum=-50.0, hangover=2)
+    assert not any(detector.update(-60.0) for _ in range(10))
+    assert detector.update(-30.0)
+    # the hangover bridges pauses
+    assert detector.update(-60.0)
+    assert not detector.update(-60.0)
+    assert detector.floor == pytest.approx(-60.0, abs=0.5)
+
+
+def test_voice_detector_ignores_quiet_rooms():
+    detector = VoiceDetector(threshold=10.0, minimum=-50.0)
+    detector.update(-90.0)
+    assert not detector.update(-60.0)
@@ -0,0 +1,186 @@
+import struct
+
+import numpy as np
+import pytest
+
+import audio_engine
+from audio_engine import AudioEngine, NullSink
+
+
+def wav(samples, bits, rate=audio_engine.RATE, channels=1, extensible=False, encoding=audio_engine.WAVE_FORMAT_PCM):
+    """
+    WAV file of samples, already encoded with bits per sample.
+    """
+    width = bits // 8
+    if extensible:
+        # the sub format guid starts with the format
+        fmt = struct.pack(
+            "<HHIIHHHHIH14s", audio_engine.WAVE_FORMAT_EXTENSIBLE, channels, rate, rate * channels * width,
+            channels * width, bits, 22, bits, 0, encoding, b"\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71",
+        )
+    else:
+        fmt = struct.pack("<HHIIHH", encoding, channels, rate, rate * channels * width, channels * width, bits)
+    chunks = b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"data" + struct.pack("<I", len(samples)) + samples
+    return b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks
+
+
+PCM = np.array([0, 256, -256, 32767, -32768], np.int16)
+
+
+def encode(bits):
+    if bits == 8:
+        return ((PCM.astype(np.int32) >> 8) + 128).astype(np.uint8).tobytes()
+    if bits == 16:
+        return PCM.astype("<i2").tobytes()
+    if bits == 24:
+        return b"".join(struct.pack("<i", int(s) << 8)[:3] for s in PCM)
+    return (PCM.astype("<i4") << 16).tobytes()
+
+
+@pytest.mark.parametrize("bits", [8, 16, 24, 32])
+def test_decode_wav_integer_samples(bits):
+    sound = audio_engine.decode_wav(wav(encode(bits), bits))
+    assert sound.shape == (len(PCM), audio_engine.CHANNELS)
+    # 8 bit samples keep the most significant byte
+    expected = PCM & ~0xFF if bits == 8 else PCM
+    assert np.array_equal(sound[:, 0], expected)
+
+
+def test_decode_wav_float_samples():
+    data = (PCM / 32767.0).astype("<f4").tobytes()
+    sound = audio_engine.decode_wav(wav(data, 32, encoding=audio_engine.WAVE_FORMAT_IEEE_FLOAT))
+    assert np.abs(sound[:, 0].astype(int) - PCM).max() <= 1
+
+
+@pytest.mark.parametrize("bits", [16, 24])
+def test_decode_wav_extensible(bits):
+    sound = audio_engine.decode_wav(wav(encode(bits), bits, extensible=True))
+    assert np.array_equal(sound[:, 0], PCM)
+
+
+def test_decode_wav_copies_mono_to_every_channel():
+    sound = audio_engine.decode_wav(wav(encode(16), 16))
+    assert np.array_equal(sound[:, 0], sound[:, 1])
+
+
+def test_decode_wav_to_a_rate_and_channels():
+    sound = audio_engine.decode_wav(wav(encode(16), 16), channels=1)
+    assert sound.shape == (len(PCM), 1)
+    assert np.array_equal(sound[:, 0], PCM)
+    samples = np.zeros(4800, np.int16).tobytes()
+    assert audio_engine.decode_wav(wav(samples, 16), rate=16000, channels=1).shape == (1600, 1)
+
+
+def test_decode_wav_resamples():
+    samples = np.zeros(1600, np.int16).tobytes()
+    sound = audio_engine.decode_wav(wav(samples, 16, rate=16000))
+    assert len(sound) == 4800
+
+
+def test_decode_wav_rejects_other_files():
+    with pytest.raises(ValueError):
+        audio_engine.decode_wav(b"not a wav file")
+    with pytest.raises(ValueError):
+        audio_engine.decode_wav(wav(encode(16), 16, encoding=2))
+
+
+def test_encode_wav_round_trip():
+    sound = np.arange(-100, 100, dtype=np.int16).reshape(-1, audio_engine.CHANNELS)
+    assert np.array_equal(audio_engine.decode_wav(audio_engine.encode_wav(sound)), sound)
+
+
+def test_volume_gain():
+    assert audio_engine.volume_gain(0) == 0.0
+    assert audio_engine.volume_gain(100) == 1.0
+    assert audio_engine.volume_gain(50) == pytest.approx(0.1)
+
+
+def test_normalization_gain_does_not_clip():
+    sound = np.full((100, 2), 500, np.int16)
+    assert audio_engine.normalization_gain(sound) == pytest.approx(audio_engine.MAX_NORMALIZE_GAIN)
+    sound[0] = 32000
+    assert audio_engine.normalization_gain(sound) <= 32767 / 32000
+
+
+@pytest.fixture
+def engine():
+    """
+    An engine whose blocks are mixed by the test, with next_block.
+    """
+    engine = AudioEngine(NullSink())
+    engine.close()
+    return engine
+
+
+def constant(value, blocks, block=audio_engine.BLOCK_FRAMES):
+    return np.full((blocks * block, audio_engine.CHANNELS), value, np.int16)
+
+
+def test_mixer_events(engine):
+    engine.play(constant(100, 2), "sound")
+    assert engine.playing() == "sound"
+    block, events = engine.next_block()
+    assert events == [("start", "effects", "sound", 0)]
+    block, events = engine.next_block()
+    assert events == [("finish", "effects", "sound", audio_engine.BLOCK_FRAMES)]
+    assert engine.playing() is None
+    block, events = engine.next_block()
+    assert events == []
+    assert not block.any()
+
+
+def test_mixer_stop_and_replace(engine):
+    engine.play(constant(100, 4), "first", "music")
+    engine.next_block()
+    engine.play(constant(100, 4), "second", "music")
+    _, events = engine.next_block()
+    assert events == [("stop", "music", "first", 0), ("start", "music", "second", 0)]
+    engine.stop()
+    _, events = engine.next_block()
+    assert events == [("stop", "music", "second", 0)]
+
+
+def test_mixer_sums_channels(engine):
+    # levels have ramped to their gains after RAMP_TIME
+    for _ in range(int(audio_engine.RAMP_TIME * audio_engine.RATE / audio_engine.BLOCK_FRAMES) + 1):
+        engine.next_block()
+    engine.ducking = {}
+    engine.play(constant(100, 2), "a", "effects")
+    engine.play(constant(200, 2), "b", "speech", gain=2.0)
+    block, _ = engine.next_block()
+    assert np.all(block == 500)
+
+
+def test_mixer_ramps_gains(engine):
+    engine.set_gain("effects", 0.0)
+    for _ in range(50):
+        engine.next_block()
+    engine.set_gain("effects", 1.0)
+    engine.play(constant(1000, 40), "sound")
+    block, _ = engine.next_block()
+    # no click: the level ramps up along the block
+    assert block[0, 0] == 0
+    assert 0 < block[-1, 0] < 1000
+    assert np.all(np.diff(block[:, 0].astype(int)) >= 0)
+
+
+def test_mixer_ducks_music(engine):
+    engine.play(constant(1000, 100), "music", "music")
+    engine.play(constant(0, 100), "effect", "effects")
+    for _ in range(50):
+        block, _ = engine.next_block()
+    assert block[0, 0] == pytest.approx(1000 * audio_engine.DUCK_GAIN, abs=1)
+
+
+def test_mixer_volume_and_clipping(engine):
+    engine.set_volume(0.5)
+    engine.play(constant(30000, 100), "a", "effects")
+    engine.play(constant(30000, 100), "b", "speech")
+    engine.ducking = {}
+    for _ in range(50):
+        block, _ = engine.next_block()
+    assert block[0, 0] == 30000
+    engine.set_volume(1.0)
+    for _ in range(50):
+        block, _ = engine.next_block()
+    assert block[0, 0] == 32767
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+import keyword_spotting
+from keyword_spotting import KeywordSpotter, Segmenter, dtw_distance, mfcc
+
+
+def tone(frequencies, seconds=0.4, rate=keyword_spotting.RATE):
+    """
+    int16 samples of a sequence of tones, standing for the sounds of a word.
+    """
+    t = np.arange(int(seconds * rate / len(frequencies))) / rate
+    return np.concatenate([(8000 * np.sin(2 * np.pi * f * t)).astype(np.int16) for f in frequencies])
+
+
+def test_mfcc_shape():
+    features = mfcc(tone([440]))
+    frames = 1 + (len(tone([440])) - keyword_spotting.WINDOW) // keyword_spotting.HOP
+    assert features.shape == (frames, 2 * keyword_spotting.CEPSTRA)
+    # cepstral mean normalization
+    assert np.allclose(features[:, :keyword_spotting.CEPSTRA].mean(axis=0), 0.0, atol=1e-6)
+
+
+def test_mfcc_of_a_short_utterance():
+    assert mfcc(np.zeros(100, np.int16)).shape == (1, 2 * keyword_spotting.CEPSTRA)
+
+
+def test_dtw_identical_features():
+    features = np.random.default_rng(0).normal(size=(30, 4))
+    assert dtw_distance(features, features) == pytest.approx(0.0, abs=1e-6)
+
+
+def test_dtw_shifted_features():
+    rng = np.random.default_rng(0)
+    template = rng.normal(size=(20, 4))
+    # the word within silence, shifted in the utterance
+    shifted = np.vstack((np.zeros((7, 4)), template, np.zeros((5, 4))))
+    other = rng.normal(size=(32, 4))
+    assert dtw_distance(shifted, template) == pytest.approx(0.0, abs=1e-6)
+    assert dtw_distance(other, template) > 1.0
+
+
+def test_dtw_warped_features():
+    rng = np.random.default_rng(0)
+    template = rng.normal(size=(20, 4))
+    # spoken slower, each frame twice
+    slow = np.repeat(template, 2, axis=0)
+    assert dtw_distance(slow, template) == pytest.approx(0.0, abs=1e-6)
+
+
+def test_spotter():
+    words = {"low": [300, 500], "high": [2000, 1500]}
+    spotter = KeywordSpotter(list(words), threshold=24.0)
+    for word, frequencies in words.items():
+        spotter.add(word, tone(frequencies))
+    word, distances = spotter.spot(tone([300, 500], seconds=0.5))
+    assert word == "low"
+    assert distances["low"] < distances["high"]
+    spotter.threshold = 0.0
+    assert spotter.spot(tone([300, 500], seconds=0.5))[0] is None
+
+
+def test_spotter_without_templates():
+    spotter = KeywordSpotter(["yes"])
+    assert spotter.spot(tone([440])) == (None, {})
+
+
+def test_spotter_load(tmp_path):
+    assert KeywordSpotter(["yes"]).load(str(tmp_path)) == ["yes"]
+
+
+def frames(count, value=0):
+    return [np.full(keyword_spotting.audio_capture.FRAME_SAMPLES, value, np.int16) for _ in range(count)]
+
+
+def test_segmenter():
+    segmenter = Segmenter(pre_roll=2, max_frames=100, min_frames=3)
+    pushed = [segmenter.push(f, i, False) for i, f in enumerate(frames(5, 1))]
+    pushed += [segmenter.push(f, 5 + i, True) for i, f in enumerate(frames(4, 2))]
+    assert pushed == [None] * 9
+    samples, t = segmenter.push(frames(1, 3)[0], 9, False)
+    assert t == 9
+    # pre roll, voice, and the frame where voice ended
+    assert len(samples) == 7 * keyword_spotting.audio_capture.FRAME_SAMPLES
+    assert samples[0] == 1 and samples[-1] == 3
+
+
+def test_segmenter_ignores_short_utterances():
+    segmenter = Segmenter(pre_roll=2, max_frames=100, min_frames=3)
+    segmenter.push(frames(1)[0], 0, True)
+    assert segmenter.push(frames(1)[0], 1, False) is None
+
+
+def test_segmenter_cuts_long_utterances():
+    segmenter = Segmenter(pre_roll=0, max_frames=4, min_frames=1)
+    results = [segmenter.push(f, i, True) for i, f in enumerate(frames(4))]
+    assert results[:3] == [None] * 3
+    assert len(results[3][0]) == 4 * keyword_spotting.audio_capture.FRAME_SAMPLES
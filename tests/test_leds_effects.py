@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import leds_effects
+from middleware import ICON_SIZE
+
+
+SHOWN = np.zeros((ICON_SIZE * ICON_SIZE, 3))
+
+
+def no_icons(name):
+    raise KeyError(name)
+
+
+@pytest.mark.parametrize("params", [
+    {"name": "crossfade", "duration": 0},
+    {"name": "wipe", "duration": -1.0},
+    {"name": "pulse", "period": 0},
+    {"name": "pulse", "duration": 0},
+    {"name": "scroll", "text": "hi", "speed": 0},
+    {"name": "scroll", "text": "hi", "loops": -1},
+    {"name": "sparkle", "fade": 0},
+    {"name": "sparkle", "duration": float("nan")},
+    {"name": "pulse", "period": "fast"},
+    {"name": "blink"},
+])
+def test_create_rejects_bad_parameters(params):
+    with pytest.raises(ValueError):
+        leds_effects.create(params, SHOWN, no_icons, 0.0)
+
+
+def test_pulse():
+    pulse = leds_effects.create({"name": "pulse", "color": [200, 0, 0], "period": 2.0}, SHOWN, no_icons, 0.0)
+    assert np.allclose(pulse.render(0.0), 0.0)
+    assert np.allclose(pulse.render(1.0), [200, 0, 0])
+
+
+def test_crossfade():
+    fade = leds_effects.create({"name": "crossfade", "color": [100, 100, 100], "duration": 1.0}, SHOWN, no_icons, 0.0)
+    assert np.allclose(fade.render(0.5), 50.0)
+    assert fade.done(1.0)
+
+
+def test_scroll_ends_blank():
+    scroll = leds_effects.create({"name": "scroll", "text": "hi", "speed": 100.0}, SHOWN, no_icons, 0.0)
+    assert scroll.render(0.05).any()
+    assert scroll.done(10.0)
+    assert not scroll.render(10.0).any()
+
+
+def test_sparkle_fades_out():
+    sparkle = leds_effects.create({"name": "sparkle", "density": 1.0, "duration": 1.0}, SHOWN, no_icons, 0.0)
+    assert sparkle.render(0.5).any()
+    assert not sparkle.render(1.0).any()
@@ -0,0 +1,289 @@
+import time
+
+import numpy as np
+import pytest
+
+import middleware as mw
+from middleware import DBEntry, Field
+
+
+class Sample(DBEntry):
+    prefix = "test"
+    fields = {
+        "name": "robot",
+        "level": Field(5, int, 0, 10),
+        "angle": Field(0.0, float, "min_angle", "max_angle"),
+        "min_angle": -40,
+        "max_angle": 40,
+        "colors": [],
+        "series": Field(0, history=10),
+        "limit": 3,
+    }
+    cached = ("limit",)
+    codecs = {"colors": "rgb8"}
+
+
+@pytest.mark.parametrize("codec, value", [
+    ("rgb8", [[0, 128, 255], [1, 2, 3]]),
+    (None, {"text": "hello", "list": [1, 2.5, None, True]}),
+])
+def test_codec_round_trip(codec, value):
+    data = mw.encode_value(value, codec)
+    assert mw.decode_value(data) == value
+    if codec is not None:
+        assert data.startswith(mw.CODEC_MARKER + codec.encode())
+
+
+def test_frame_codec_round_trip():
+    frame = np.arange(12, dtype=np.uint8).reshape(4, 3)
+    decoded = mw.decode_value(mw.encode_value(frame, "frame"))
+    assert np.array_equal(decoded, frame)
+
+
+def test_animation_codec_round_trip():
+    frames = np.random.default_rng(0).integers(0, 256, (3, 5, 3), dtype=np.uint8)
+    animation = {"mode": "loop", "durations": [0.1, 0.2, 0.3], "frames": frames}
+    decoded = mw.decode_value(mw.encode_value(animation, "animation"))
+    assert decoded["mode"] == "loop"
+    assert decoded["durations"] == [0.1, 0.2, 0.3]
+    assert np.array_equal(decoded["frames"], frames)
+
+
+def test_codec_falls_back_to_json():
+    # not a list of colors
+    data = mw.encode_value("off", "rgb8")
+    assert isinstance(data, str)
+    assert mw.decode_value(data) == "off"
+
+
+def test_field_default():
+    sample = Sample()
+    assert sample.name == "robot"
+    assert sample.colors == []
+
+
+def test_field_validation():
+    sample = Sample()
+    sample.level = "7"
+    assert sample.level == 7
+    sample.level = 20
+    assert sample.level == 10
+    sample.level = -1
+    assert sample.level == 0
+    sample.level = None
+    assert sample.level is None
+
+
+def test_field_limits_from_other_fields():
+    sample = Sample()
+    sample.angle = 90
+    assert sample.angle == 40.0
+    sample.max_angle = 20
+    sample.angle = 90
+    assert sample.angle == 20.0
+
+
+def test_field_codec():
+    sample = Sample()
+    sample.colors = [[1, 2, 3]]
+    assert mw.connection.get("test_colors").startswith(mw.CODEC_MARKER)
+    assert sample.colors == [[1, 2, 3]]
+
+
+def test_set_many_and_get_many():
+    mw.set_many({"test_a": 1, "test_b": [[1, 2, 3]]}, codecs={"test_b": "rgb8"})
+    assert mw.connection.get("test_b").startswith(mw.CODEC_MARKER)
+    assert mw.get_many(["test_a", "test_b", "test_c"], defaults={"test_c": "x"}) == {"test_a": 1, "test_b": [[1, 2, 3]], "test_c": "x"}
+    assert mw.get_key("test_c") == "x"
+    assert mw.get_many(["test_d"]) == {"test_d": None}
+
+
+def test_set_many_if():
+    mw.set_key("test_url", "a")
+    assert not mw.set_many_if("test_url", "b", {"test_url": None})
+    assert mw.set_many_if("test_url", "a", {"test_url": None, "test_finished": 1.0})
+    assert mw.get_many(["test_url", "test_finished"]) == {"test_url": None, "test_finished": 1.0}
+
+
+def test_read_many():
+    sample = Sample()
+    sample.level = 2
+    values, = mw.read_many((sample, "name", "level"))
+    assert values == {"name": "robot", "level": 2}
+
+
+def test_snapshot():
+    sample = Sample()
+    assert sample.snapshot("name", "level") == {"name": "robot", "level": 5}
+    assert sample.snapshot()["colors"] == []
+
+
+def test_cache_hits():
+    sample = Sample()
+    assert sample.limit == 3
+    hits = mw.cache.stats()["hits"]
+    assert sample.limit == 3
+    assert mw.cache.stats()["hits"] == hits + 1
+
+
+def test_cache_is_invalidated_by_writes_of_other_nodes():
+    sample = Sample()
+    assert sample.limit == 3
+    # written without the entry, as another process would
+    mw.set_key("test_limit", 4)
+    deadline = time.monotonic() + 1.0
+    while sample.limit != 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sample.limit == 4
+
+
+def test_cache_discards_values_read_before_a_change():
+    version = mw.cache.version("test_key")
+    mw.cache.invalidate("test_key")
+    mw.cache.store("test_key", "stale", version)
+    assert mw.cache.lookup("test_key") == (False, None)
+
+
+def test_watcher_fires_on_set_key():
+    watcher = mw.Watcher()
+    watcher.add("test_key", "name")
+    assert watcher.wait(0.01) == set()
+    mw.set_key("test_key", 1)
+    assert watcher.wait(1.0) == {"name"}
+    watcher.close()
+
+
+def test_watcher_of_entry_fields():
+    sample = Sample()
+    watcher = sample.watch("name", "level")
+    sample.name = "elmo"
+    sample.level = 1
+    mw.set_key("test_other", 2)
+    assert watcher.wait(1.0) == {"name", "level"}
+    watcher.close()
+
+
+def test_write_behind():
+    sample = Sample()
+    sample.level = 1
+    sample.write_behind()
+    sample.level = 2
+    sample.level = 3
+    assert sample.level == 3
+    assert mw.get_key("test_level") == 1
+    sample.flush()
+    assert mw.get_key("test_level") == 3
+    sample.write_through()
+    sample.level = 4
+    assert mw.get_key("test_level") == 4
+
+
+def test_update():
+    sample = Sample()
+    assert sample.limit == 3
+    sample.update({"level": 20, "colors": [[1, 2, 3]], "series": 1, "limit": 5})
+    assert mw.get_key("test_level") == 10
+    assert mw.connection.get("test_colors").startswith(mw.CODEC_MARKER)
+    assert [v for _, v in sample.history("series").latest()] == [1]
+    assert sample.limit == 5
+
+
+def test_update_if():
+    sample = Sample()
+    sample.name = "a"
+    assert not sample.update_if("name", "b", {"name": None, "level": 1})
+    assert sample.snapshot("name", "level") == {"name": "a", "level": 5}
+    assert sample.update_if("name", "a", {"name": None, "level": 20})
+    assert sample.snapshot("name", "level") == {"name": None, "level": 10}
+
+
+def test_update_in_write_behind_mode():
+    sample = Sample()
+    sample.level = 1
+    sample.write_behind()
+    sample.update({"level": 2})
+    assert mw.get_key("test_level") == 1
+    sample.write_through()
+    assert mw.get_key("test_level") == 2
+
+
+def test_field_history():
+    sample = Sample()
+    for i in range(3):
+        sample.series = i
+    assert [v for _, v in sample.history("series").latest(2)] == [1, 2]
+    assert sample.history("name") is None
+
+
+def test_time_series():
+    series = mw.TimeSeries("test", maxlen=5)
+    assert series.latest() == []
+    assert series.tail(0.01) == []
+    start = time.time()
+    for i in range(8):
+        series.append(i)
+    assert [v for _, v in series.latest(3)] == [5, 6, 7]
+    assert [v for _, v in series.range()] == [3, 4, 5, 6, 7]
+    assert [v for _, v in series.window(10.0)] == [3, 4, 5, 6, 7]
+    assert all(t >= start - 0.001 for t, _ in series.range())
+    assert [v for _, v in series.tail(0.01)] == [3, 4, 5, 6, 7]
+    series.append(8)
+    assert [v for _, v in series.tail(0.01)] == [8]
+    assert series.tail(0.01) == []
+
+
+def test_write_behind_with_an_interval_is_idempotent():
+    sample = Sample()
+    sample.level = 1
+    sample.write_behind(0.01)
+    flusher = sample.flusher
+    sample.write_behind(0.02)
+    assert sample.flusher is flusher
+    assert sample.flush_interval == 0.02
+    sample.level = 2
+    deadline = time.monotonic() + 1.0
+    while mw.get_key("test_level") != 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert mw.get_key("test_level") == 2
+    sample.write_through()
+    flusher.join(1.0)
+    assert not flusher.is_alive()
+    assert sample.flusher is None
+
+
+def test_collect_changes_skips_time_series(backend):
+    subscription = backend.subscribe()
+    subscription.add_pattern("test_*")
+    subscription.add_pattern(mw.SERIES_PREFIX + "*")
+    sample = Sample()
+    sample.series = 1
+    mw.set_key("test_key", 1)
+    assert mw.collect_changes(subscription, rate=100.0) == {"test_series", "test_key"}
+    mw.TimeSeries("test").append(1)
+    assert mw.collect_changes(subscription, rate=100.0, timeout=0.01) == set()
+    subscription.close()
+
+
+def test_node_status():
+    node = mw.Node("test_node")
+    manager = mw.NodeManager()
+    watcher = node.watch(Sample(), "level")
+    node.is_shutdown()
+    node.beat()
+    assert manager.status("test_node") == "running"
+    # blocked on its watcher, as an idle node is
+    node.last_iteration = time.time() - 10.0
+    node.waiting = True
+    node.beat()
+    assert manager.status("test_node") == "running"
+    assert watcher.wait(0.01) == set()
+    assert not node.waiting
+    node.beat()
+    assert manager.status("test_node") == "running"
+    # hung after waking up
+    node.last_wake = time.time() - mw.STALL_TIMEOUT - 0.1
+    node.beat()
+    assert manager.status("test_node") == "stalled"
+    watcher.close()
+    node.shutdown()
+    assert manager.status("test_node") == "dead"
@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+from middleware_backends import Backend, MemoryBackend, SubscriptionClosed
+
+
+def test_backend_is_an_interface():
+    with pytest.raises(NotImplementedError):
+        Backend().get("key")
+
+
+def test_set_and_get(backend):
+    backend.set("key", "value")
+    assert backend.get("key") == b"value"
+    assert backend.get("missing") is None
+
+
+def test_set_nx_keeps_the_value(backend):
+    backend.set("key", b"first")
+    backend.set("key", b"second", nx=True)
+    assert backend.get("key") == b"first"
+
+
+def test_ttl_expires(backend):
+    backend.set("key", b"value", ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get("key") is None
+    assert not backend.exists("key")
+
+
+def test_mset_and_mget(backend):
+    backend.mset({"a": b"1", "b": b"2"})
+    assert backend.mget(["a", "b", "c"]) == [b"1", b"2", None]
+
+
+def test_set_missing(backend):
+    backend.set("a", b"1")
+    backend.set_missing({"a": b"x", "b": b"2"})
+    assert backend.mget(["a", "b"]) == [b"1", b"2"]
+
+
+def test_mset_if(backend):
+    backend.set("url", b"a")
+    assert not backend.mset_if("url", b"b", {"url": b"c"})
+    assert backend.get("url") == b"a"
+    assert backend.mset_if("url", b"a", {"url": b"c", "other": b"d"})
+    assert backend.mget(["url", "other"]) == [b"c", b"d"]
+
+
+def test_delete_and_keys(backend):
+    backend.mset({"a_1": b"1", "a_2": b"2", "b_1": b"3"})
+    assert sorted(backend.keys("a_*")) == [b"a_1", b"a_2"]
+    backend.delete("a_1", "missing")
+    assert sorted(backend.scan("a_*")) == [b"a_2"]
+    assert backend.exists("a_2") and not backend.exists("a_1")
+    backend.flushall()
+    assert backend.keys() == []
+
+
+def test_subscription_is_notified(backend):
+    subscription = backend.subscribe()
+    subscription.add("key")
+    subscription.add_pattern("prefix_*")
+    backend.set("other", b"1")
+    backend.set("key", b"1")
+    backend.mset({"prefix_a": b"1"})
+    backend.delete("key")
+    assert [subscription.get(0) for _ in range(4)] == ["key", "prefix_a", "key", None]
+    subscription.close()
+
+
+def test_closed_subscription_raises(backend):
+    subscription = backend.subscribe()
+    subscription.add("key")
+    subscription.close()
+    with pytest.raises(SubscriptionClosed):
+        subscription.get(1.0)
+
+
+def test_stream_is_bounded(backend):
+    ids = [backend.stream_append("stream", str(i), maxlen=3) for i in range(5)]
+    assert ids == sorted(ids)
+    assert [v for _, v in backend.stream_range("stream")] == [b"2", b"3", b"4"]
+    assert [v for _, v in backend.stream_range("stream", count=2)] == [b"2", b"3"]
+    assert [v for _, v in backend.stream_revrange("stream", 2)] == [b"4", b"3"]
+    assert backend.stream_revrange("missing", 2) == []
+
+
+def test_stream_read_waits_for_entries(backend):
+    after = backend.stream_append("stream", b"1", maxlen=10)
+    assert backend.stream_read("stream", after, 0.01) == []
+    backend.stream_append("stream", b"2", maxlen=10)
+    assert [v for _, v in backend.stream_read("stream", after, 0.01)] == [b"2"]
+
+
+def test_stream_append_many(backend):
+    backend.stream_append_many({"a": b"1", "b": b"2"}, maxlen=10)
+    assert [v for _, v in backend.stream_range("a")] == [b"1"]
+    assert [v for _, v in backend.stream_range("b")] == [b"2"]
+
+
+def test_backends_are_independent():
+    first, second = MemoryBackend(), MemoryBackend()
+    first.set("key", b"1")
+    assert second.get("key") is None